@@ -0,0 +1,10 @@
+import { auth } from "@/firebaseConfig";
+
+// The backend's admin routes (record deletes and edits, the change feed)
+// check the signed-in user's Firebase ID token and their role in "users".
+// getIdToken() returns the cached token and refreshes it when it expires.
+export const authHeaders = async (): Promise<Record<string, string>> => {
+  const user = auth.currentUser;
+  if (!user) return {};
+  return { Authorization: `Bearer ${await user.getIdToken()}` };
+};
@@ -0,0 +1,182 @@
+import React, { useState, useEffect, useRef } from "react";
+import styles from "@/styles/XRay.module.css";
+
+interface TiledImage {
+  index: number;
+  width: number;
+  height: number;
+  tileSize: number;
+  levels: number;
+  tileUrl: string;
+}
+
+interface XRayTileViewerProps {
+  uniqueId: string;
+  height?: number;
+}
+
+interface View {
+  scale: number; // screen pixels per full-resolution image pixel
+  x: number; // screen position of the image's top-left corner
+  y: number;
+}
+
+const MAX_SCALE = 4;
+
+const XRayTileViewer: React.FC<XRayTileViewerProps> = ({
+  uniqueId,
+  height = 500,
+}) => {
+  const baseUrl = import.meta.env.VITE_BACKEND_URL;
+  const containerRef = useRef<HTMLDivElement>(null);
+  const dragRef = useRef<{ x: number; y: number } | null>(null);
+  const [images, setImages] = useState<TiledImage[]>([]);
+  const [selected, setSelected] = useState(0);
+  const [view, setView] = useState<View | null>(null);
+  const [width, setWidth] = useState(0);
+
+  useEffect(() => {
+    setImages([]);
+    setSelected(0);
+    fetch(`${baseUrl}/xray/${encodeURIComponent(uniqueId)}/images`)
+      .then((res) => (res.ok ? res.json() : { images: [] }))
+      .then((manifest) => setImages(manifest.images))
+      .catch(() => setImages([]));
+  }, [baseUrl, uniqueId]);
+
+  const image = images[selected];
+
+  // Fit the whole film in the viewer whenever the image changes
+  useEffect(() => {
+    const container = containerRef.current;
+    if (!image || !container) return;
+    const containerWidth = container.clientWidth;
+    const scale = Math.min(containerWidth / image.width, height / image.height);
+    setWidth(containerWidth);
+    setView({
+      scale,
+      x: (containerWidth - image.width * scale) / 2,
+      y: (height - image.height * scale) / 2,
+    });
+  }, [image, height]);
+
+  if (!image) return null;
+
+  const handleWheel = (event: React.WheelEvent<HTMLDivElement>) => {
+    if (!view || !containerRef.current) return;
+    const rect = containerRef.current.getBoundingClientRect();
+    const pointerX = event.clientX - rect.left;
+    const pointerY = event.clientY - rect.top;
+    const fitScale = Math.min(width / image.width, height / image.height);
+    const scale = Math.min(
+      MAX_SCALE,
+      Math.max(fitScale / 2, view.scale * (event.deltaY < 0 ? 1.25 : 0.8))
+    );
+    // Zoom around the pointer
+    setView({
+      scale,
+      x: pointerX - ((pointerX - view.x) * scale) / view.scale,
+      y: pointerY - ((pointerY - view.y) * scale) / view.scale,
+    });
+  };
+
+  const handleMouseDown = (event: React.MouseEvent<HTMLDivElement>) => {
+    dragRef.current = { x: event.clientX, y: event.clientY };
+  };
+
+  const handleMouseMove = (event: React.MouseEvent<HTMLDivElement>) => {
+    if (!dragRef.current || !view) return;
+    const dx = event.clientX - dragRef.current.x;
+    const dy = event.clientY - dragRef.current.y;
+    dragRef.current = { x: event.clientX, y: event.clientY };
+    setView({ ...view, x: view.x + dx, y: view.y + dy });
+  };
+
+  const stopDragging = () => {
+    dragRef.current = null;
+  };
+
+  // Only the tiles of the current zoom level that intersect the viewer
+  const tiles: React.ReactNode[] = [];
+  if (view && width) {
+    const maxLevel = image.levels - 1;
+    const level = Math.max(
+      0,
+      Math.min(maxLevel, maxLevel + Math.ceil(Math.log2(view.scale)))
+    );
+    const levelScale = Math.pow(2, maxLevel - level); // image pixels per level pixel
+    const levelWidth = Math.ceil(image.width / levelScale);
+    const levelHeight = Math.ceil(image.height / levelScale);
+    const tileScreen = image.tileSize * levelScale * view.scale;
+
+    const firstCol = Math.max(0, Math.floor(-view.x / tileScreen));
+    const lastCol = Math.min(
+      Math.ceil(levelWidth / image.tileSize) - 1,
+      Math.floor((width - view.x) / tileScreen)
+    );
+    const firstRow = Math.max(0, Math.floor(-view.y / tileScreen));
+    const lastRow = Math.min(
+      Math.ceil(levelHeight / image.tileSize) - 1,
+      Math.floor((height - view.y) / tileScreen)
+    );
+
+    for (let row = firstRow; row <= lastRow; row++) {
+      for (let col = firstCol; col <= lastCol; col++) {
+        const tileWidth = Math.min(image.tileSize, levelWidth - col * image.tileSize);
+        const tileHeight = Math.min(image.tileSize, levelHeight - row * image.tileSize);
+        const url = image.tileUrl
+          .replace("{level}", String(level))
+          .replace("{col}", String(col))
+          .replace("{row}", String(row));
+        tiles.push(
+          <img
+            key={`${level}/${col}_${row}`}
+            src={`${baseUrl}${url}`}
+            alt=""
+            draggable={false}
+            className={styles.xrayTile}
+            style={{
+              left: view.x + col * tileScreen,
+              top: view.y + row * tileScreen,
+              width: (tileWidth * tileScreen) / image.tileSize,
+              height: (tileHeight * tileScreen) / image.tileSize,
+            }}
+          />
+        );
+      }
+    }
+  }
+
+  return (
+    <div className={styles.pdfSection}>
+      <h4 className={styles.sectionSubtitle}>🩻 Radiograph</h4>
+      {images.length > 1 && (
+        <div className={styles.pdfActions}>
+          {images.map((item) => (
+            <button
+              key={item.index}
+              className={styles.viewPdfButton}
+              onClick={() => setSelected(item.index)}
+            >
+              Film {item.index + 1}
+            </button>
+          ))}
+        </div>
+      )}
+      <div
+        ref={containerRef}
+        className={styles.xrayViewer}
+        style={{ height }}
+        onWheel={handleWheel}
+        onMouseDown={handleMouseDown}
+        onMouseMove={handleMouseMove}
+        onMouseUp={stopDragging}
+        onMouseLeave={stopDragging}
+      >
+        {tiles}
+      </div>
+    </div>
+  );
+};
+
+export default XRayTileViewer;
@@ -0,0 +1,70 @@
+import useGenerateActivity from "@/hooks/useGenerateActivity";
+
+// Files per request. The backend handles each request with one duplicate
+// lookup, one batched write and one activity entry
+const FILES_PER_REQUEST = 50;
+
+export interface BatchUploadSummary {
+  saved: string[];
+  duplicates: string[];
+  failed: { fileName: string; error: string }[];
+  records: any[];
+}
+
+// Uploads PDFs to /records/{type}/batch. The backend parses them, skips
+// records whose uniqueId is already stored, saves the rest to Firestore and
+// logs the activity, so the page makes no Firestore calls per file.
+const useBatchUpload = () => {
+  const { getCurrentUser } = useGenerateActivity();
+  const baseUrl = import.meta.env.VITE_BACKEND_URL;
+
+  const uploadBatch = async (
+    type: string,
+    files: File[],
+    onProgress?: (done: number, total: number) => void
+  ): Promise<BatchUploadSummary> => {
+    const currentUser = await getCurrentUser();
+    const firstname =
+      currentUser?.firstname || currentUser?.email.split("@")[0] || "";
+    const summary: BatchUploadSummary = {
+      saved: [],
+      duplicates: [],
+      failed: [],
+      records: [],
+    };
+
+    for (let i = 0; i < files.length; i += FILES_PER_REQUEST) {
+      const chunk = files.slice(i, i + FILES_PER_REQUEST);
+      const formData = new FormData();
+      chunk.forEach((file) => formData.append("files", file));
+      formData.append("firstname", firstname);
+
+      try {
+        const res = await fetch(`${baseUrl}/records/${type}/batch`, {
+          method: "POST",
+          body: formData,
+        });
+        if (!res.ok) {
+          const { detail } = await res.json().catch(() => ({}));
+          throw new Error(detail || `HTTP ${res.status}`);
+        }
+        const result = await res.json();
+        summary.saved.push(...result.saved);
+        summary.duplicates.push(...result.duplicates);
+        summary.failed.push(...result.failed);
+        summary.records.push(...result.records);
+      } catch (err) {
+        // The whole request failed: report its files and go on with the rest
+        const error = err instanceof Error ? err.message : String(err);
+        chunk.forEach((file) => summary.failed.push({ fileName: file.name, error }));
+      }
+      onProgress?.(i + chunk.length, files.length);
+    }
+
+    return summary;
+  };
+
+  return { uploadBatch };
+};
+
+export default useBatchUpload;
@@ -21,6 +21,7 @@ interface UseGenerateActivityReturn {
     activityType: string,
     customReport?: string
   ) => Promise<void>;
+  getCurrentUser: () => Promise<{ firstname: string; email: string } | null>;
   isLoading: boolean;
   error: string | null;
 }
@@ -179,6 +180,7 @@ const useGenerateActivity = (): UseGenerateActivityReturn => {
 
   return {
     generateActivity,
+    getCurrentUser,
     isLoading,
     error,
   };
@@ -0,0 +1,127 @@
+import { useEffect, useRef } from "react";
+import { authHeaders } from "@/backendAuth";
+
+export type RecordChangeOp = "insert" | "update" | "delete";
+
+export interface RecordChange<T> {
+  seq: number;
+  collection: string;
+  op: RecordChangeOp;
+  uniqueId: string;
+  documentId: string;
+  record: T | null; // null for deletes
+  createdAt: string;
+}
+
+interface UseRecordChangesOptions<T> {
+  onChange: (change: RecordChange<T>) => void;
+  // The feed could not resume (too far behind); reload the whole list
+  onReset?: () => void;
+}
+
+const OPERATIONS: string[] = ["insert", "update", "delete"];
+const RETRY_MS = 3000;
+const MAX_RETRY_MS = 60000;
+
+// Signed out, or not an admin: reconnecting will not help
+class FeedRefusedError extends Error {}
+
+const sleep = (ms: number) => new Promise((resolve) => setTimeout(resolve, ms));
+
+// Subscribes to the backend's change feed for one report type. The feed is
+// for admins only and EventSource cannot send an Authorization header, so
+// the stream is read with fetch: it reconnects with backoff and resumes
+// after the last event id it received (Last-Event-ID).
+const useRecordChanges = <T,>(
+  type: string,
+  { onChange, onReset }: UseRecordChangesOptions<T>
+) => {
+  const handlers = useRef({ onChange, onReset });
+  handlers.current = { onChange, onReset };
+
+  useEffect(() => {
+    const controller = new AbortController();
+    const url = `${import.meta.env.VITE_BACKEND_URL}/records/${type}/changes`;
+    let lastEventId = "";
+    let delay = RETRY_MS;
+
+    const dispatch = (event: string, data: string) => {
+      if (OPERATIONS.includes(event)) {
+        handlers.current.onChange(JSON.parse(data) as RecordChange<T>);
+      } else if (event === "reset") {
+        handlers.current.onReset?.();
+      }
+    };
+
+    // One connection: parse "event:", "data:" and "id:" lines until it ends
+    const read = async () => {
+      const headers: Record<string, string> = {
+        Accept: "text/event-stream",
+        ...(await authHeaders()),
+      };
+      if (lastEventId) headers["Last-Event-ID"] = lastEventId;
+
+      const res = await fetch(url, { headers, signal: controller.signal });
+      if (res.status === 401 || res.status === 403) {
+        throw new FeedRefusedError(`Change feed refused (HTTP ${res.status})`);
+      }
+      if (!res.ok || !res.body) throw new Error(`HTTP ${res.status}`);
+      delay = RETRY_MS;
+
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) return;
+        buffer += decoder.decode(value, { stream: true });
+
+        let end;
+        while ((end = buffer.indexOf("\n\n")) >= 0) {
+          const block = buffer.slice(0, end);
+          buffer = buffer.slice(end + 2);
+          let event = "message";
+          const data: string[] = [];
+          for (const line of block.split("\n")) {
+            if (line.startsWith(":")) continue; // comment / keepalive
+            const colon = line.indexOf(":");
+            const field = colon < 0 ? line : line.slice(0, colon);
+            const text = colon < 0 ? "" : line.slice(colon + 1).replace(/^ /, "");
+            if (field === "event") event = text;
+            else if (field === "data") data.push(text);
+            else if (field === "id") lastEventId = text;
+            else if (field === "retry" && /^\d+$/.test(text)) delay = Number(text);
+          }
+          if (data.length > 0) dispatch(event, data.join("\n"));
+        }
+      }
+    };
+
+    const run = async () => {
+      while (!controller.signal.aborted) {
+        try {
+          await read();
+        } catch (err) {
+          if (controller.signal.aborted) return;
+          console.error("Change feed error:", err);
+          if (err instanceof FeedRefusedError) return;
+        }
+        await sleep(delay);
+        delay = Math.min(delay * 2, MAX_RETRY_MS);
+      }
+    };
+    run();
+
+    return () => controller.abort();
+  }, [type]);
+};
+
+export default useRecordChanges;
+
+// Example usage in an admin page:
+/*
+useRecordChanges<CBCRecord>("cbc", {
+  onChange: (change) => applyChange(change),
+  onReset: () => loadRecords(),
+});
+*/
@@ -0,0 +1,116 @@
+import { useCallback, useState } from "react";
+
+const TUS_VERSION = "1.0.0";
+const CHUNK_SIZE = 512 * 1024;
+const MAX_RETRIES = 8; // consecutive failures before giving up on a file
+
+export interface ResumableUploadProgress {
+  fileName: string;
+  sent: number;
+  total: number;
+}
+
+interface UploadStatus {
+  offset: number;
+  completed: boolean;
+  result: any;
+}
+
+// A failure that retrying the same request will not fix (bad type, too large...)
+class PermanentUploadError extends Error {}
+
+const sleep = (ms: number) => new Promise((resolve) => setTimeout(resolve, ms));
+
+// Chunked, resumable uploads to /uploads (tus-style). A dropped connection
+// only loses the chunk in flight: the upload asks the backend how far it got
+// and carries on from there, backing off between attempts.
+const useResumableUpload = () => {
+  const [progress, setProgress] = useState<ResumableUploadProgress | null>(
+    null
+  );
+  const baseUrl = import.meta.env.VITE_BACKEND_URL;
+
+  const upload = useCallback(
+    async (file: File, params: Record<string, string>): Promise<any> => {
+      const query = new URLSearchParams({ filename: file.name, ...params });
+      const created = await fetch(`${baseUrl}/uploads?${query}`, {
+        method: "POST",
+        headers: {
+          "Tus-Resumable": TUS_VERSION,
+          "Upload-Length": String(file.size),
+        },
+      });
+      if (!created.ok) {
+        const { detail } = await created.json().catch(() => ({}));
+        throw new Error(detail || `Could not start the upload (HTTP ${created.status})`);
+      }
+      const location = `${baseUrl}${created.headers.get("Location")}`;
+
+      const fetchStatus = async (): Promise<UploadStatus> => {
+        const res = await fetch(location);
+        if (!res.ok) {
+          throw new PermanentUploadError(`Upload lost (HTTP ${res.status})`);
+        }
+        return res.json();
+      };
+
+      let offset = 0;
+      let failures = 0;
+      setProgress({ fileName: file.name, sent: 0, total: file.size });
+
+      while (true) {
+        try {
+          const res = await fetch(location, {
+            method: "PATCH",
+            headers: {
+              "Tus-Resumable": TUS_VERSION,
+              "Content-Type": "application/offset+octet-stream",
+              "Upload-Offset": String(offset),
+            },
+            body: file.slice(offset, offset + CHUNK_SIZE),
+          });
+
+          if (res.status === 409) {
+            // Out of step (e.g. the reply to a completed chunk got lost)
+            const status = await fetchStatus();
+            if (status.completed) return status.result;
+            offset = status.offset;
+            continue;
+          }
+          if (res.status >= 400 && res.status < 500) {
+            const { detail } = await res.json().catch(() => ({}));
+            throw new PermanentUploadError(detail || `HTTP ${res.status}`);
+          }
+          if (!res.ok) {
+            throw new Error(`HTTP ${res.status}`);
+          }
+
+          failures = 0;
+          offset = Number(res.headers.get("Upload-Offset"));
+          setProgress({ fileName: file.name, sent: offset, total: file.size });
+
+          // The last chunk answers with the processed record
+          if (res.status === 200) return res.json();
+        } catch (err) {
+          if (err instanceof PermanentUploadError || ++failures > MAX_RETRIES) {
+            throw err;
+          }
+          await sleep(Math.min(30000, 1000 * 2 ** (failures - 1)));
+          try {
+            const status = await fetchStatus();
+            if (status.completed) return status.result;
+            offset = status.offset;
+          } catch (statusErr) {
+            if (statusErr instanceof PermanentUploadError) throw statusErr;
+            // Still offline; retry the same chunk after the next back-off
+          }
+        }
+      }
+    },
+    [baseUrl]
+  );
+
+  return { upload, progress };
+};
+
+export default useResumableUpload;
@@ -1,16 +1,10 @@
 import React, { useState, useRef } from "react";
-import {
-  collection,
-  addDoc,
-  getDocs,
-  query,
-  where,
-  deleteDoc,
-  doc,
-} from "firebase/firestore";
+import { collection, getDocs } from "firebase/firestore";
 import { db } from "@/firebaseConfig";
 import styles from "@/styles/XRay.module.css";
 import Sidebar from "@/components/Sidebar";
+import useBatchUpload from "@/hooks/useBatchUpload";
+import { authHeaders } from "@/backendAuth";
 
 interface LabValue {
   result: string;
@@ -64,6 +58,7 @@ const Urinalysis: React.FC = () => {
   const [selectedRecord, setSelectedRecord] = useState<UrinalysisRecord | null>(null);
   const [showModal, setShowModal] = useState(false);
   const fileInputRef = useRef<HTMLInputElement>(null);
+  const { uploadBatch } = useBatchUpload();
 
 
   const handleSidebarToggle = () => {
@@ -71,67 +66,49 @@ const Urinalysis: React.FC = () => {
   };
 
 
-  // Handle file upload
-  const handleFileUpload = async (event: React.ChangeEvent<HTMLInputElement>) => {
-  const files = event.target.files;
-  if (!files) return;
+  // Upload the selection as server-side batches: the backend parses the
+  // PDFs, skips duplicates, saves to Firestore and logs the activity
+  const handleFileUpload = async (
+    event: React.ChangeEvent<HTMLInputElement>
+  ) => {
+    const files = event.target.files;
+    if (!files) return;
 
-  setLoading(true);
-  setUploadProgress("Starting upload...");
-
-  for (let i = 0; i < files.length; i++) {
-    const file = files[i];
-
-    if (file.type !== "application/pdf") {
-      alert(`File ${file.name} is not a PDF file`);
-      continue;
-    }
-
-    setUploadProgress(`Processing ${file.name}... (${i + 1}/${files.length})`);
+    const pdfs = Array.from(files).filter((file) => {
+      if (file.type !== "application/pdf") {
+        alert(`File ${file.name} is not a PDF file`);
+        return false;
+      }
+      return true;
+    });
+    if (pdfs.length === 0) return;
 
-    const formData = new FormData();
-    formData.append("file", file);
+    setLoading(true);
+    setUploadProgress("Starting upload...");
 
     try {
-      const res = await fetch("http://localhost:8000/extract-urinalysis", {
-        method: "POST",
-        body: formData,
-      });
-
-      const data = await res.json();
-
-      console.log("Parsed Data from backend:", data);
-
-
-      if (data.error) {
-        console.error(`Error in ${file.name}:`, data.error);
-        continue;
-      }
-
-      // Check for duplicates in Firestore
-      const q = query(
-        collection(db, "urinalysisRecords"),
-        where("uniqueId", "==", data.uniqueId)
+      const { saved, duplicates, failed } = await uploadBatch(
+        "urinalysis",
+        pdfs,
+        (done, total) => setUploadProgress(`Processed ${done}/${total} files...`)
       );
-      const existing = await getDocs(q);
-
-      if (!existing.empty) {
-        console.log(`Record already exists for ${data.patientName}`);
-        continue;
+      failed.forEach(({ fileName, error }) =>
+        console.error(`Error in ${fileName}:`, error)
+      );
+      if (duplicates.length > 0) {
+        console.log(`${duplicates.length} record(s) already exist`);
       }
-
-      // Save to Firestore
-      await addDoc(collection(db, "urinalysisRecords"), data);
-      setUploadProgress(`Saved ${data.patientName}`);
+      await loadRecords();
+      setUploadProgress(
+        `Upload finished: ${saved.length} saved, ${duplicates.length} already existed, ${failed.length} failed.`
+      );
     } catch (err) {
       console.error("Upload error:", err);
+      setUploadProgress("Upload failed.");
+    } finally {
+      setLoading(false);
     }
-  }
-
-  await loadRecords();
-  setUploadProgress("Upload finished.");
-  setLoading(false);
-};
+  };
 
 
   // Load all records from Firestore
@@ -163,8 +140,20 @@ const Urinalysis: React.FC = () => {
   const handleDeleteRecord = async (recordId: string) => {
     if (!window.confirm("Are you sure you want to delete this record?")) return;
 
+    const recordToDelete = records.find((record) => record.id === recordId);
+    if (!recordToDelete) return;
+
     try {
-      await deleteDoc(doc(db, "urinalysisRecords", recordId));
+      // The backend also drops it from the search index and the change feeds
+      const res = await fetch(
+        `${import.meta.env.VITE_BACKEND_URL}/records/urinalysis/${encodeURIComponent(
+          recordId
+        )}`,
+        { method: "DELETE", headers: await authHeaders() }
+      );
+      if (!res.ok) {
+        throw new Error(`Delete failed with HTTP ${res.status}`);
+      }
       await loadRecords();
     } catch (error) {
       console.error("Error deleting record:", error);
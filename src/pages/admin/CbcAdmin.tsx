@@ -1,17 +1,12 @@
 import React, { useState, useRef } from "react";
-import {
-  collection,
-  addDoc,
-  getDocs,
-  query,
-  where,
-  deleteDoc,
-  doc,
-} from "firebase/firestore";
+import { collection, getDocs } from "firebase/firestore";
 import { db } from "@/firebaseConfig";
 import styles from "@/styles/XRay.module.css";
 import Sidebar from "@/components/Sidebar";
 import useGenerateActivity from "@/hooks/useGenerateActivity";
+import useRecordChanges, { RecordChange } from "@/hooks/useRecordChanges";
+import useBatchUpload from "@/hooks/useBatchUpload";
+import { authHeaders } from "@/backendAuth";
 
 interface CBCValue {
   result: string;
@@ -65,6 +60,7 @@ const CbcAdmin: React.FC = () => {
   const [selectedRecord, setSelectedRecord] = useState<CBCRecord | null>(null);
   const [showModal, setShowModal] = useState(false);
   const fileInputRef = useRef<HTMLInputElement>(null);
+  const { uploadBatch } = useBatchUpload();
 
   // Initialize the activity hook
   const {
@@ -77,93 +73,47 @@ const CbcAdmin: React.FC = () => {
     setIsSidebarCollapsed(!isSidebarCollapsed);
   };
 
-  // Handle file upload with activity logging
+  // Upload the selection as server-side batches: the backend parses the
+  // PDFs, skips duplicates, saves to Firestore and logs the activity; the
+  // change feed adds the new records to the list
   const handleFileUpload = async (
     event: React.ChangeEvent<HTMLInputElement>
   ) => {
     const files = event.target.files;
     if (!files) return;
 
-    setLoading(true);
-    setUploadProgress("Starting upload...");
-
-    let uploadedCount = 0;
-    let totalFiles = files.length;
-
-    for (let i = 0; i < files.length; i++) {
-      const file = files[i];
-
+    const pdfs = Array.from(files).filter((file) => {
       if (file.type !== "application/pdf") {
         alert(`File ${file.name} is not a PDF file`);
-        continue;
-      }
-
-      setUploadProgress(
-        `Processing ${file.name}... (${i + 1}/${files.length})`
-      );
-
-      const formData = new FormData();
-      formData.append("file", file);
-
-      try {
-        const res = await fetch(`${import.meta.env.VITE_BACKEND_URL}/upload-and-store?type=cbc`,  {
-          method: "POST",
-          body: formData,
-        });
-
-        const {data, pdfUrl} = await res.json();
-
-        if (data.error) {
-          console.error(`Error in ${file.name}:`, data.error);
-          continue;
-        }
-
-        // Check for duplicates in Firestore
-        const q = query(
-          collection(db, "cbcRecords"),
-          where("uniqueId", "==", data.uniqueId)
-        );
-        const existing = await getDocs(q);
-
-        if (!existing.empty) {
-          console.log(`Record already exists for ${data.patientName}`);
-          continue;
-        }
-
-        // Save to Firestore
-        await addDoc(collection(db, "cbcRecords"), 
-        {...data, pdfUrl});
-        setUploadProgress(`Saved ${data.patientName}`);
-        uploadedCount++;
-
-        // Log individual CBC add activity
-        try {
-          await generateActivity(
-            "cbc_add",
-            `Added CBC record for ${data.patientName} (${data.uniqueId})`
-          );
-        } catch (activityErr) {
-          console.error("Failed to log CBC add activity:", activityErr);
-        }
-      } catch (err) {
-        console.error("Upload error:", err);
+        return false;
       }
-    }
+      return true;
+    });
+    if (pdfs.length === 0) return;
 
-    await loadRecords();
-    setUploadProgress("Upload finished.");
-    setLoading(false);
+    setLoading(true);
+    setUploadProgress("Starting upload...");
 
-    // Log bulk import activity if multiple files were uploaded
-    if (uploadedCount > 1) {
-      try {
-        await generateActivity(
-          "bulk_import",
-          `Bulk uploaded ${uploadedCount} CBC records from ${totalFiles} files`
-        );
-      } catch (activityErr) {
-        console.error("Failed to log bulk import activity:", activityErr);
+    try {
+      const { saved, duplicates, failed } = await uploadBatch(
+        "cbc",
+        pdfs,
+        (done, total) => setUploadProgress(`Processed ${done}/${total} files...`)
+      );
+      failed.forEach(({ fileName, error }) =>
+        console.error(`Error in ${fileName}:`, error)
+      );
+      if (duplicates.length > 0) {
+        console.log(`${duplicates.length} record(s) already exist`);
       }
+      setUploadProgress(
+        `Upload finished: ${saved.length} saved, ${duplicates.length} already existed, ${failed.length} failed.`
+      );
+    } catch (err) {
+      console.error("Upload error:", err);
+      setUploadProgress("Upload failed.");
+    } finally {
+      setLoading(false);
     }
   };
 
@@ -204,22 +154,49 @@ const CbcAdmin: React.FC = () => {
     }
   };
 
+  // Apply an insert/update/delete pushed by the backend instead of reloading
+  const applyChange = (change: RecordChange<CBCRecord>) => {
+    setRecords((current) => {
+      if (change.op === "delete" || !change.record) {
+        return current.filter((record) => record.id !== change.documentId);
+      }
+      const record = { ...change.record, id: change.documentId };
+      const exists = current.some((r) => r.id === change.documentId);
+      // Updates stay in place; new records go first (newest first)
+      return exists
+        ? current.map((r) => (r.id === change.documentId ? record : r))
+        : [record, ...current];
+    });
+  };
+
+  useRecordChanges<CBCRecord>("cbc", {
+    onChange: applyChange,
+    onReset: () => loadRecords(),
+  });
+
   // Delete record with activity logging
   const handleDeleteRecord = async (recordId: string) => {
     if (!window.confirm("Are you sure you want to delete this record?")) return;
 
     // Find the record to get patient info for logging
     const recordToDelete = records.find((record) => record.id === recordId);
+    if (!recordToDelete) return;
 
     try {
-      await deleteDoc(doc(db, "cbcRecords", recordId));
-      await loadRecords();
+      const res = await fetch(
+        `${import.meta.env.VITE_BACKEND_URL}/records/cbc/${encodeURIComponent(
+          recordId
+        )}`,
+        { method: "DELETE", headers: await authHeaders() }
+      );
+      if (!res.ok) {
+        throw new Error(`Delete failed with HTTP ${res.status}`);
+      }
+      // The change feed removes it from the list
 
       // Log delete activity
       try {
-        const patientInfo = recordToDelete
-          ? `${recordToDelete.patientName} (${recordToDelete.uniqueId})`
-          : "Unknown patient";
+        const patientInfo = `${recordToDelete.patientName} (${recordToDelete.uniqueId})`;
         await generateActivity(
           "cbc_delete",
           `Deleted CBC record for ${patientInfo}`
@@ -1,17 +1,15 @@
 import React, { useState, useRef } from "react";
 import {
   collection,
-  addDoc,
   getDocs,
-  query,
-  where,
-  deleteDoc,
-  doc,
 } from "firebase/firestore";
 import { db } from "@/firebaseConfig";
 import styles from "@/styles/XRay.module.css";
 import Sidebar from "@/components/Sidebar";
 import useGenerateActivity from "@/hooks/useGenerateActivity"; // Import the hook
+import useBatchUpload from "@/hooks/useBatchUpload";
+import useRecordChanges, { RecordChange } from "@/hooks/useRecordChanges";
+import { authHeaders } from "@/backendAuth";
 
 interface EcgRecord {
   id?: string;
@@ -54,107 +52,53 @@ const EcgAdmin: React.FC = () => {
     isLoading: activityLoading,
     error: activityError,
   } = useGenerateActivity();
+  const { uploadBatch } = useBatchUpload();
 
   const handleSidebarToggle = () => {
     setIsSidebarCollapsed(!isSidebarCollapsed);
   };
 
-  // Handle file upload with activity logging
+  // Upload the selection as server-side batches: the backend parses the
+  // PDFs, skips duplicates, saves to Firestore and logs the activity
   const handleFileUpload = async (
     event: React.ChangeEvent<HTMLInputElement>
   ) => {
     const files = event.target.files;
     if (!files) return;
 
-    setLoading(true);
-    setUploadProgress("Starting upload...");
-
-    let uploadedCount = 0;
-    let totalFiles = files.length;
-
-    for (let i = 0; i < files.length; i++) {
-      const file = files[i];
-
+    const pdfs = Array.from(files).filter((file) => {
       if (file.type !== "application/pdf") {
         alert(`File ${file.name} is not a PDF file`);
-        continue;
+        return false;
       }
+      return true;
+    });
+    if (pdfs.length === 0) return;
 
-      setUploadProgress(
-        `Processing ${file.name}... (${i + 1}/${files.length})`
-      );
-
-      const formData = new FormData();
-      formData.append("file", file);
-
-      try {
-        const res = await fetch(`${import.meta.env.VITE_BACKEND_URL}/upload-and-store?type=ecg`, {
-          method: "POST",
-          body: formData,
-        });
-
-        const {data, pdfUrl} = await res.json();
-
-        console.log("Parsed Data from backend:", data);
-
-        if (data.error) {
-          console.error(`Error in ${file.name}:`, data.error);
-          continue;
-        }
-
-        // Check for duplicates in Firestore
-        if (!data.uniqueId) {
-          console.error(
-            "Upload error: uniqueId is missing from backend response."
-          );
-          continue;
-        }
-        const q = query(
-          collection(db, "ecgRecords"),
-          where("uniqueId", "==", data.uniqueId)
-        );
-        const existing = await getDocs(q);
-
-        if (!existing.empty) {
-          console.log(`Record already exists for ${data.patient_name}`);
-          continue;
-        }
-
-        // Save to Firestore
-        await addDoc(collection(db, "ecgRecords"), 
-        {...data, pdfUrl});
-        setUploadProgress(`Saved ${data.patient_name}`);
-        uploadedCount++;
-
-        // Log individual upload activity with proper ECG terminology
-        try {
-          await generateActivity(
-            "ecg_upload",
-            `Uploaded ECG record for ${data.patient_name} (${data.uniqueId})`
-          );
-        } catch (activityErr) {
-          console.error("Failed to log upload activity:", activityErr);
-        }
-      } catch (err) {
-        console.error("Upload error:", err);
-      }
-    }
+    setLoading(true);
+    setUploadProgress("Starting upload...");
 
-    // Log summary if multiple files processed
     try {
-      if (uploadedCount > 1) {
-        await generateActivity(
-          "bulk_import",
-          `Bulk uploaded ${uploadedCount} ECG records from ${totalFiles} file(s)`
-        );
+      const { saved, duplicates, failed } = await uploadBatch(
+        "ecg",
+        pdfs,
+        (done, total) => setUploadProgress(`Processed ${done}/${total} files...`)
+      );
+      failed.forEach(({ fileName, error }) =>
+        console.error(`Error in ${fileName}:`, error)
+      );
+      if (duplicates.length > 0) {
+        console.log(`${duplicates.length} record(s) already exist`);
       }
+      setUploadProgress(
+        `Upload finished: ${saved.length} saved, ${duplicates.length} already existed, ${failed.length} failed.`
+      );
     } catch (err) {
-      console.error("Failed to log bulk upload summary:", err);
+      console.error("Upload error:", err);
+      setUploadProgress("Upload failed.");
+    } finally {
+      setLoading(false);
     }
-
-    await loadRecords();
-    setUploadProgress("Upload finished.");
-    setLoading(false);
   };
 
   // Load all records from Firestore with activity logging
@@ -194,17 +138,47 @@ const EcgAdmin: React.FC = () => {
     }
   };
 
+  // Apply an insert/update/delete pushed by the backend instead of reloading
+  const applyChange = (change: RecordChange<EcgRecord>) => {
+    setRecords((current) => {
+      if (change.op === "delete" || !change.record) {
+        return current.filter((record) => record.id !== change.documentId);
+      }
+      const record = { ...change.record, id: change.documentId };
+      const exists = current.some((r) => r.id === change.documentId);
+      // Updates stay in place; new records go first (newest first)
+      return exists
+        ? current.map((r) => (r.id === change.documentId ? record : r))
+        : [record, ...current];
+    });
+  };
+
+  useRecordChanges<EcgRecord>("ecg", {
+    onChange: applyChange,
+    onReset: () => loadRecords(),
+  });
+
   // Delete record with activity logging
   const handleDeleteRecord = async (recordId: string) => {
     if (!window.confirm("Are you sure you want to delete this record?")) return;
 
     // Find the record to get patient details for logging
     const recordToDelete = records.find((r) => r.id === recordId);
+    if (!recordToDelete) return;
     const patientName = recordToDelete?.patientName || "Unknown Patient";
     const uniqueId = recordToDelete?.uniqueId || "";
 
     try {
-      await deleteDoc(doc(db, "ecgRecords", recordId));
+      // The backend also drops it from the search index and the change feeds
+      const res = await fetch(
+        `${import.meta.env.VITE_BACKEND_URL}/records/ecg/${encodeURIComponent(
+          recordId
+        )}`,
+        { method: "DELETE", headers: await authHeaders() }
+      );
+      if (!res.ok) {
+        throw new Error(`Delete failed with HTTP ${res.status}`);
+      }
 
       // Log the delete activity with proper ECG terminology
       try {
@@ -216,7 +190,7 @@ const EcgAdmin: React.FC = () => {
         console.error("Failed to log delete activity:", err);
       }
 
-      await loadRecords();
+      // The change feed removes it from the list
     } catch (error) {
       console.error("Error deleting record:", error);
     }
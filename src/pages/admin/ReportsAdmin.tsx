@@ -2,13 +2,13 @@ import React, { useState} from "react";
 import {
   collection,
   getDocs,
-  deleteDoc,
-  doc,
 } from "firebase/firestore";
 import { db } from "@/firebaseConfig";
 import styles from "@/styles/XRay.module.css";
 import Sidebar from "@/components/Sidebar";
 import useGenerateActivity from "@/hooks/useGenerateActivity";
+import useRecordChanges, { RecordChange } from "@/hooks/useRecordChanges";
+import { authHeaders } from "@/backendAuth";
 
 interface MedExamRecord {
   id?: string;
@@ -144,16 +144,46 @@ const ReportsAdmin: React.FC = () => {
     }
   };
 
+  // Apply an insert/update/delete pushed by the backend instead of reloading
+  const applyChange = (change: RecordChange<MedExamRecord>) => {
+    setRecords((current) => {
+      if (change.op === "delete" || !change.record) {
+        return current.filter((record) => record.id !== change.documentId);
+      }
+      const record = { ...change.record, id: change.documentId };
+      const exists = current.some((r) => r.id === change.documentId);
+      // Updates stay in place; new records go first (newest first)
+      return exists
+        ? current.map((r) => (r.id === change.documentId ? record : r))
+        : [record, ...current];
+    });
+  };
+
+  useRecordChanges<MedExamRecord>("medical", {
+    onChange: applyChange,
+    onReset: () => loadRecords(),
+  });
+
   // Delete record with activity logging
   const handleDeleteRecord = async (recordId: string) => {
     if (!window.confirm("Are you sure you want to delete this record?")) return;
 
     // Find the record to get patient info for logging
     const recordToDelete = records.find((record) => record.id === recordId);
+    if (!recordToDelete) return;
 
     try {
-      await deleteDoc(doc(db, "medExamRecords", recordId));
-      await loadRecords();
+      // The backend also drops it from the search index and the change feeds
+      const res = await fetch(
+        `${import.meta.env.VITE_BACKEND_URL}/records/medical/${encodeURIComponent(
+          recordId
+        )}`,
+        { method: "DELETE", headers: await authHeaders() }
+      );
+      if (!res.ok) {
+        throw new Error(`Delete failed with HTTP ${res.status}`);
+      }
+      // The change feed removes it from the list
 
       // Log delete activity
       try {
@@ -1,17 +1,15 @@
 import React, { useState, useRef } from "react";
 import {
   collection,
-  addDoc,
   getDocs,
-  query,
-  where,
-  deleteDoc,
-  doc,
 } from "firebase/firestore";
 import { db } from "@/firebaseConfig";
 import styles from "@/styles/XRay.module.css";
 import Sidebar from "@/components/Sidebar";
 import useGenerateActivity from "@/hooks/useGenerateActivity";
+import useBatchUpload from "@/hooks/useBatchUpload";
+import useRecordChanges, { RecordChange } from "@/hooks/useRecordChanges";
+import { authHeaders } from "@/backendAuth";
 
 interface LabValue {
   result: string;
@@ -76,102 +74,52 @@ const UrinalysisAdmin: React.FC = () => {
     isLoading: activityLoading,
     error: activityError,
   } = useGenerateActivity();
+  const { uploadBatch } = useBatchUpload();
 
   const handleSidebarToggle = () => {
     setIsSidebarCollapsed(!isSidebarCollapsed);
   };
 
-  // Handle file upload with activity logging
+  // Upload the selection as server-side batches: the backend parses the
+  // PDFs, skips duplicates, saves to Firestore and logs the activity
   const handleFileUpload = async (
     event: React.ChangeEvent<HTMLInputElement>
   ) => {
     const files = event.target.files;
     if (!files) return;
 
-    setLoading(true);
-    setUploadProgress("Starting upload...");
-
-    let successfulUploads = 0;
-    let totalFiles = files.length;
-
-    for (let i = 0; i < files.length; i++) {
-      const file = files[i];
-
+    const pdfs = Array.from(files).filter((file) => {
       if (file.type !== "application/pdf") {
         alert(`File ${file.name} is not a PDF file`);
-        continue;
+        return false;
       }
+      return true;
+    });
+    if (pdfs.length === 0) return;
 
-      setUploadProgress(
-        `Processing ${file.name}... (${i + 1}/${files.length})`
-      );
-
-      const formData = new FormData();
-      formData.append("file", file);
-
-      try {
-        const res = await fetch(`${import.meta.env.VITE_BACKEND_URL}/upload-and-store?type=urinalysis`, {
-          method: "POST",
-          body: formData,
-        });
-
-        const {data, pdfUrl} = await res.json();
-
-        console.log("Parsed Data from backend:", data);
-
-        if (data.error) {
-          console.error(`Error in ${file.name}:`, data.error);
-          continue;
-        }
-
-        // Check for duplicates in Firestore
-        const q = query(
-          collection(db, "urinalysisRecords"),
-          where("uniqueId", "==", data.uniqueId)
-        );
-        const existing = await getDocs(q);
-
-        if (!existing.empty) {
-          console.log(`Record already exists for ${data.patientName}`);
-          continue;
-        }
-
-        // Save to Firestore
-        await addDoc(collection(db, "urinalysisRecords"), 
-        {...data, pdfUrl});
-        setUploadProgress(`Saved ${data.patientName}`);
-        successfulUploads++;
-      try {
-          await generateActivity(
-            "urinalysis_upload",
-            `Uploaded X-Ray record for ${data.patientName} (${data.uniqueId})`
-          );
-        } catch (activityErr) {
-          console.error("Failed to log upload activity:", activityErr);
-        }
-      } catch (err) {
-        console.error("Upload error:", err);
-      }
-    }
-
-    
-
-    await loadRecords();
-    setUploadProgress("Upload finished.");
-    setLoading(false);
+    setLoading(true);
+    setUploadProgress("Starting upload...");
 
-    // Log activity for successful uploads
-    if (successfulUploads > 0) {
-      try {
-        await generateActivity(
-          "urinalysis_add",
-          `Successfully uploaded ${successfulUploads} urinalysis record${
-            successfulUploads > 1 ? "s" : ""
-          } from ${totalFiles} file${totalFiles > 1 ? "s" : ""}`
-        );
-      } catch (err) {
-        console.error("Failed to log upload activity:", err);
+    try {
+      const { saved, duplicates, failed } = await uploadBatch(
+        "urinalysis",
+        pdfs,
+        (done, total) => setUploadProgress(`Processed ${done}/${total} files...`)
+      );
+      failed.forEach(({ fileName, error }) =>
+        console.error(`Error in ${fileName}:`, error)
+      );
+      if (duplicates.length > 0) {
+        console.log(`${duplicates.length} record(s) already exist`);
       }
+      setUploadProgress(
+        `Upload finished: ${saved.length} saved, ${duplicates.length} already existed, ${failed.length} failed.`
+      );
+    } catch (err) {
+      console.error("Upload error:", err);
+      setUploadProgress("Upload failed.");
+    } finally {
+      setLoading(false);
     }
   };
 
@@ -200,16 +148,46 @@ const UrinalysisAdmin: React.FC = () => {
     }
   };
 
+  // Apply an insert/update/delete pushed by the backend instead of reloading
+  const applyChange = (change: RecordChange<UrinalysisRecord>) => {
+    setRecords((current) => {
+      if (change.op === "delete" || !change.record) {
+        return current.filter((record) => record.id !== change.documentId);
+      }
+      const record = { ...change.record, id: change.documentId };
+      const exists = current.some((r) => r.id === change.documentId);
+      // Updates stay in place; new records go first (newest first)
+      return exists
+        ? current.map((r) => (r.id === change.documentId ? record : r))
+        : [record, ...current];
+    });
+  };
+
+  useRecordChanges<UrinalysisRecord>("urinalysis", {
+    onChange: applyChange,
+    onReset: () => loadRecords(),
+  });
+
   // Delete record with activity logging
   const handleDeleteRecord = async (recordId: string) => {
     if (!window.confirm("Are you sure you want to delete this record?")) return;
 
     // Find the record to get patient name for logging
     const recordToDelete = records.find((record) => record.id === recordId);
+    if (!recordToDelete) return;
     const patientName = recordToDelete?.patientName || "Unknown Patient";
 
     try {
-      await deleteDoc(doc(db, "urinalysisRecords", recordId));
+      // The backend also drops it from the search index and the change feeds
+      const res = await fetch(
+        `${import.meta.env.VITE_BACKEND_URL}/records/urinalysis/${encodeURIComponent(
+          recordId
+        )}`,
+        { method: "DELETE", headers: await authHeaders() }
+      );
+      if (!res.ok) {
+        throw new Error(`Delete failed with HTTP ${res.status}`);
+      }
 
       // Log delete activity
       try {
@@ -221,7 +199,7 @@ const UrinalysisAdmin: React.FC = () => {
         console.error("Failed to log delete activity:", err);
       }
 
-      await loadRecords();
+      // The change feed removes it from the list
     } catch (error) {
       console.error("Error deleting record:", error);
     }
@@ -1,17 +1,16 @@
 import React, { useState, useRef } from "react";
 import {
   collection,
-  addDoc,
   getDocs,
-  query,
-  where,
-  deleteDoc,
-  doc,
 } from "firebase/firestore";
 import { db } from "@/firebaseConfig";
 import styles from "@/styles/XRay.module.css";
 import Sidebar from "@/components/Sidebar";
+import XRayTileViewer from "@/components/XRayTileViewer";
 import useGenerateActivity from "@/hooks/useGenerateActivity";
+import useBatchUpload from "@/hooks/useBatchUpload";
+import useRecordChanges, { RecordChange } from "@/hooks/useRecordChanges";
+import { authHeaders } from "@/backendAuth";
 
 interface XRayRecord {
   id?: string;
@@ -46,98 +45,52 @@ const XRayAdmin: React.FC = () => {
     isLoading: activityLoading,
     error: activityError,
   } = useGenerateActivity();
+  const { uploadBatch } = useBatchUpload();
 
   const handleSidebarToggle = () => {
     setIsSidebarCollapsed(!isSidebarCollapsed);
   };
 
-  // Handle file upload with activity logging
+  // Upload the selection as server-side batches: the backend parses the
+  // PDFs, skips duplicates, saves to Firestore and logs the activity
   const handleFileUpload = async (
     event: React.ChangeEvent<HTMLInputElement>
   ) => {
     const files = event.target.files;
     if (!files) return;
 
-    setLoading(true);
-    setUploadProgress("Starting upload...");
-
-    let uploadedCount = 0;
-    let totalFiles = files.length;
-
-    for (let i = 0; i < files.length; i++) {
-      const file = files[i];
-
+    const pdfs = Array.from(files).filter((file) => {
       if (file.type !== "application/pdf") {
         alert(`File ${file.name} is not a PDF file`);
-        continue;
+        return false;
       }
+      return true;
+    });
+    if (pdfs.length === 0) return;
 
-      setUploadProgress(
-        `Processing ${file.name}... (${i + 1}/${files.length})`
-      );
-
-      const formData = new FormData();
-      formData.append("file", file);
-
-      try {
-        const res = await fetch(`${import.meta.env.VITE_BACKEND_URL}/upload-and-store?type=xray`, {
-          method: "POST",
-          body: formData,
-        });
-
-        const {data, pdfUrl} = await res.json();
-
-        if (data.error) {
-          console.error(`Error in ${file.name}:`, data.error);
-          continue;
-        }
-
-        // Check for duplicates in Firestore
-        const q = query(
-          collection(db, "xrayRecords"),
-          where("uniqueId", "==", data.uniqueId)
-        );
-        const existing = await getDocs(q);
-
-        if (!existing.empty) {
-          console.log(`Record already exists for ${data.patientName}`);
-          continue;
-        }
-
-        // Save to Firestore
-        await addDoc(collection(db, "xrayRecords"), 
-        { ...data, pdfUrl});
-        setUploadProgress(`Saved ${data.patientName}`);
-        uploadedCount++;
-
-        // Log individual upload activity
-        try {
-          await generateActivity(
-            "xray_upload",
-            `Uploaded X-Ray record for ${data.patientName} (${data.uniqueId})`
-          );
-        } catch (activityErr) {
-          console.error("Failed to log upload activity:", activityErr);
-        }
-      } catch (err) {
-        console.error("Upload error:", err);
-      }
-    }
-
-    await loadRecords();
-    setUploadProgress("Upload finished.");
-    setLoading(false);
+    setLoading(true);
+    setUploadProgress("Starting upload...");
 
-    // Log bulk upload activity if multiple files were uploaded
-    if (uploadedCount > 1) {
-      try {
-        await generateActivity(
-          "bulk_import",
-          `Bulk uploaded ${uploadedCount} X-Ray records from ${totalFiles} files`
-        );
-      } catch (activityErr) {
-        console.error("Failed to log bulk upload activity:", activityErr);
+    try {
+      const { saved, duplicates, failed } = await uploadBatch(
+        "xray",
+        pdfs,
+        (done, total) => setUploadProgress(`Processed ${done}/${total} files...`)
+      );
+      failed.forEach(({ fileName, error }) =>
+        console.error(`Error in ${fileName}:`, error)
+      );
+      if (duplicates.length > 0) {
+        console.log(`${duplicates.length} record(s) already exist`);
       }
+      setUploadProgress(
+        `Upload finished: ${saved.length} saved, ${duplicates.length} already existed, ${failed.length} failed.`
+      );
+    } catch (err) {
+      console.error("Upload error:", err);
+      setUploadProgress("Upload failed.");
+    } finally {
+      setLoading(false);
     }
   };
 
@@ -166,16 +119,46 @@ const XRayAdmin: React.FC = () => {
     }
   };
 
+  // Apply an insert/update/delete pushed by the backend instead of reloading
+  const applyChange = (change: RecordChange<XRayRecord>) => {
+    setRecords((current) => {
+      if (change.op === "delete" || !change.record) {
+        return current.filter((record) => record.id !== change.documentId);
+      }
+      const record = { ...change.record, id: change.documentId };
+      const exists = current.some((r) => r.id === change.documentId);
+      // Updates stay in place; new records go first (newest first)
+      return exists
+        ? current.map((r) => (r.id === change.documentId ? record : r))
+        : [record, ...current];
+    });
+  };
+
+  useRecordChanges<XRayRecord>("xray", {
+    onChange: applyChange,
+    onReset: () => loadRecords(),
+  });
+
   // Delete record with activity logging
   const handleDeleteRecord = async (recordId: string) => {
     if (!window.confirm("Are you sure you want to delete this record?")) return;
 
     // Find the record to get patient info for logging
     const recordToDelete = records.find((record) => record.id === recordId);
+    if (!recordToDelete) return;
 
     try {
-      await deleteDoc(doc(db, "xrayRecords", recordId));
-      await loadRecords();
+      // The backend also drops it from the search index and the change feeds
+      const res = await fetch(
+        `${import.meta.env.VITE_BACKEND_URL}/records/xray/${encodeURIComponent(
+          recordId
+        )}`,
+        { method: "DELETE", headers: await authHeaders() }
+      );
+      if (!res.ok) {
+        throw new Error(`Delete failed with HTTP ${res.status}`);
+      }
+      // The change feed removes it from the list
 
       // Log delete activity
       try {
@@ -471,6 +454,8 @@ const XRayAdmin: React.FC = () => {
                   </div>
                 </div>
               )}
+              <XRayTileViewer uniqueId={selectedRecord.uniqueId} />
+
               {selectedRecord?.pdfUrl && (() => {
                   const baseUrl = import.meta.env.VITE_BACKEND_URL;
                   const isFullUrl = selectedRecord.pdfUrl.startsWith("http");
@@ -0,0 +1,112 @@
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+
+# Admin-only routes (shadow diffs, quarantine, archive backfill, reparse and the index rebuilds,
+# record edits and the change feed) take "X-Admin-Token: <token>"; unset disables it. Separate
+# from PROFILE_TOKEN, which only lets a caller profile requests
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# The admin pages send "Authorization: Bearer <Firebase ID token>" instead. The user is an admin
+# when their entry in the Firestore "users" collection has role "Admin", as in the frontend's routes
+FIREBASE_PROJECT = os.getenv("FIREBASE_PROJECT", os.getenv("FIRESTORE_PROJECT", ""))
+ADMIN_ROLE = "Admin"
+USERS_COLLECTION = "users"
+# How long a user's role is trusted before it is read again
+ADMIN_ROLE_CACHE_SECONDS = float(os.getenv("ADMIN_ROLE_CACHE_SECONDS", "300"))
+ID_TOKEN_CACHE_SIZE = 1000
+
+
+class FirebaseAdmins:
+    """
+    Checks Firebase ID tokens and the role of their user. A verified token
+    is remembered until it expires, and a role for ADMIN_ROLE_CACHE_SECONDS,
+    so only the first request of a session reaches Google and Firestore.
+    Without google-auth, google-cloud-firestore or FIREBASE_PROJECT, checking
+    a token raises a RuntimeError (503).
+    """
+
+    def __init__(self, project: str = FIREBASE_PROJECT):
+        self.project = project
+        self._lock = threading.Lock()
+        self._tokens: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._roles: Dict[str, Tuple[float, str]] = {}
+        self._request = None
+        self._db = None
+        self._field_filter = None
+
+    def _verify(self, token: str) -> Optional[str]:
+        """Email of the token's user, None when the token is invalid or expired."""
+        now = time.time()
+        with self._lock:
+            cached = self._tokens.get(token)
+            if cached is not None and cached[0] > now:
+                return cached[1]
+        if not self.project:
+            raise RuntimeError("Set FIREBASE_PROJECT to accept Firebase sign-ins")
+        try:
+            from google.auth.transport import requests as google_requests
+            from google.oauth2 import id_token
+        except ImportError:
+            raise RuntimeError("Firebase sign-ins need google-auth (pip install google-auth)")
+        if self._request is None:
+            self._request = google_requests.Request()
+        try:
+            claims = id_token.verify_firebase_token(token, self._request, audience=self.project)
+        except ValueError:
+            return None
+        email = (claims or {}).get("email") or ""
+        if not email:
+            return None
+        with self._lock:
+            self._tokens[token] = (float(claims.get("exp", now)), email)
+            while len(self._tokens) > ID_TOKEN_CACHE_SIZE:
+                self._tokens.popitem(last=False)
+        return email
+
+    def _role(self, email: str) -> str:
+        now = time.time()
+        with self._lock:
+            cached = self._roles.get(email)
+            if cached is not None and cached[0] > now:
+                return cached[1]
+        if self._db is None:
+            try:
+                from google.cloud import firestore
+                from google.cloud.firestore_v1.base_query import FieldFilter
+            except ImportError:
+                raise RuntimeError("Firebase sign-ins need google-cloud-firestore (pip install google-cloud-firestore)")
+            try:
+                self._db = firestore.Client(project=self.project)
+            except Exception as e:
+                raise RuntimeError(f"Cannot connect to Firestore: {str(e)}")
+            self._field_filter = FieldFilter
+        query = self._db.collection(USERS_COLLECTION).where(filter=self._field_filter("email", "==", email)).limit(1)
+        snapshot = next(iter(query.stream()), None)
+        role = (snapshot.to_dict() or {}).get("role", "") if snapshot is not None else ""
+        with self._lock:
+            self._roles[email] = (now + ADMIN_ROLE_CACHE_SECONDS, role)
+        return role
+
+    def is_admin(self, token: str) -> bool:
+        email = self._verify(token)
+        return email is not None and self._role(email) == ADMIN_ROLE
+
+
+firebase_admins = FirebaseAdmins()
+
+
+def is_admin(headers) -> bool:
+    """The admin token, or the Firebase ID token of a user whose role is Admin."""
+    token = headers.get("X-Admin-Token") or ""
+    if ADMIN_TOKEN and hmac.compare_digest(token, ADMIN_TOKEN):
+        return True
+    authorization = headers.get("Authorization") or ""
+    scheme, _, id_token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not id_token.strip():
+        return False
+    return firebase_admins.is_admin(id_token.strip())
@@ -0,0 +1,326 @@
+import os
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from blob_store import BlobStore
+from reference_ranges import FLAG_LETTERS, compile_ranges, evaluate, flatten_analytes, parse_results
+from sidecars import list_sidecars, read_sidecar
+
+
+ANALYTICS_DIR = os.getenv("ANALYTICS_DIR", "analytics")
+# Buffered rows are written as a new part file when either limit is reached
+ANALYTICS_FLUSH_ROWS = int(os.getenv("ANALYTICS_FLUSH_ROWS", "5000"))
+ANALYTICS_FLUSH_SECONDS = float(os.getenv("ANALYTICS_FLUSH_SECONDS", "60"))
+# Merge the parts into one (dropping superseded rows) once there are this many
+ANALYTICS_COMPACT_PARTS = int(os.getenv("ANALYTICS_COMPACT_PARTS", "32"))
+
+ANALYTIC_REPORT_TYPES = ("cbc", "lipid", "chem", "urinalysis")
+# Structured chemistry values, used when the tabular rows are missing
+CHEM_FIELDS = ("fbs", "bua", "creatinine", "sgpt", "cholesterol", "hdl", "ldl", "triglycerides")
+
+GROUP_COLUMNS = ("report_type", "company", "analyte", "unit", "flag", "year", "month")
+# Aggregate name -> pyarrow hash aggregation (median is a t-digest estimate)
+AGGREGATES = {
+    "count": "count",
+    "mean": "mean",
+    "min": "min",
+    "max": "max",
+    "sum": "sum",
+    "stddev": "stddev",
+    "median": "approximate_median",
+}
+
+PART_PREFIX = "part-"
+PART_SUFFIX = ".parquet"
+
+# "March 27, 2025  11:40", "18-Mar-2024 11:20 AM", "2025-03-27 11:40" (structured exports)
+DATE_FORMATS = ("%B %d, %Y %H:%M", "%d-%b-%Y %I:%M %p", "%d-%b-%Y %H:%M", "%B %d, %Y", "%d-%b-%Y", "%m-%d-%Y",
+                "%Y-%m-%d %H:%M", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d")
+
+
+def parse_collection_date(value) -> Optional[datetime]:
+    text = re.sub(r"\s+", " ", str(value or "")).strip()
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, date_format)
+        except ValueError:
+            continue
+    return None
+
+
+def analyte_name(name: str) -> str:
+    """Chemistry rows carry printed test names ("Uric Acid"); match the other keys."""
+    return re.sub(r"[^a-z0-9]+", "_", name.lower()).strip("_")
+
+
+def analyte_rows(report_type: str, record: Dict, company: str = "", ingested_at: Optional[datetime] = None) -> Dict[str, List]:
+    """One row per numeric analyte of a parsed record, with the computed L/H flag."""
+    if report_type == "chem" and not record.get("test_results"):
+        record = dict(record)
+        record["test_results"] = [
+            {"test_name": field, "result": record[field], "unit": "", "reference_range": ""}
+            for field in CHEM_FIELDS if record.get(field)
+        ]
+
+    columns = flatten_analytes([record])
+    values = parse_results(columns["result"])
+    ranges = compile_ranges(columns["reference_range"])
+    flags, _, evaluated = evaluate(values, ranges)
+    numeric = np.flatnonzero(~np.isnan(values))
+
+    collected = parse_collection_date(record.get("collectionDateTime") or record.get("collection_datetime"))
+    ingested_at = ingested_at or datetime.now(timezone.utc)
+    dated = collected or ingested_at.replace(tzinfo=None)
+
+    rows = {
+        "unique_id": [], "report_type": [], "company": [], "mrn": [], "patient_name": [],
+        "analyte": [], "value": [], "unit": [], "reference_range": [], "flag": [], "pdf_flag": [],
+        "collected_at": [], "year": [], "month": [], "ingested_at": [],
+    }
+    for i in numeric:
+        rows["unique_id"].append(record.get("uniqueId", ""))
+        rows["report_type"].append(report_type)
+        rows["company"].append(company)
+        rows["mrn"].append(str(record.get("mrn") or ""))
+        rows["patient_name"].append(str(record.get("patientName") or record.get("name") or ""))
+        rows["analyte"].append(analyte_name(columns["analyte"][i]))
+        rows["value"].append(float(values[i]))
+        rows["unit"].append(columns["unit"][i])
+        rows["reference_range"].append(columns["reference_range"][i])
+        rows["flag"].append(FLAG_LETTERS[int(flags[i])] if evaluated[i] else "")
+        rows["pdf_flag"].append(columns["pdf_flag"][i])
+        rows["collected_at"].append(collected)
+        rows["year"].append(dated.year)
+        rows["month"].append(dated.month)
+        rows["ingested_at"].append(ingested_at)
+    return rows
+
+
+class AnalyticsStore:
+    """
+    Append-only Parquet mirror of the numeric lab results, one row per
+    analyte, for population queries. Rows are buffered and written as new
+    part files; a re-ingested record supersedes its earlier rows.
+    """
+
+    def __init__(self, directory: str = ANALYTICS_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._buffer: List[Dict[str, List]] = []
+        self._buffered_rows = 0
+        self._last_flush = time.monotonic()
+        try:
+            import pyarrow  # noqa: F401
+            self.available = bool(directory)
+        except ImportError:
+            print("[ANALYTICS] pyarrow is not installed (pip install pyarrow); lab results are not mirrored")
+            self.available = False
+        if self.available:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def _schema():
+        import pyarrow as pa
+        return pa.schema([
+            ("unique_id", pa.string()),
+            ("report_type", pa.string()),
+            ("company", pa.string()),
+            ("mrn", pa.string()),
+            ("patient_name", pa.string()),
+            ("analyte", pa.string()),
+            ("value", pa.float64()),
+            ("unit", pa.string()),
+            ("reference_range", pa.string()),
+            ("flag", pa.string()),
+            ("pdf_flag", pa.string()),
+            ("collected_at", pa.timestamp("s")),
+            ("year", pa.int16()),
+            ("month", pa.int8()),
+            ("ingested_at", pa.timestamp("ms", tz="UTC")),
+        ])
+
+    def parts(self) -> List[str]:
+        if not self.available or not os.path.isdir(self.directory):
+            return []
+        return sorted(
+            os.path.join(self.directory, name) for name in os.listdir(self.directory)
+            if name.startswith(PART_PREFIX) and name.endswith(PART_SUFFIX)
+        )
+
+    def append(self, report_type: str, record: Dict, company: str = "") -> int:
+        """Buffer the record's numeric analytes; returns the number of rows."""
+        if not self.available or report_type not in ANALYTIC_REPORT_TYPES:
+            return 0
+        rows = analyte_rows(report_type, record, company)
+        count = len(rows["value"])
+        with self._lock:
+            if count:
+                self._buffer.append(rows)
+                self._buffered_rows += count
+            due = (self._buffered_rows >= ANALYTICS_FLUSH_ROWS
+                   or (self._buffered_rows and time.monotonic() - self._last_flush >= ANALYTICS_FLUSH_SECONDS))
+        if due:
+            self.flush()
+        return count
+
+    def _write_part(self, table) -> str:
+        import pyarrow.parquet as pq
+        name = f"{PART_PREFIX}{time.time_ns():020d}-{uuid.uuid4().hex[:8]}{PART_SUFFIX}"
+        path = os.path.join(self.directory, name)
+        tmp_path = path + ".tmp"
+        pq.write_table(table, tmp_path, compression="zstd")
+        os.replace(tmp_path, path)
+        return path
+
+    def flush(self) -> Optional[str]:
+        """Write the buffered rows as a new part file, compacting when there are many parts."""
+        if not self.available:
+            return None
+        import pyarrow as pa
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if not self._buffer:
+                return None
+            buffer, self._buffer, self._buffered_rows = self._buffer, [], 0
+            columns = {name: [value for rows in buffer for value in rows[name]] for name in buffer[0]}
+            path = self._write_part(pa.table(columns, schema=self._schema()))
+            if len(self.parts()) >= ANALYTICS_COMPACT_PARTS:
+                self._compact()
+        return path
+
+    def _dataset(self, paths: Sequence[str]):
+        import pyarrow.dataset as ds
+        from pyarrow.fs import LocalFileSystem
+        return ds.dataset(list(paths), schema=self._schema(), format="parquet",
+                          filesystem=LocalFileSystem(use_mmap=True))
+
+    def _latest(self, table, paths: Sequence[str]):
+        """Drop the rows of records that were ingested again later."""
+        import pyarrow.compute as pc
+        latest = (self._dataset(paths).to_table(columns=["unique_id", "ingested_at"])
+                  .group_by("unique_id").aggregate([("ingested_at", "max")]))
+        joined = table.join(latest, "unique_id")
+        current = joined.filter(pc.equal(joined["ingested_at"], joined["ingested_at_max"]))
+        return current.drop_columns(["ingested_at_max"])
+
+    def _compact(self) -> None:
+        paths = self.parts()
+        if len(paths) < 2:
+            return
+        table = self._latest(self._dataset(paths).to_table(), paths)
+        self._write_part(table.select(self._schema().names))
+        for path in paths:
+            os.remove(path)
+        print(f"[ANALYTICS] Compacted {len(paths)} parts into {table.num_rows} rows")
+
+    def compact(self) -> None:
+        if not self.available:
+            return
+        self.flush()
+        with self._lock:
+            self._compact()
+
+    def query(self, report_type: Optional[str] = None, analytes: Optional[List[str]] = None,
+              company: Optional[str] = None, year: Optional[int] = None,
+              date_from: Optional[str] = None, date_to: Optional[str] = None,
+              min_value: Optional[float] = None, max_value: Optional[float] = None,
+              flag: Optional[str] = None, group_by: Optional[List[str]] = None,
+              aggregates: Optional[List[str]] = None, limit: int = 1000) -> Dict:
+        """
+        Filtered scan (pushed down to the Parquet row groups), then either the
+        matching rows or one aggregate row per group.
+        """
+        import pyarrow.compute as pc
+
+        group_by = group_by or []
+        aggregates = aggregates or ["count", "mean", "median", "min", "max"]
+        unknown = [c for c in group_by if c not in GROUP_COLUMNS] + [a for a in aggregates if a not in AGGREGATES]
+        if unknown:
+            raise ValueError(f"Unknown group_by column or aggregate: {', '.join(unknown)}")
+
+        if not self.available:
+            raise RuntimeError("The analytics store needs pyarrow (pip install pyarrow) and ANALYTICS_DIR")
+        self.flush()
+        started = time.perf_counter()
+        with self._lock:
+            paths = self.parts()
+            if not paths:
+                return {"rowCount": 0, "rows": [], "elapsed_ms": 0.0}
+
+            conditions = []
+            if report_type:
+                conditions.append(pc.field("report_type") == report_type)
+            if analytes:
+                conditions.append(pc.field("analyte").isin([analyte_name(a) for a in analytes]))
+            if company:
+                conditions.append(pc.field("company") == company)
+            if year:
+                conditions.append(pc.field("year") == year)
+            if date_from:
+                conditions.append(pc.field("collected_at") >= pc.scalar(datetime.fromisoformat(date_from)))
+            if date_to:
+                conditions.append(pc.field("collected_at") < pc.scalar(datetime.fromisoformat(date_to)))
+            if flag is not None:
+                conditions.append(pc.field("flag") == flag)
+            expression = None
+            for condition in conditions:
+                expression = condition if expression is None else expression & condition
+
+            table = self._dataset(paths).to_table(filter=expression)
+            table = self._latest(table, paths)
+
+        # Value bounds after the supersede step, so an old value can't match
+        if min_value is not None:
+            table = table.filter(pc.greater_equal(table["value"], min_value))
+        if max_value is not None:
+            table = table.filter(pc.less_equal(table["value"], max_value))
+
+        result = {"rowCount": table.num_rows}
+        if group_by:
+            grouped = table.group_by(group_by).aggregate([("value", AGGREGATES[a]) for a in aggregates])
+            names = {f"value_{AGGREGATES[a]}": a for a in aggregates}
+            grouped = grouped.rename_columns([names.get(n, n) for n in grouped.column_names])
+            grouped = grouped.select(group_by + aggregates).sort_by([(c, "ascending") for c in group_by])
+            result["groups"] = grouped.to_pylist()
+        else:
+            result["rows"] = table.slice(0, limit).to_pylist()
+        result["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        return result
+
+    def rebuild(self, store: BlobStore) -> Dict:
+        """Replace the store with the last parse results kept in the text sidecars of the blob store."""
+        if not self.available:
+            raise RuntimeError("The analytics store needs pyarrow (pip install pyarrow) and ANALYTICS_DIR")
+        self.flush()
+        with self._lock:
+            old_parts = self.parts()
+        records = rows = 0
+        for key in list_sidecars(store):
+            sidecar = read_sidecar(store, key)
+            if sidecar.get("report_type") in ANALYTIC_REPORT_TYPES and sidecar.get("result"):
+                rows += self.append(sidecar["report_type"], sidecar["result"], sidecar.get("company", ""))
+                records += 1
+        with self._lock:
+            for path in old_parts:
+                os.remove(path)
+        self.compact()
+        return {"records": records, "rows": rows}
+
+    def stats(self) -> Dict:
+        paths = self.parts()
+        return {
+            "available": self.available,
+            "directory": self.directory,
+            "parts": len(paths),
+            "bytes": sum(os.path.getsize(path) for path in paths),
+            "bufferedRows": self._buffered_rows,
+        }
+
+
+analytics_store = AnalyticsStore()
@@ -0,0 +1,187 @@
+"""
+Offline batch ingestion of a directory of PDFs, e.g. a client's archive.
+
+    python batch_ingest.py ARCHIVE_DIR --out results.jsonl [--type auto] [--workers 8] [--chunksize 4]
+    python batch_ingest.py ARCHIVE_DIR --out results.parquet --checkpoint archive.checkpoint
+
+Uses the same extraction (page layout included) and parse_* functions as the API. Progress is
+checkpointed after every document, so an interrupted run picks up where it
+stopped when started again with the same --out/--checkpoint.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool
+from typing import Dict, Optional, Tuple
+
+with contextlib.redirect_stdout(io.StringIO()):
+    from main import PARSER_VERSION, PARSERS, guess_report_type, parse_pdf
+
+
+def _quiet_worker():
+    # The parsers print their raw text; keep the progress output readable
+    sys.stdout = open(os.devnull, "w")
+
+
+def process_pdf(job: Tuple[str, str, str]) -> Dict:
+    path, relative_path, report_type = job
+    filename = os.path.basename(path)
+    start = time.perf_counter()
+    try:
+        with open(path, "rb") as f:
+            content = f.read()
+        # Same extraction and parse as upload_and_store
+        data = parse_pdf(content, report_type, filename)
+        return {
+            "path": relative_path,
+            "report_type": report_type,
+            "parser_version": PARSER_VERSION,
+            "parse_ms": round((time.perf_counter() - start) * 1000, 2),
+            "data": data,
+        }
+    except Exception as e:
+        return {"path": relative_path, "report_type": report_type, "error": str(e)}
+
+
+def find_jobs(input_dir: str, report_type: str, recursive: bool):
+    jobs, skipped = [], []
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if not name.lower().endswith(".pdf"):
+                continue
+            path = os.path.join(root, name)
+            relative_path = os.path.relpath(path, input_dir)
+            resolved = report_type if report_type != "auto" else guess_report_type(name)
+            if resolved:
+                jobs.append((path, relative_path, resolved))
+            else:
+                skipped.append(relative_path)
+        if not recursive:
+            break
+    return jobs, skipped
+
+
+def load_checkpoint(path: str) -> set:
+    if not os.path.exists(path):
+        return set()
+    with open(path, "r", encoding="utf-8") as f:
+        return {line.rstrip("\n") for line in f if line.strip()}
+
+
+def write_parquet(jsonl_path: str, parquet_path: str) -> None:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit("Parquet output needs pyarrow (pip install pyarrow); the JSONL results were kept at " + jsonl_path)
+
+    columns = {"path": [], "report_type": [], "parser_version": [], "uniqueId": [], "fileName": [], "data": []}
+    with open(jsonl_path, "r", encoding="utf-8") as f:
+        for line in f:
+            row = json.loads(line)
+            columns["path"].append(row["path"])
+            columns["report_type"].append(row["report_type"])
+            columns["parser_version"].append(row["parser_version"])
+            columns["uniqueId"].append(row["data"].get("uniqueId", ""))
+            columns["fileName"].append(row["data"].get("fileName", ""))
+            # Report types have different shapes; keep the full result as JSON
+            columns["data"].append(json.dumps(row["data"], ensure_ascii=False, default=str))
+
+    pq.write_table(pa.table(columns), parquet_path, compression="zstd")
+
+
+def print_progress(done: int, total: int, errors: int, started: float, final: bool = False) -> None:
+    elapsed = time.perf_counter() - started
+    rate = done / elapsed if elapsed > 0 else 0.0
+    remaining = (total - done) / rate if rate > 0 else 0.0
+    end = "\n" if final else "\r"
+    sys.stderr.write(f"{done}/{total} docs  {rate:7.1f} docs/sec  errors {errors}  eta {remaining:6.0f}s{end}")
+    sys.stderr.flush()
+
+
+def ingest(input_dir: str, out: str, report_type: str = "auto", workers: Optional[int] = None,
+           chunksize: int = 4, checkpoint: Optional[str] = None, recursive: bool = True,
+           verbose: bool = False) -> Dict:
+    parquet = out.endswith(".parquet")
+    jsonl_path = out + ".jsonl.part" if parquet else out
+    checkpoint = checkpoint or out + ".checkpoint"
+    errors_path = out + ".errors.jsonl"
+
+    jobs, skipped = find_jobs(input_dir, report_type, recursive)
+    completed = load_checkpoint(checkpoint)
+    pending = [job for job in jobs if job[1] not in completed]
+
+    sys.stderr.write(f"{len(jobs)} PDFs found, {len(jobs) - len(pending)} already done, "
+                     f"{len(skipped)} skipped (unknown report type)\n")
+
+    done = 0
+    errors = 0
+    started = time.perf_counter()
+    last_report = 0.0
+    with open(jsonl_path, "a", encoding="utf-8") as results_file, \
+            open(checkpoint, "a", encoding="utf-8") as checkpoint_file, \
+            open(errors_path, "a", encoding="utf-8") as errors_file, \
+            Pool(processes=workers, initializer=None if verbose else _quiet_worker) as pool:
+        for row in pool.imap_unordered(process_pdf, pending, chunksize=max(1, chunksize)):
+            done += 1
+            if "error" in row:
+                errors += 1
+                errors_file.write(json.dumps(row, ensure_ascii=False) + "\n")
+                errors_file.flush()
+            else:
+                results_file.write(json.dumps(row, ensure_ascii=False, default=str) + "\n")
+                results_file.flush()
+                # Only after the result is on disk
+                checkpoint_file.write(row["path"] + "\n")
+                checkpoint_file.flush()
+
+            now = time.perf_counter()
+            if now - last_report >= 1.0:
+                print_progress(done, len(pending), errors, started)
+                last_report = now
+        # Let the workers exit on their own (leaving the block terminates them), so they flush pattern stats
+        pool.close()
+        pool.join()
+
+    print_progress(done, len(pending), errors, started, final=True)
+
+    if parquet:
+        write_parquet(jsonl_path, out)
+
+    elapsed = time.perf_counter() - started
+    return {
+        "found": len(jobs),
+        "processed": done,
+        "errors": errors,
+        "skipped": skipped,
+        "elapsed_s": round(elapsed, 2),
+        "docs_per_sec": round(done / elapsed, 2) if elapsed > 0 else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input_dir")
+    parser.add_argument("--out", required=True, help="results file, .jsonl or .parquet")
+    parser.add_argument("--type", default="auto", choices=["auto", *PARSERS],
+                        help="report type for every file, or 'auto' to use the filename prefix")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--chunksize", type=int, default=4, help="documents handed to a worker at a time")
+    parser.add_argument("--checkpoint", default=None, help="checkpoint file (default: OUT.checkpoint)")
+    parser.add_argument("--no-recursive", action="store_true", help="only the top-level directory")
+    parser.add_argument("--verbose", action="store_true", help="keep the parsers' debug output")
+    args = parser.parse_args()
+
+    summary = ingest(args.input_dir, args.out, report_type=args.type, workers=args.workers,
+                     chunksize=args.chunksize, checkpoint=args.checkpoint,
+                     recursive=not args.no_recursive, verbose=args.verbose)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
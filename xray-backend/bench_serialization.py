@@ -0,0 +1,87 @@
+"""
+Serialization benchmark over the sample corpus in uploaded_pdfs/.
+
+Compares FastAPI's default path (jsonable_encoder + json.dumps on the parser
+dicts) against the typed models rendered with orjson, in full and compact mode.
+
+    python bench_serialization.py [--repeat 2000] [--batch 100]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import time
+
+import fitz  # PyMuPDF
+from fastapi.encoders import jsonable_encoder
+
+with contextlib.redirect_stdout(io.StringIO()):
+    from main import PARSERS, UPLOAD_DIR, guess_report_type
+from models import dumps, to_model
+
+
+def load_corpus():
+    records = []
+    for filename in sorted(os.listdir(UPLOAD_DIR)):
+        report_type = guess_report_type(filename)
+        if not filename.lower().endswith(".pdf") or not report_type:
+            continue
+        with fitz.open(os.path.join(UPLOAD_DIR, filename)) as pdf:
+            separator = "\n" if report_type == "chem" else ""
+            text = separator.join(page.get_text() for page in pdf)
+        with contextlib.redirect_stdout(io.StringIO()):
+            data = PARSERS[report_type](text, filename)
+        records.append((report_type, filename, data))
+    return records
+
+
+def fastapi_default(value) -> bytes:
+    # What FastAPI does for a plain dict return value
+    return json.dumps(jsonable_encoder(value), ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def timed(fn, value, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        payload = fn(value)
+    elapsed = time.perf_counter() - start
+    return elapsed / repeat * 1e6, len(payload)
+
+
+def report(label, value, model, repeat):
+    rows = [
+        ("jsonable_encoder + json", timed(fastapi_default, value, repeat)),
+        ("model + orjson", timed(lambda v: dumps(model), None, repeat)),
+        ("model + orjson compact", timed(lambda v: dumps(model, compact=True), None, repeat)),
+    ]
+    baseline_us, baseline_bytes = rows[0][1]
+    print(f"\n{label}")
+    for name, (us, size) in rows:
+        print(f"  {name:<26} {us:10.1f} us  {size:8d} B  x{baseline_us / us:5.1f} faster  {size / baseline_bytes:6.1%} size")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--batch", type=int, default=100, help="records per simulated batch response")
+    args = parser.parse_args()
+
+    records = load_corpus()
+    if not records:
+        print(f"No PDFs found in {UPLOAD_DIR}")
+        return
+
+    for report_type, filename, data in records:
+        model = to_model(report_type, data)
+        report(f"{filename} ({report_type})", data, model, args.repeat)
+
+    # Batch response, e.g. a bulk upload of medical exams and labs
+    batch = [records[i % len(records)] for i in range(args.batch)]
+    batch_dicts = [{"data": data, "pdfUrl": filename} for _, filename, data in batch]
+    batch_models = [{"data": to_model(report_type, data), "pdfUrl": filename} for report_type, filename, data in batch]
+    report(f"batch of {args.batch} records", batch_dicts, batch_models, max(1, args.repeat // args.batch))
+
+
+if __name__ == "__main__":
+    main()
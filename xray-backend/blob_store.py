@@ -0,0 +1,444 @@
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+
+
+# Keys are paths relative to the store root, e.g. "XRAY_RADEN2025.pdf" or
+# "XRAY_RADEN2025_tiles/0/12/3_4.jpg"
+BLOB_STORE = os.getenv("BLOB_STORE", "local")
+BLOB_DIR = os.getenv("BLOB_DIR", "uploaded_pdfs")
+BLOB_CACHE_DIR = os.getenv("BLOB_CACHE_DIR", "blob_cache")
+BLOB_CACHE_MAX_BYTES = int(os.getenv("BLOB_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+# A cached blob is checked against the shared store again after this long (a re-upload on another node)
+BLOB_CACHE_REVALIDATE_SECONDS = float(os.getenv("BLOB_CACHE_REVALIDATE_SECONDS", "60"))
+# The cache directory holds the blobs under blobs/ and, in index.db, their sizes and last
+# use, shared by every process on the node (API workers, extraction and reparse pools)
+CACHE_BLOBS = "blobs"
+CACHE_INDEX = "index.db"
+# A .tmp file older than this was left by a crashed write, not one still in flight
+STALE_TMP_SECONDS = 3600
+
+
+def check_key(key: str) -> str:
+    """Reject keys that would escape the store root."""
+    parts = key.split("/")
+    if not key or key.startswith("/") or "\\" in key or any(part in ("", ".", "..") for part in parts):
+        raise ValueError(f"Invalid blob key: {key!r}")
+    return key
+
+
+class BlobStore(ABC):
+    """
+    Where the uploaded PDFs and the files derived from them live. Stores
+    with files on this node (LocalBlobStore, CachedBlobStore) also have
+    local_path(key), for FileResponse; get_blob_store returns one of them.
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        """The blob's bytes, None when missing."""
+
+    @abstractmethod
+    def put(self, key: str, data: bytes, content_type: str = "application/octet-stream") -> None:
+        """Store (or replace) a blob."""
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """Remove a blob; missing blobs are ignored."""
+
+    @abstractmethod
+    def list(self, prefix: str = "") -> List[str]:
+        """Keys starting with prefix, sorted."""
+
+    @abstractmethod
+    def stat(self, key: str) -> Optional[Dict]:
+        """{"size", "etag", "modified"} of a blob, None when missing."""
+
+    def exists(self, key: str) -> bool:
+        return self.stat(key) is not None
+
+    def delete_prefix(self, prefix: str) -> int:
+        keys = self.list(prefix)
+        for key in keys:
+            self.delete(key)
+        return len(keys)
+
+
+class LocalBlobStore(BlobStore):
+    """A directory on this node (single-node deployments and development)."""
+
+    def __init__(self, root: str = BLOB_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, *check_key(key).split("/"))
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, data: bytes, content_type: str = "application/octet-stream") -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def list(self, prefix: str = "") -> List[str]:
+        keys = []
+        for directory, _, names in os.walk(self.root):
+            relative = os.path.relpath(directory, self.root).replace(os.sep, "/")
+            for name in names:
+                key = name if relative == "." else f"{relative}/{name}"
+                if key.startswith(prefix) and not name.endswith(".tmp"):
+                    keys.append(key)
+        return sorted(keys)
+
+    def stat(self, key: str) -> Optional[Dict]:
+        try:
+            stat = os.stat(self._path(key))
+        except FileNotFoundError:
+            return None
+        return {"size": stat.st_size, "etag": f"{stat.st_mtime_ns:x}-{stat.st_size:x}", "modified": stat.st_mtime}
+
+    def local_path(self, key: str) -> Optional[str]:
+        """A local file holding the blob, None when missing."""
+        path = self._path(key)
+        return path if os.path.isfile(path) else None
+
+
+class S3BlobStore(BlobStore):
+    """
+    An S3-compatible bucket shared by every API node (AWS S3, or MinIO with
+    S3_ENDPOINT_URL). It has no local files, so get_blob_store wraps it in a
+    CachedBlobStore.
+    """
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None,
+                 region: Optional[str] = None):
+        try:
+            import boto3
+            from botocore.config import Config
+        except ImportError:
+            raise RuntimeError("BLOB_STORE=s3 needs boto3 (pip install boto3)")
+
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self.endpoint_url = endpoint_url
+        self.region = region
+        # Path-style addressing works with MinIO and other S3 stand-ins as well as AWS
+        self._client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region,
+                                    config=Config(s3={"addressing_style": "path"}, retries={"max_attempts": 5}))
+        self._missing = self._client.exceptions.NoSuchKey
+
+    def __reduce__(self):
+        # Process pools (reparse_all) pickle the store with every task; a worker
+        # builds one client and reuses it
+        return (_s3_store, (self.bucket, self.prefix, self.endpoint_url, self.region))
+
+    def _key(self, key: str) -> str:
+        return self.prefix + check_key(key)
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            return self._client.get_object(Bucket=self.bucket, Key=self._key(key))["Body"].read()
+        except self._missing:
+            return None
+
+    def put(self, key: str, data: bytes, content_type: str = "application/octet-stream") -> None:
+        self._client.put_object(Bucket=self.bucket, Key=self._key(key), Body=data, ContentType=content_type)
+
+    def delete(self, key: str) -> None:
+        self._client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+    def list(self, prefix: str = "") -> List[str]:
+        keys = []
+        paginator = self._client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix + prefix):
+            keys.extend(item["Key"][len(self.prefix):] for item in page.get("Contents", []))
+        return sorted(keys)
+
+    def stat(self, key: str) -> Optional[Dict]:
+        from botocore.exceptions import ClientError
+
+        try:
+            head = self._client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return {"size": head["ContentLength"], "etag": head["ETag"].strip('"'),
+                "modified": head["LastModified"].timestamp()}
+
+
+# Stores rebuilt in this process from a pickle, one per configuration
+_unpickled: Dict[tuple, BlobStore] = {}
+_unpickled_lock = threading.Lock()
+
+
+def _s3_store(bucket: str, prefix: str, endpoint_url: Optional[str], region: Optional[str]) -> "S3BlobStore":
+    key = ("s3", bucket, prefix, endpoint_url, region)
+    with _unpickled_lock:
+        if key not in _unpickled:
+            _unpickled[key] = S3BlobStore(bucket, prefix, endpoint_url, region)
+        return _unpickled[key]
+
+
+class CachedBlobStore(BlobStore):
+    """
+    Per-node read-through cache in front of a shared store: blobs read or
+    written on this node are kept on local disk, least recently used first
+    out once the cache exceeds max_bytes. Sizes and last use live in a
+    SQLite index next to the blobs, so every process on the node evicts
+    against the same total. A cached blob is trusted for revalidate_seconds,
+    then compared with the shared store's ETag.
+
+    A read-only handle (what process pool workers get) serves cached blobs
+    and reads the rest from the shared store without caching them; its
+    writes go to the shared store and drop the cached copy.
+    """
+
+    def __init__(self, backend: BlobStore, directory: str = BLOB_CACHE_DIR,
+                 max_bytes: int = BLOB_CACHE_MAX_BYTES, revalidate_seconds: float = BLOB_CACHE_REVALIDATE_SECONDS,
+                 read_only: bool = False):
+        self.backend = backend
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.revalidate_seconds = revalidate_seconds
+        self.read_only = read_only
+        self._blobs = os.path.join(directory, CACHE_BLOBS)
+        self._lock = threading.Lock()
+        # key -> (shared store stat, checked at); blobs cached by another process are revalidated on first use
+        self._meta: Dict[str, tuple] = {}
+        self.hits = self.misses = self.evictions = 0
+        os.makedirs(self._blobs, exist_ok=True)
+        # IMMEDIATE: a process takes the write lock before reading the total it evicts against
+        self._index = sqlite3.connect(os.path.join(directory, CACHE_INDEX), timeout=30,
+                                      check_same_thread=False, isolation_level="IMMEDIATE")
+        self._index.execute("PRAGMA journal_mode=WAL")
+        self._index.execute("PRAGMA synchronous=NORMAL")
+        with self._index:
+            self._index.execute(
+                """CREATE TABLE IF NOT EXISTS blobs (
+                       key TEXT PRIMARY KEY,
+                       size INTEGER NOT NULL,
+                       used REAL NOT NULL
+                   )"""
+            )
+            self._index.execute("CREATE INDEX IF NOT EXISTS blobs_used ON blobs (used)")
+        if not read_only:
+            self._load()
+
+    def __reduce__(self):
+        # Pool workers get a read-only handle, one per process (see _cache_reader)
+        return (_cache_reader, (self.backend, self.directory, self.max_bytes, self.revalidate_seconds))
+
+    def _load(self) -> None:
+        """Index the blobs on disk that the index lacks (and the reverse), drop stale .tmp files."""
+        found = {}
+        stale_before = time.time() - STALE_TMP_SECONDS
+        for directory, _, names in os.walk(self._blobs):
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if name.endswith(".tmp"):
+                    # Other processes may be writing theirs right now
+                    if stat.st_mtime < stale_before:
+                        self._remove(path)
+                    continue
+                key = os.path.relpath(path, self._blobs).replace(os.sep, "/")
+                found[key] = (stat.st_size, stat.st_atime)
+        with self._lock, self._index:
+            indexed = {key for key, in self._index.execute("SELECT key FROM blobs")}
+            self._index.executemany("INSERT OR IGNORE INTO blobs (key, size, used) VALUES (?, ?, ?)",
+                                    [(key, size, used) for key, (size, used) in found.items() if key not in indexed])
+            self._index.executemany("DELETE FROM blobs WHERE key = ?",
+                                    [(key,) for key in indexed if key not in found and not os.path.exists(self._path(key))])
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._blobs, *check_key(key).split("/"))
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _store(self, key: str, data: bytes, stat: Optional[Dict]) -> str:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            with self._index:
+                self._index.execute("INSERT OR REPLACE INTO blobs (key, size, used) VALUES (?, ?, ?)",
+                                    (key, len(data), time.time()))
+                evicted = self._evict(key)
+            self._meta[key] = (stat, time.monotonic())
+            for old_key in evicted:
+                self._meta.pop(old_key, None)
+            self.evictions += len(evicted)
+        for old_key in evicted:
+            self._remove(self._path(old_key))
+        return path
+
+    def _evict(self, keep: str) -> List[str]:
+        # Called with the lock held, in the index transaction; the newest entry always stays
+        total = self._index.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        evicted = []
+        if total <= self.max_bytes:
+            return evicted
+        for key, size in self._index.execute("SELECT key, size FROM blobs WHERE key != ? ORDER BY used", (keep,)).fetchall():
+            if total <= self.max_bytes:
+                break
+            evicted.append(key)
+            total -= size
+        self._index.executemany("DELETE FROM blobs WHERE key = ?", [(key,) for key in evicted])
+        return evicted
+
+    def _forget(self, key: str) -> None:
+        with self._lock:
+            with self._index:
+                self._index.execute("DELETE FROM blobs WHERE key = ?", (key,))
+            self._meta.pop(key, None)
+        self._remove(self._path(key))
+
+    def _size(self, key: str) -> Optional[int]:
+        with self._lock:
+            row = self._index.execute("SELECT size FROM blobs WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def _fresh(self, key: str) -> bool:
+        """The cached copy, if any, may be served (revalidating it when due)."""
+        size = self._size(key)
+        if size is None:
+            return False
+        with self._lock:
+            cached, checked = self._meta.get(key, (None, float("-inf")))
+        if time.monotonic() - checked < self.revalidate_seconds:
+            return True
+        stat = self.backend.stat(key)
+        if stat is None or stat["size"] != size or (cached is not None and stat["etag"] != cached["etag"]):
+            self._forget(key)
+            return False
+        with self._lock:
+            self._meta[key] = (stat, time.monotonic())
+        return True
+
+    def _cached_path(self, key: str) -> Optional[str]:
+        if not self._fresh(key):
+            return None
+        path = self._path(key)
+        if not os.path.exists(path):
+            self._forget(key)
+            return None
+        with self._lock:
+            if not self.read_only:
+                with self._index:
+                    self._index.execute("UPDATE blobs SET used = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+        return path
+
+    def _fetch(self, key: str) -> Optional[str]:
+        data = self.backend.get(key)
+        with self._lock:
+            self.misses += 1
+        if data is None:
+            return None
+        return self._store(key, data, self.backend.stat(key))
+
+    def local_path(self, key: str) -> Optional[str]:
+        """A local file holding the blob, fetched into the cache on a miss; None when missing."""
+        if self.read_only:
+            return self._cached_path(key)
+        return self._cached_path(key) or self._fetch(key)
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self.local_path(key)
+        if path is None:
+            return self.backend.get(key) if self.read_only else None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            # Evicted between the lookup and the read
+            return self.backend.get(key)
+
+    def put(self, key: str, data: bytes, content_type: str = "application/octet-stream") -> None:
+        self.backend.put(key, data, content_type)
+        if self.read_only:
+            self._forget(key)
+        else:
+            self._store(key, data, self.backend.stat(key))
+
+    def delete(self, key: str) -> None:
+        self.backend.delete(key)
+        self._forget(key)
+
+    def list(self, prefix: str = "") -> List[str]:
+        return self.backend.list(prefix)
+
+    def stat(self, key: str) -> Optional[Dict]:
+        if self._cached_path(key) is None:
+            return self.backend.stat(key)
+        with self._lock:
+            stat = self._meta.get(key, (None,))[0]
+        return stat or self.backend.stat(key)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            blobs, total = self._index.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+            return {"directory": self.directory, "blobs": blobs, "bytes": total,
+                    "maxBytes": self.max_bytes, "hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions}
+
+
+def _cache_reader(backend: BlobStore, directory: str, max_bytes: int, revalidate_seconds: float) -> CachedBlobStore:
+    key = ("cache", directory)
+    with _unpickled_lock:
+        if key not in _unpickled:
+            _unpickled[key] = CachedBlobStore(backend, directory, max_bytes, revalidate_seconds, read_only=True)
+        return _unpickled[key]
+
+
+def get_blob_store() -> BlobStore:
+    if BLOB_STORE == "s3":
+        bucket = os.getenv("S3_BUCKET")
+        if not bucket:
+            raise ValueError("BLOB_STORE=s3 needs S3_BUCKET")
+        backend = S3BlobStore(bucket, os.getenv("S3_PREFIX", ""), os.getenv("S3_ENDPOINT_URL") or None,
+                              os.getenv("S3_REGION") or None)
+        return CachedBlobStore(backend)
+    if BLOB_STORE == "local":
+        return LocalBlobStore(BLOB_DIR)
+    raise ValueError(f"Unknown BLOB_STORE: {BLOB_STORE}. Expected 'local' or 's3'")
+
+
+def blob_store_stats(store: BlobStore) -> Dict:
+    stats = {"backend": type(store).__name__}
+    if isinstance(store, CachedBlobStore):
+        stats["backend"] = type(store.backend).__name__
+        stats["cache"] = store.stats()
+    elif isinstance(store, LocalBlobStore):
+        stats["directory"] = store.root
+    return stats
@@ -0,0 +1,153 @@
+import asyncio
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, List, Optional, Sequence
+
+import orjson
+from starlette.concurrency import run_in_threadpool
+
+from models import dumps
+
+
+CHANGE_FEED_PATH = os.getenv("CHANGE_FEED_PATH", "changes.db")
+# Events kept for resuming; a client further behind is told to reload
+CHANGE_FEED_RETENTION = int(os.getenv("CHANGE_FEED_RETENTION", "10000"))
+# How often a stream re-checks the log for events published by other workers
+CHANGE_FEED_POLL_SECONDS = float(os.getenv("CHANGE_FEED_POLL_SECONDS", "2"))
+CHANGE_FEED_KEEPALIVE_SECONDS = float(os.getenv("CHANGE_FEED_KEEPALIVE_SECONDS", "15"))
+CHANGE_FEED_BATCH = 500
+
+OPERATIONS = ("insert", "update", "delete")
+
+
+class ChangeFeed:
+    """
+    Ordered log of record inserts, updates and deletes. The sequence number
+    is the client's cursor: a stream resumes after the last id it saw.
+    """
+
+    def __init__(self, path: str = CHANGE_FEED_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                """CREATE TABLE IF NOT EXISTS changes (
+                       seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                       collection TEXT NOT NULL,
+                       op TEXT NOT NULL,
+                       unique_id TEXT NOT NULL,
+                       document_id TEXT NOT NULL,
+                       data TEXT,
+                       created_at TEXT NOT NULL
+                   )"""
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS changes_collection ON changes (collection, seq)")
+        # (loop, event) of every open stream in this process
+        self._subscribers = set()
+
+    def publish(self, collection: str, op: str, unique_id: str, document_id: str = "",
+                record: Optional[Dict] = None) -> int:
+        return self.publish_many(collection, op, [(unique_id, document_id, record)])[-1]
+
+    def publish_many(self, collection: str, op: str, changes: Sequence) -> List[int]:
+        """Append (unique_id, document_id, record) changes in one commit; returns their cursors."""
+        if op not in OPERATIONS:
+            raise ValueError(f"Unknown operation: {op}. Expected one of: {', '.join(OPERATIONS)}")
+        now = datetime.now(timezone.utc).isoformat()
+        seqs = []
+        with self._lock, self._connection:
+            for unique_id, document_id, record in changes:
+                cursor = self._connection.execute(
+                    "INSERT INTO changes (collection, op, unique_id, document_id, data, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (collection, op, unique_id, document_id or "", dumps(record).decode() if record is not None else None, now),
+                )
+                seqs.append(cursor.lastrowid)
+            if any(seq % 100 == 0 for seq in seqs):
+                self._connection.execute("DELETE FROM changes WHERE seq <= ?", (seqs[-1] - CHANGE_FEED_RETENTION,))
+        self._notify()
+        return seqs
+
+    def _notify(self) -> None:
+        for loop, event in list(self._subscribers):
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                self._subscribers.discard((loop, event))
+
+    def latest(self) -> int:
+        with self._lock:
+            row = self._connection.execute("SELECT MAX(seq) FROM changes").fetchone()
+        return row[0] or 0
+
+    def oldest(self) -> int:
+        with self._lock:
+            row = self._connection.execute("SELECT MIN(seq) FROM changes").fetchone()
+        return row[0] or 0
+
+    def since(self, cursor: int, collections: Sequence[str], limit: int = CHANGE_FEED_BATCH) -> List[Dict]:
+        placeholders = ",".join("?" * len(collections))
+        with self._lock:
+            rows = self._connection.execute(
+                f"SELECT seq, collection, op, unique_id, document_id, data, created_at FROM changes "
+                f"WHERE seq > ? AND collection IN ({placeholders}) ORDER BY seq LIMIT ?",
+                [cursor, *collections, limit],
+            ).fetchall()
+        return [
+            {"seq": seq, "collection": collection, "op": op, "uniqueId": unique_id, "documentId": document_id,
+             "record": orjson.loads(data) if data else None, "createdAt": created_at}
+            for seq, collection, op, unique_id, document_id, data, created_at in rows
+        ]
+
+    async def stream(self, collections: Sequence[str], cursor: Optional[int]) -> AsyncIterator[bytes]:
+        """
+        Server-Sent Events: past events after cursor, then new ones as they
+        are published. Without a cursor only new events are sent; a cursor
+        older than the retained log gets a "reset" event instead.
+        """
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        subscriber = (loop, event)
+        self._subscribers.add(subscriber)
+        try:
+            latest = await run_in_threadpool(self.latest)
+            if cursor is None or cursor > latest:
+                cursor = latest
+            elif cursor + 1 < await run_in_threadpool(self.oldest):
+                yield _sse("reset", latest, {"cursor": latest})
+                cursor = latest
+            yield f"retry: 3000\n: cursor {cursor}\n\n".encode()
+
+            idle = 0.0
+            while True:
+                # Cleared before reading, so a publish during the read still wakes us
+                event.clear()
+                changes = await run_in_threadpool(self.since, cursor, collections)
+                for change in changes:
+                    cursor = change["seq"]
+                    yield _sse(change["op"], cursor, change)
+                if len(changes) == CHANGE_FEED_BATCH:
+                    continue
+
+                try:
+                    await asyncio.wait_for(event.wait(), CHANGE_FEED_POLL_SECONDS)
+                    idle = 0.0
+                except asyncio.TimeoutError:
+                    idle += CHANGE_FEED_POLL_SECONDS
+                    if idle >= CHANGE_FEED_KEEPALIVE_SECONDS:
+                        idle = 0.0
+                        yield b": keepalive\n\n"
+        finally:
+            self._subscribers.discard(subscriber)
+
+    def stats(self) -> Dict:
+        return {"latest": self.latest(), "oldest": self.oldest(), "streams": len(self._subscribers)}
+
+
+def _sse(event: str, seq: int, data: Dict) -> bytes:
+    return f"id: {seq}\nevent: {event}\ndata: ".encode() + dumps(data) + b"\n\n"
+
+
+change_feed = ChangeFeed()
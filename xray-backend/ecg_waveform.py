@@ -0,0 +1,317 @@
+import itertools
+import json
+import os
+import struct
+from typing import Dict, List, Optional, Tuple
+
+import fitz  # PyMuPDF
+import numpy as np
+
+from blob_store import BlobStore
+from pdf_documents import DocumentPool, open_pdf
+
+
+# The GE MAC "4x2.5x3_25_R1" layout printed on our ECG attachments: three rows
+# of four 2.5 s leads, then a 10 s lead II rhythm strip, at 25 mm/s, 10 mm/mV
+LEAD_ROWS = [
+    ["I", "aVR", "V1", "V4"],
+    ["II", "aVL", "V2", "V5"],
+    ["III", "aVF", "V3", "V6"],
+]
+RHYTHM_LEAD = "II_rhythm"
+STRIP_SECONDS = 10.0
+PAPER_SPEED_MM_S = 25.0
+GAIN_MM_MV = 10.0
+
+# Default output rate; the scanned tracings hold ~130 columns per second
+WAVEFORM_SAMPLE_RATE = int(os.getenv("ECG_WAVEFORM_SAMPLE_RATE", "100"))
+WAVEFORM_SUFFIX = ".waveform.bin"
+WAVEFORM_MAGIC = b"ECGW"
+
+# Trace pixels are dark and grey; the grid is light pink
+_DARK_GRAY = 150
+_MAX_SATURATION = 40
+_FAINT_RED = 215
+# Columns a thin trace may skip before it is considered lost
+_MAX_GAP = 6
+# Vector traces are long polylines, unlike grid lines and glyphs
+_MIN_TRACE_SEGMENTS = 20
+
+
+def _row_positions(mask: np.ndarray, rows: int, band: int) -> List[int]:
+    """
+    Baselines of the trace rows: the y positions crossed by a dark pixel in
+    the most columns, among which the `rows` most evenly spaced are chosen
+    (header and footer text is not part of an evenly spaced set).
+    """
+    height, width = mask.shape
+    sums = np.vstack([np.zeros((1, width), np.int32), np.cumsum(mask, axis=0, dtype=np.int32)])
+    ys = np.arange(height)
+    coverage = ((sums[np.minimum(height, ys + band + 1)] - sums[np.maximum(0, ys - band)]) > 0).mean(axis=1)
+
+    candidates: List[int] = []
+    for y in np.argsort(-coverage):
+        if all(abs(int(y) - c) > 2 * band for c in candidates):
+            candidates.append(int(y))
+        if len(candidates) == rows * 2:
+            break
+
+    best: Optional[Tuple[float, Tuple[int, ...]]] = None
+    for combo in itertools.combinations(sorted(candidates), rows):
+        gaps = np.diff(combo)
+        if gaps.min() < 0.85 * gaps.max():
+            continue
+        score = float(coverage[list(combo)].sum())
+        if best is None or score > best[0]:
+            best = (score, combo)
+    if best is None:
+        raise ValueError("Could not locate the ECG trace rows")
+    return list(best[1])
+
+
+def _track_row(mask: np.ndarray, baseline: int, low: int, high: int) -> np.ndarray:
+    """
+    Follow one row's trace across the image. The trace is a connected line,
+    so in each column it is the run of dark pixels touching the run picked in
+    the previous column; after a gap the run closest to the baseline is taken
+    again. Long runs are the vertical strokes of a QRS complex and contribute
+    their far end, so peaks survive. Columns without a trace are NaN.
+    """
+    band = mask[low:high]
+    centre = baseline - low
+    acquire = (high - low) / 6
+    ys = np.full(mask.shape[1], np.nan)
+    previous: Optional[Tuple[int, int]] = None
+    gap = 0
+    for x in range(band.shape[1]):
+        dark = np.flatnonzero(band[:, x])
+        if dark.size == 0:
+            gap += 1
+            if gap > _MAX_GAP:
+                previous = None
+            continue
+        breaks = np.flatnonzero(np.diff(dark) > 1)
+        starts = np.concatenate(([dark[0]], dark[breaks + 1]))
+        ends = np.concatenate((dark[breaks], [dark[-1]]))
+
+        if previous is not None:
+            touching = np.flatnonzero((starts <= previous[1] + 3) & (ends >= previous[0] - 3))
+            if touching.size == 0:
+                gap += 1
+                if gap > _MAX_GAP:
+                    previous = None
+                continue
+            i = int(touching[np.argmax(np.minimum(ends[touching], previous[1]) - np.maximum(starts[touching], previous[0]))])
+        else:
+            distance = np.maximum(0, np.maximum(starts - centre, centre - ends))
+            i = int(np.argmin(distance))
+            if distance[i] > acquire:
+                continue
+
+        start, end = int(starts[i]), int(ends[i])
+        if end - start > 4:
+            y = start if abs(start - centre) > abs(end - centre) else end
+        else:
+            y = (start + end) / 2
+        ys[x] = y + low
+        previous = (start, end)
+        gap = 0
+    return ys
+
+
+def _trace_extent(xs: np.ndarray, ys: np.ndarray) -> Tuple[float, float]:
+    """
+    First and last x of the rhythm strip's trace: from the first to the last
+    long stretch, so stray marks like the lead label do not count, while the
+    seam where the recorder's two pages were stitched together is bridged.
+    """
+    traced = xs[~np.isnan(ys)]
+    if traced.size < 2:
+        raise ValueError("No ECG trace found in the rhythm strip")
+    breaks = np.flatnonzero(np.diff(traced) > _MAX_GAP + 1)
+    starts = traced[np.concatenate(([0], breaks + 1))]
+    ends = traced[np.concatenate((breaks, [traced.size - 1]))]
+    long = (ends - starts) >= 0.05 * (xs[-1] - xs[0])
+    if not long.any():
+        raise ValueError("No ECG trace found in the rhythm strip")
+    return float(starts[long][0]), float(ends[long][-1])
+
+
+def _raster_rows(pixmap: fitz.Pixmap) -> List[Tuple[np.ndarray, np.ndarray]]:
+    if pixmap.n - pixmap.alpha < 3:
+        pixmap = fitz.Pixmap(fitz.csRGB, pixmap)
+    pixels = np.frombuffer(pixmap.samples, np.uint8).reshape(pixmap.height, pixmap.width, pixmap.n)[:, :, :3]
+    pixels = pixels.astype(np.int16)
+    gray = pixels.mean(axis=2)
+    saturation = pixels.max(axis=2) - pixels.min(axis=2)
+    grey = saturation < _MAX_SATURATION
+    mask = (gray < _DARK_GRAY) & grey
+    # The steep QRS strokes are faint one-pixel lines, as light as the darker
+    # grid dots; unlike those they run vertically, so keep faint pixels that
+    # are part of a vertical run of three
+    faint = (pixels[:, :, 0] < _FAINT_RED) & grey
+    run = faint[:-2] & faint[1:-1] & faint[2:]
+    mask[1:-1] |= run
+    mask[:-2] |= run
+    mask[2:] |= run
+
+    baselines = _row_positions(mask, len(LEAD_ROWS) + 1, band=max(4, pixmap.height // 50))
+    spacing = int(np.diff(baselines).mean())
+    xs = np.arange(mask.shape[1], dtype=np.float64)
+    rows = []
+    for baseline in baselines:
+        low = max(0, baseline - int(spacing * 0.9))
+        high = min(mask.shape[0], baseline + int(spacing * 0.9))
+        rows.append((xs, _track_row(mask, baseline, low, high)))
+    return rows
+
+
+def _vector_rows(paths: List[Dict]) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """Trace polylines grouped into rows by their median height."""
+    polylines = []
+    for path in paths:
+        points = []
+        for item in path["items"]:
+            if item[0] == "l":
+                points.extend((item[1], item[2]))
+        if points:
+            polylines.append(np.array([(p.x, p.y) for p in points], dtype=np.float64))
+
+    medians = sorted(float(np.median(line[:, 1])) for line in polylines)
+    rows_count = len(LEAD_ROWS) + 1
+    # Row centres: the largest gaps between path heights separate the rows
+    gaps = np.argsort(-np.diff(medians))[:rows_count - 1] if len(medians) >= rows_count else []
+    edges = sorted(medians[i] + (medians[i + 1] - medians[i]) / 2 for i in gaps)
+    if len(edges) != rows_count - 1:
+        raise ValueError("Could not group the ECG trace paths into rows")
+
+    rows = []
+    for r in range(rows_count):
+        low = edges[r - 1] if r > 0 else -np.inf
+        high = edges[r] if r < len(edges) else np.inf
+        members = [line for line in polylines if low <= np.median(line[:, 1]) < high]
+        points = np.concatenate(members)
+        points = points[np.argsort(points[:, 0], kind="stable")]
+        rows.append((points[:, 0], points[:, 1]))
+    return rows
+
+
+def _find_trace(page: fitz.Page):
+    """Vector trace paths when the PDF has them, otherwise the tracing image."""
+    paths = [
+        path for path in page.get_drawings()
+        if "s" in path["type"] and sum(1 for item in path["items"] if item[0] == "l") >= _MIN_TRACE_SEGMENTS
+    ]
+    if paths:
+        return "vector", paths
+
+    largest, largest_area = None, 0.0
+    for image in page.get_images(full=True):
+        for rect in page.get_image_rects(image[0]):
+            if rect.width * rect.height > largest_area:
+                largest, largest_area = image[0], rect.width * rect.height
+    if largest is None:
+        raise ValueError("No ECG tracing found on the page")
+    return "raster", largest
+
+
+def _resample(xs: np.ndarray, ys: np.ndarray, start: float, stop: float, units_per_mm: float,
+              sample_rate: int) -> np.ndarray:
+    """One lead: positions to mV around the lead's median level, at sample_rate."""
+    keep = (xs >= start) & (xs <= stop) & ~np.isnan(ys)
+    xs, ys = xs[keep], ys[keep]
+    seconds = (stop - start) / units_per_mm / PAPER_SPEED_MM_S
+    count = max(1, int(round(seconds * sample_rate)))
+    if xs.size < 2:
+        return np.zeros(count, dtype=np.float32)
+    grid = start + np.arange(count) * (stop - start) / count
+    # PDF and image y grow downwards
+    millivolts = (np.median(ys) - ys) / units_per_mm / GAIN_MM_MV
+    return np.interp(grid, xs, millivolts).astype(np.float32)
+
+
+def extract_waveforms(pdf: fitz.Document, sample_rate: int = WAVEFORM_SAMPLE_RATE) -> Dict:
+    """
+    The 12 leads and the rhythm strip of an ECG attachment as float32 arrays
+    in mV at sample_rate. The horizontal scale comes from the rhythm strip,
+    which spans STRIP_SECONDS.
+    """
+    page = pdf[0]
+    source, trace = _find_trace(page)
+    if source == "vector":
+        rows = _vector_rows(trace)
+    else:
+        rows = _raster_rows(fitz.Pixmap(pdf, trace))
+
+    rhythm_xs, rhythm_ys = rows[-1]
+    start, stop = _trace_extent(rhythm_xs, rhythm_ys)
+    units_per_mm = (stop - start) / (STRIP_SECONDS * PAPER_SPEED_MM_S)
+
+    leads: Dict[str, np.ndarray] = {}
+    width = (stop - start) / len(LEAD_ROWS[0])
+    for (xs, ys), names in zip(rows, LEAD_ROWS):
+        for i, name in enumerate(names):
+            leads[name] = _resample(xs, ys, start + i * width, start + (i + 1) * width, units_per_mm, sample_rate)
+    leads[RHYTHM_LEAD] = _resample(rhythm_xs, rhythm_ys, start, stop, units_per_mm, sample_rate)
+
+    return {"source": source, "sampleRate": sample_rate, "units": "mV", "leads": leads}
+
+
+def encode_waveforms(waveforms: Dict) -> bytes:
+    """
+    Binary form: b"ECGW", a little-endian uint32 header length, a JSON header
+    (sampleRate, units, source, and per lead its name and sample count), then
+    every lead's samples as little-endian float32, in header order.
+    """
+    leads = waveforms["leads"]
+    header = {
+        "sampleRate": waveforms["sampleRate"],
+        "units": waveforms["units"],
+        "source": waveforms["source"],
+        "leads": [{"name": name, "samples": int(values.size)} for name, values in leads.items()],
+    }
+    header_bytes = json.dumps(header, separators=(",", ":")).encode()
+    body = b"".join(values.astype("<f4").tobytes() for values in leads.values())
+    return WAVEFORM_MAGIC + struct.pack("<I", len(header_bytes)) + header_bytes + body
+
+
+def decode_waveforms(data: bytes) -> Dict:
+    if data[:4] != WAVEFORM_MAGIC:
+        raise ValueError("Not an ECG waveform file")
+    (header_length,) = struct.unpack("<I", data[4:8])
+    header = json.loads(data[8:8 + header_length])
+    offset = 8 + header_length
+    leads = {}
+    for lead in header["leads"]:
+        leads[lead["name"]] = np.frombuffer(data, dtype="<f4", count=lead["samples"], offset=offset)
+        offset += lead["samples"] * 4
+    return {"source": header["source"], "sampleRate": header["sampleRate"], "units": header["units"], "leads": leads}
+
+
+def pdf_waveforms(content: bytes) -> bytes:
+    """Encoded waveforms of an ECG PDF; runs in an extraction worker."""
+    with open_pdf(content) as pdf:
+        return encode_waveforms(extract_waveforms(pdf))
+
+
+def load_waveforms(store: BlobStore, pdf_key: str, pool: DocumentPool) -> bytes:
+    """
+    Encoded waveforms for a stored ECG PDF, cached next to it in the blob
+    store and rebuilt (in the pool's workers) when the PDF is newer than the cache.
+    """
+    cache_key = os.path.splitext(pdf_key)[0] + WAVEFORM_SUFFIX
+    pdf_stat, cache_stat = store.stat(pdf_key), store.stat(cache_key)
+    if pdf_stat is None:
+        raise FileNotFoundError(f"No PDF {pdf_key}")
+    if cache_stat is not None and cache_stat["modified"] >= pdf_stat["modified"]:
+        data = store.get(cache_key)
+        if data is not None:
+            return data
+
+    content = store.get(pdf_key)
+    if content is None:
+        raise FileNotFoundError(f"No PDF {pdf_key}")
+    data = pool.run(pdf_waveforms, content)
+
+    store.put(cache_key, data)
+    return data
@@ -0,0 +1,212 @@
+import re
+import threading
+import zlib
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import fitz  # PyMuPDF
+
+
+# Fingerprints remembered (known or not), so a layout is matched against the templates once
+TEMPLATE_CACHE_SIZE = 256
+# Words whose bottoms are this close share a row (the 2024 layout prints values 3pt below the label)
+ROW_TOLERANCE = 4.0
+
+
+def page_layout(pdf: fitz.Document) -> Dict:
+    """What fingerprinting and the coordinate extractors need: producer, page 1 size and words."""
+    page = pdf[0]
+    return {
+        "producer": (pdf.metadata or {}).get("producer") or "",
+        "width": round(page.rect.width),
+        "height": round(page.rect.height),
+        "words": [(round(w[0], 1), round(w[1], 1), round(w[2], 1), round(w[3], 1), w[4])
+                  for w in page.get_text("words")],
+    }
+
+
+def rows_of(words: List[Tuple]) -> List[List[Tuple]]:
+    """Words grouped into rows by their bottom edge, each row left to right."""
+    rows: List[List[Tuple]] = []
+    for word in sorted(words, key=lambda w: (w[3], w[0])):
+        if rows and word[3] - rows[-1][0][3] <= ROW_TOLERANCE:
+            rows[-1].append(word)
+        else:
+            rows.append([word])
+    return [sorted(row, key=lambda w: w[0]) for row in rows]
+
+
+# The lab system's report layouts. columns are the left edges of the flag, result, unit and
+# reference range columns; header is the table heading that anchors the fingerprint.
+TEMPLATES = {
+    # 2025 reports: "Name : AMY A RADEN", US letter, labels and values on one baseline
+    "hclab-2025": {
+        "producer": "FPDF",
+        "size": (612, 792),
+        "anchors": ("Name", ":", "Careprovider"),
+        "header": ("TEST", "Result", "Unit", "Biological"),
+        "columns": (190, 215, 360, 450),
+    },
+    # 2024 reports: "Order Number" block, wider page, values printed just below the label
+    "hclab-2024": {
+        "producer": "FPDF",
+        "size": (660, 792),
+        "anchors": ("Order", "Number", "Careprovider"),
+        "header": ("TEST", "Result", "Unit", "Biological"),
+        "columns": (235, 250, 370, 455),
+    },
+    # 2023 clinical chemistry: "Lab No. :" block
+    "chem-2023": {
+        "producer": "FPDF",
+        "size": (612, 792),
+        "anchors": ("Lab", "No.", "Clinician"),
+        "header": ("Test", "Name", "Result", "Unit", "Reference"),
+        "columns": (235, 248, 372, 445),
+    },
+}
+
+# Printed test name -> result field; CBC names repeat in the absolute count section
+TABLE_FIELDS = {
+    "cbc": {
+        "RBC Count": "rbc", "Hematocrit": "hematocrit", "Hemoglobin": "hemoglobin", "MCV": "mcv",
+        "MCH": "mch", "MCHC": "mchc", "RDW": "rdw", "Platelet Count": "platelets", "MPV": "mpv",
+        "WBC Count": "wbc", "Neutrophil": "neutrophils_percent", "Lymphocytes": "lymphocytes_percent",
+        "Monocytes": "monocytes_percent", "Eosinophil": "eosinophils_percent", "Basophil": "basophils_percent",
+    },
+    "cbc:WBC Absolute Count": {
+        "Neutrophil": "neutrophils_abs", "Lymphocyte": "lymphocytes_abs", "Monocyte": "monocytes_abs",
+        "Eosinophil": "eosinophils_abs", "Basophil": "basophils_abs",
+    },
+    "urinalysis": {
+        "Color": "color", "Clarity": "clarity", "Glucose": "glucose", "Bilirubin": "bilirubin",
+        "Ketones": "ketones", "Specific Gravity": "specific_gravity", "Blood": "blood", "PH": "ph",
+        "Protein": "protein", "Urobilinogen": "urobilinogen", "Nitrite": "nitrite",
+        "Leukocyte Esterase": "leukocyte_esterase", "RBC": "rbc", "WBC": "wbc",
+        "Epithelial Cells": "epithelial_cells", "Bacteria": "bacteria", "Hyaline Cast": "hyaline_cast",
+        "Remarks:": "remarks",
+    },
+    "lipid": {
+        "ALT/SGPT": "alt_sgpt", "ALT": "alt_sgpt", "Cholesterol (Total)": "total_cholesterol",
+        "Triglycerides": "triglycerides", "Cholesterol HDL": "hdl_cholesterol",
+        "Cholesterol LDL": "ldl_cholesterol", "VLDL": "vldl",
+    },
+    # The 2024 layout prints a heading ("Glucose, Fasting (FBS)") above the row with the result
+    "chem": {
+        "Fasting Blood Sugar": "fbs", "Blood Uric Acid (BUA)": "bua", "Blood Uric Acid BUA": "bua",
+        "Creatinine, Serum": "creatinine", "Creatinine Serum": "creatinine", "ALT/SGPT": "sgpt", "ALT": "sgpt",
+        "Cholesterol (Total)": "cholesterol", "Cholesterol HDL": "hdl", "Cholesterol LDL": "ldl",
+        "Triglycerides": "triglycerides",
+    },
+}
+
+
+class LabTemplates:
+    """
+    Recognises the lab system's report layouts by producer, page size and
+    anchor words, and reads the result table by column position instead of
+    trying fallback regexes. A layout that matches no template gets None and
+    the parsers' regex chains. Template ids are cached by fingerprint.
+    """
+
+    def __init__(self, templates: Dict = TEMPLATES):
+        self.templates = templates
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[str, Optional[str]]" = OrderedDict()
+        self._counts: Counter = Counter()
+
+    @staticmethod
+    def fingerprint(layout: Dict) -> str:
+        """producer | page size | labels down the left of the first rows (digits dropped, as in template_key)."""
+        top = [re.sub(r"\d+", "", w[4]) for row in rows_of(layout["words"])[:8] for w in row if w[0] < 90]
+        key = f"{layout['producer']}|{layout['width']}x{layout['height']}|{' '.join(top)}"
+        return f"{zlib.crc32(key.encode()):08x}"
+
+    def _match(self, layout: Dict) -> Optional[str]:
+        words = {w[4] for w in layout["words"]}
+        rows = [" ".join(w[4] for w in row) for row in rows_of(layout["words"])]
+        for template_id, template in self.templates.items():
+            if not layout["producer"].startswith(template["producer"]):
+                continue
+            if (layout["width"], layout["height"]) != template["size"]:
+                continue
+            if not all(anchor in words for anchor in template["anchors"]):
+                continue
+            if any(row.startswith(" ".join(template["header"])) for row in rows):
+                return template_id
+        return None
+
+    def identify(self, layout: Optional[Dict]) -> Optional[str]:
+        if not layout or not layout.get("words"):
+            return None
+        fingerprint = self.fingerprint(layout)
+        with self._lock:
+            if fingerprint in self._cache:
+                self._cache.move_to_end(fingerprint)
+                template_id = self._cache[fingerprint]
+                self._counts[template_id or "unknown"] += 1
+                return template_id
+        template_id = self._match(layout)
+        with self._lock:
+            self._cache[fingerprint] = template_id
+            while len(self._cache) > TEMPLATE_CACHE_SIZE:
+                self._cache.popitem(last=False)
+            self._counts[template_id or "unknown"] += 1
+        return template_id
+
+    def table(self, report_type: str, layout: Optional[Dict]) -> Optional[Dict[str, Dict]]:
+        """
+        Every result field of the report type, {field: {result, unit,
+        reference_range, flag}}, read from a known layout; None for an
+        unknown layout (or one whose table holds none of the type's tests).
+        """
+        if report_type not in TABLE_FIELDS:
+            return None
+        template_id = self.identify(layout)
+        if template_id is None:
+            return None
+        template = self.templates[template_id]
+        flag_x, result_x, unit_x, range_x = template["columns"]
+        header = " ".join(template["header"])
+
+        values: Dict[str, Dict] = {}
+        fields = TABLE_FIELDS[report_type]
+        in_table = False
+        for row in rows_of(layout["words"]):
+            if not in_table:
+                in_table = " ".join(w[4] for w in row).startswith(header)
+                continue
+            label = " ".join(w[4] for w in row if w[0] < flag_x)
+            flag = [w[4] for w in row if flag_x <= w[0] < result_x]
+            result = [w[4] for w in row if result_x <= w[0] < unit_x]
+            unit = [w[4] for w in row if unit_x <= w[0] < range_x]
+            reference_range = [w[4] for w in row if w[0] >= range_x]
+            if not label:
+                continue
+            if not (flag or result or unit or reference_range):
+                # A section heading; the CBC absolute counts reuse the differential's names
+                fields = TABLE_FIELDS.get(f"{report_type}:{label}", fields)
+                continue
+            field = fields.get(label)
+            if field and field not in values:
+                values[field] = {
+                    "result": " ".join(result),
+                    "unit": " ".join(unit),
+                    "reference_range": " ".join(reference_range),
+                    # H / L / N, or whatever else the lab prints there (HH, LL, A, *)
+                    "flag": " ".join(flag),
+                }
+        if not values:
+            return None
+        # Tests the report doesn't print come back empty, as from the parsers
+        for name, section in TABLE_FIELDS.items():
+            if name.split(":")[0] == report_type:
+                for field in section.values():
+                    values.setdefault(field, {"result": "", "unit": "", "reference_range": "", "flag": ""})
+        return values
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"templates": list(self.templates), "fingerprints": len(self._cache), "documents": dict(self._counts)}
+
+
+lab_templates = LabTemplates()
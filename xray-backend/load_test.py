@@ -0,0 +1,274 @@
+"""
+End-to-end HTTP load test of the API against the uploaded_pdfs/ corpus.
+
+    python load_test.py                                   # uvicorn, 1/4/16/32 concurrent, 20 s each
+    python load_test.py --concurrency 8,64 --duration 60 --uvicorn-workers 4
+    python load_test.py --mix extract=6,upload=3,view=1 --clients 5
+    python load_test.py --mode inprocess                  # httpx ASGI transport, no sockets
+    python load_test.py --url http://staging:8000         # an already running server
+
+The app is started in a scratch copy of the corpus (uploads, sidecars and
+records.db stay out of the repo). Every level reports throughput, latency
+percentiles and the error rate per request kind.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+CORPUS_DIR = os.path.join(BACKEND_DIR, "uploaded_pdfs")
+
+# Report type -> preview route, as called by the admin pages
+EXTRACT_ROUTES = {
+    "xray": "/extract-xray",
+    "cbc": "/extract-cbc",
+    "urinalysis": "/extract-urinalysis",
+    "lipid": "/extract-lipid-profile",
+    "ecg": "/extract-ecg",
+    "medical": "/extract-medical-exam",
+    "chem": "/extract-chem",
+}
+REQUEST_KINDS = ("extract", "upload", "view")
+# Same as main.REPORT_TYPE_PREFIXES; importing main here would create its
+# upload directory and record store in the current directory
+TYPE_PREFIXES = [
+    ("XRAY", "xray"), ("CBC", "cbc"), ("UA", "urinalysis"), ("URINALYSIS", "urinalysis"),
+    ("ECG", "ecg"), ("MEDICAL", "medical"), ("MEXAM", "medical"), ("SGPT", "lipid"),
+    ("LIPID", "lipid"), ("FBS", "chem"), ("CHEM", "chem"),
+]
+
+
+def load_corpus(directory: str) -> List[Tuple[str, str, bytes]]:
+    corpus = []
+    for name in sorted(os.listdir(directory)):
+        if not name.lower().endswith(".pdf"):
+            continue
+        report_type = next((t for prefix, t in TYPE_PREFIXES if name.upper().startswith(prefix)), None)
+        if report_type:
+            with open(os.path.join(directory, name), "rb") as f:
+                corpus.append((name, report_type, f.read()))
+    return corpus
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        kind, _, weight = part.partition("=")
+        kind = kind.strip()
+        if kind not in REQUEST_KINDS:
+            raise SystemExit(f"Unknown request kind in --mix: {kind} (expected {', '.join(REQUEST_KINDS)})")
+        weights[kind] = float(weight or 1)
+    return weights
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def prepare_workdir() -> str:
+    """Scratch working directory with a copy of the corpus PDFs."""
+    workdir = tempfile.mkdtemp(prefix="apecentral-load-")
+    os.makedirs(os.path.join(workdir, "uploaded_pdfs"))
+    for name in os.listdir(CORPUS_DIR):
+        if name.lower().endswith(".pdf"):
+            shutil.copy2(os.path.join(CORPUS_DIR, name), os.path.join(workdir, "uploaded_pdfs", name))
+    return workdir
+
+
+async def wait_ready(client: httpx.AsyncClient, timeout: float = 60.0) -> None:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if (await client.get("/readyz")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.25)
+    raise SystemExit("The server did not become ready in time")
+
+
+async def send(client: httpx.AsyncClient, kind: str, document: Tuple[str, str, bytes],
+               headers: Dict[str, str]) -> httpx.Response:
+    name, report_type, content = document
+    if kind == "view":
+        return await client.get(f"/view-pdf/{name}", headers=headers)
+    files = {"file": (name, content, "application/pdf")}
+    if kind == "upload":
+        return await client.post(f"/upload-and-store?type={report_type}", files=files, headers=headers)
+    return await client.post(EXTRACT_ROUTES[report_type], files=files, headers=headers)
+
+
+async def run_level(client: httpx.AsyncClient, corpus: List[Tuple[str, str, bytes]], weights: Dict[str, float],
+                    concurrency: int, duration: float, clients: int, seed: int) -> Dict:
+    kinds, kind_weights = list(weights), list(weights.values())
+    samples: List[Tuple[str, float, bool]] = []
+    errors: Dict[str, int] = {}
+    stop_at = time.perf_counter() + duration
+
+    async def user(number: int):
+        rng = random.Random(seed * 1000 + number)
+        # Spread the users over a few companies to exercise fair queueing
+        headers = {"X-Company": f"loadtest-{number % clients}"}
+        while time.perf_counter() < stop_at:
+            kind = rng.choices(kinds, kind_weights)[0]
+            document = rng.choice(corpus)
+            start = time.perf_counter()
+            try:
+                response = await send(client, kind, document, headers)
+                ok = response.status_code < 400
+                if not ok:
+                    key = f"{kind} HTTP {response.status_code}"
+                    errors[key] = errors.get(key, 0) + 1
+            except httpx.HTTPError as e:
+                ok = False
+                key = f"{kind} {type(e).__name__}"
+                errors[key] = errors.get(key, 0) + 1
+            samples.append((kind, time.perf_counter() - start, ok))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    return {"concurrency": concurrency, "elapsed_s": round(elapsed, 2), "errors": errors,
+            "overall": summarize(samples, elapsed),
+            "by_kind": {kind: summarize([s for s in samples if s[0] == kind], elapsed) for kind in kinds}}
+
+
+def summarize(samples: List[Tuple[str, float, bool]], elapsed: float) -> Dict:
+    if not samples:
+        return {"requests": 0}
+    latencies = np.array([latency for _, latency, _ in samples]) * 1000
+    failed = sum(1 for _, _, ok in samples if not ok)
+    p50, p90, p95, p99 = np.percentile(latencies, [50, 90, 95, 99])
+    return {
+        "requests": len(samples),
+        "rps": round(len(samples) / elapsed, 2),
+        "error_rate": round(failed / len(samples), 4),
+        "p50_ms": round(float(p50), 1),
+        "p90_ms": round(float(p90), 1),
+        "p95_ms": round(float(p95), 1),
+        "p99_ms": round(float(p99), 1),
+        "max_ms": round(float(latencies.max()), 1),
+    }
+
+
+def print_report(results: List[Dict]) -> None:
+    print(f"{'conc':>5} {'kind':>8} {'reqs':>6} {'req/s':>8} {'err%':>6} "
+          f"{'p50':>8} {'p90':>8} {'p95':>8} {'p99':>8} {'max':>8}  (ms)")
+    for level in results:
+        rows = [("all", level["overall"])] + list(level["by_kind"].items())
+        for kind, stats in rows:
+            if not stats["requests"]:
+                continue
+            print(f"{level['concurrency']:>5} {kind:>8} {stats['requests']:>6} {stats['rps']:>8.2f} "
+                  f"{stats['error_rate'] * 100:>6.2f} {stats['p50_ms']:>8.1f} {stats['p90_ms']:>8.1f} "
+                  f"{stats['p95_ms']:>8.1f} {stats['p99_ms']:>8.1f} {stats['max_ms']:>8.1f}")
+        for error, count in sorted(level["errors"].items()):
+            print(f"{'':>5} {'':>8} {count:>6}  {error}")
+
+
+async def run_levels(client: httpx.AsyncClient, args, corpus, weights) -> List[Dict]:
+    await wait_ready(client)
+    results = []
+    for i, concurrency in enumerate(args.concurrency):
+        sys.stderr.write(f"Concurrency {concurrency} for {args.duration:.0f} s...\n")
+        results.append(await run_level(client, corpus, weights, concurrency, args.duration,
+                                       max(1, args.clients), args.seed + i))
+    return results
+
+
+async def run_inprocess(args, corpus, weights, workdir: str) -> List[Dict]:
+    os.chdir(workdir)
+    sys.path.insert(0, BACKEND_DIR)
+    # The parsers print their raw text for every request
+    with contextlib.redirect_stdout(io.StringIO()):
+        import main
+    transport = httpx.ASGITransport(app=main.app)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        async with main.app.router.lifespan_context(main.app):
+            async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=args.timeout) as client:
+                return await run_levels(client, args, corpus, weights)
+
+
+async def run_against(url: str, args, corpus, weights) -> List[Dict]:
+    limits = httpx.Limits(max_connections=max(args.concurrency))
+    async with httpx.AsyncClient(base_url=url, timeout=args.timeout, limits=limits) as client:
+        return await run_levels(client, args, corpus, weights)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["uvicorn", "inprocess"], default="uvicorn")
+    parser.add_argument("--url", default=None, help="test an already running server instead of starting one")
+    parser.add_argument("--uvicorn-workers", type=int, default=1)
+    parser.add_argument("--concurrency", default="1,4,16,32", help="comma separated levels to sweep")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per level")
+    parser.add_argument("--mix", default="extract=6,upload=2,view=2", help="request kinds and their weights")
+    parser.add_argument("--clients", type=int, default=1, help="distinct X-Company values")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", default=None, help="also write the results to this file")
+    parser.add_argument("--keep-workdir", action="store_true")
+    args = parser.parse_args()
+    args.concurrency = [int(level) for level in args.concurrency.split(",") if level.strip()]
+
+    corpus = load_corpus(CORPUS_DIR)
+    if not corpus:
+        raise SystemExit(f"No PDFs with a known report type in {CORPUS_DIR}")
+    weights = parse_mix(args.mix)
+
+    workdir: Optional[str] = None
+    server: Optional[subprocess.Popen] = None
+    try:
+        if args.url:
+            results = asyncio.run(run_against(args.url, args, corpus, weights))
+        else:
+            workdir = prepare_workdir()
+            if args.mode == "inprocess":
+                results = asyncio.run(run_inprocess(args, corpus, weights, workdir))
+            else:
+                port = free_port()
+                log = open(os.path.join(workdir, "server.log"), "w")
+                server = subprocess.Popen(
+                    [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", BACKEND_DIR,
+                     "--host", "127.0.0.1", "--port", str(port),
+                     "--workers", str(args.uvicorn_workers), "--log-level", "warning"],
+                    cwd=workdir, stdout=log, stderr=subprocess.STDOUT,
+                )
+                results = asyncio.run(run_against(f"http://127.0.0.1:{port}", args, corpus, weights))
+    finally:
+        if server is not None:
+            server.terminate()
+            try:
+                server.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                server.kill()
+        if workdir and not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+        elif workdir:
+            sys.stderr.write(f"Working directory kept at {workdir}\n")
+
+    print_report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"mix": weights, "duration_s": args.duration, "levels": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
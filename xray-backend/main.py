@@ -1,92 +1,845 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Request
+import time
+_import_started = time.perf_counter()
+
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request, Body, Query
 from urllib.parse import quote
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-import fitz  # PyMuPDF
-from typing import Dict
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import ClientDisconnect
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime
+import io
 import re
 import os
 from pathlib import Path
-import shutil
 import traceback
+import asyncio
+from email.utils import formatdate
+import orjson
+
+from admin_auth import is_admin
+from analytics_store import analytics_store
+from blob_store import BLOB_DIR, blob_store_stats, get_blob_store
+from change_feed import change_feed
+from ecg_waveform import decode_waveforms, encode_waveforms, load_waveforms
+from lab_templates import lab_templates
+from models import ModelResponse, to_model
+from pattern_stats import pattern_stats, template_key
+from pdf_archive import pdf_archiver
+from pdf_documents import document_pool, extract_pages
+from pdf_preflight import (ROUTE_FAST, PreflightError, check_bytes, list_quarantine, preflight, public_facts,
+                           quarantine)
+from profiling import (ProfileIdMiddleware, is_profiler, is_profiling, list_profiles, new_profile_id,
+                       profile_call, profile_path, should_profile)
+from record_store import COLLECTIONS, get_record_store, persist_batch
+from reference_ranges import screen_records
+from resumable_uploads import TUS_VERSION, UploadError, parse_metadata, resumable_uploads
+from scheduler import BULK, INTERACTIVE, AdmissionScheduler
+from search_index import search_index
+from shadow_parsers import shadow_parsers
+from sidecars import SIDECAR_SPANS, reparse_all, write_sidecar
+from structured_import import IMPORT_TYPES, ExportMapper, read_export
+from warmup import WarmupState, start_warmup
+from xray_tiles import TILE_FORMAT, build_pyramids, dzi_xml, read_manifest, tiles_prefix
+
+IMPORT_SECONDS = time.perf_counter() - _import_started
 
 
 app = FastAPI()
 
-UPLOAD_DIR = "uploaded_pdfs"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+# PDFs, sidecars, tiles and waveform caches go through blob_store (BLOB_STORE=local|s3);
+# UPLOAD_DIR is the local store's directory, which the dev scripts read the sample corpus from
+UPLOAD_DIR = BLOB_DIR
+
+# Bump whenever a parse_* function changes what it extracts, then run /reparse
+PARSER_VERSION = "3"
 
 # Update your existing CORS middleware configuration
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["https://apecentral.vercel.app"],  # Add both localhost variants
     allow_credentials=True,
-    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],  # Explicitly list methods
+    allow_methods=["GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],  # Explicitly list methods
     allow_headers=["*"],
     expose_headers=["*"]  # Add this to expose all headers
 )
 
+app.add_middleware(ProfileIdMiddleware)
+
+warmup_state = WarmupState()
+scheduler = AdmissionScheduler.from_env()
+record_store = get_record_store()
+blob_store = get_blob_store()
+
+
+@app.on_event("startup")
+async def warm_up_parsers():
+    document_pool.start()
+    start_warmup(warmup_state, PARSERS, parse_pdf, document_pool.warm)
+
+
+@app.on_event("startup")
+async def expire_uploads():
+    resumable_uploads.expire()
+
+
+@app.on_event("shutdown")
+async def stop_document_pool():
+    document_pool.shutdown()
+    pattern_stats.flush()
+    analytics_store.flush()
+
+
+def extract_pdf_pages(content: bytes, with_spans: bool = False,
+                      with_layout: bool = False) -> Tuple[List[str], Optional[List], Optional[Dict]]:
+    """
+    Text of every page (scanned pages without a text layer go through OCR),
+    plus the positioned spans per page and the page 1 layout when asked for.
+    PyMuPDF runs in the recycled extraction workers of pdf_documents.
+    """
+    if is_profiling():
+        # Keep the extraction in this thread so the profile includes it
+        return extract_pages(content, with_spans, with_layout)
+    return document_pool.extract(content, with_spans, with_layout)
+
+
+def extract_pdf_text(content: bytes, separator: str = "") -> str:
+    pages, _, _ = extract_pdf_pages(content)
+    return separator.join(pages)
+
+
 @app.get("/")
 async def root():
     return {"message": "Medical Records API is running"}
 
 
+@app.get("/healthz")
+async def healthz():
+    # Liveness only: the process is up and serving requests
+    return {"status": "ok", "import_ms": round(IMPORT_SECONDS * 1000, 2)}
+
+
+@app.get("/readyz")
+async def readyz():
+    # Readiness: only route uploads here once the parsers are warm
+    state = warmup_state.as_dict()
+    state["import_ms"] = round(IMPORT_SECONDS * 1000, 2)
+    return JSONResponse(state, status_code=200 if warmup_state.ready else 503)
+
+
+
+def quarantine_failed(content: bytes, filename: str, error: PreflightError) -> None:
+    """Keep a file that failed the preflight for a look, when it is worth one."""
+    if error.quarantine:
+        try:
+            quarantine(blob_store, content, error)
+        except Exception as store_error:
+            print(f"[PREFLIGHT ERROR] Could not quarantine {filename}: {str(store_error)}")
+
+
+def check_pdf(content: bytes, filename: str, report_type: str = "") -> Dict:
+    """
+    Preflight an upload; files that fail it are quarantined, then re-raised.
+    The MuPDF probe runs in the extraction workers of pdf_documents, so call
+    this inside a scheduler slot.
+    """
+    try:
+        if is_profiling():
+            # Keep the probe in this thread so the profile includes it
+            return preflight(content, filename, report_type in LAYOUT_PARSERS)
+        return document_pool.run(preflight, content, filename, report_type in LAYOUT_PARSERS)
+    except PreflightError as e:
+        quarantine_failed(content, filename, e)
+        raise
+
+
+def check_and_process(content: bytes, filename: str, report_type: str, company: str = "") -> Tuple[Dict, Dict]:
+    """check_pdf, then process_upload with its facts: (preflight facts, parse result)."""
+    facts = check_pdf(content, filename, report_type)
+    return facts, process_upload(content, filename, report_type, company, facts)
+
+
+def preflight_upload(request: Request, content: bytes, filename: str) -> None:
+    """Reject empty, non-PDF and truncated files from their bytes in microseconds, before they take a bulk slot."""
+    try:
+        check_bytes(content, filename)
+    except PreflightError as e:
+        quarantine_failed(content, filename, e)
+        request.state.preflight = public_facts(e.facts)
+        raise HTTPException(status_code=e.status, detail=e.detail)
+
+
+def process_upload(content: bytes, filename: str, report_type: str, company: str = "",
+                   preflight_facts: Optional[Dict] = None) -> Dict:
+    """Store an uploaded PDF, extract its text and parse it (runs in a worker thread)."""
+    # Save PDF to the blob store, shared by every API node (rewritten smaller first when archiving at upload)
+    filename = os.path.basename(filename)
+    pdf_archiver.store(blob_store, filename, content, report_type, document_pool)
+
+    # Extract text; the preflight already read the whole of a one-page text PDF
+    if preflight_facts and preflight_facts["route"] == ROUTE_FAST and not SIDECAR_SPANS:
+        pages, spans, layout = preflight_facts["pages"], None, preflight_facts.get("layout")
+    else:
+        pages, spans, layout = extract_pdf_pages(content, with_spans=SIDECAR_SPANS,
+                                                 with_layout=report_type in LAYOUT_PARSERS)
+    full_text = "".join(pages)
+
+    # Dispatch to correct parser; lab reports in a known layout are read by position
+    if layout is not None:
+        data = PARSERS[report_type](full_text, filename, layout=layout)
+    else:
+        data = PARSERS[report_type](full_text, filename)
+
+    # A sample of uploads also runs the candidate parser of the type, if one is configured, off this thread
+    shadow_parsers.maybe_submit(report_type, PARSERS[report_type], full_text, filename, data, layout)
+
+    data["pdfUrl"] = quote(filename)
+
+    # Keep the extracted text next to the PDF so it can be re-parsed later
+    try:
+        write_sidecar(blob_store, filename, report_type, pages, "", data, PARSER_VERSION, spans, company=company,
+                      layout=layout)
+    except Exception as e:
+        print(f"[SIDECAR ERROR] {filename}: {str(e)}")
+
+    # Numeric lab results are mirrored for population queries
+    try:
+        analytics_store.append(report_type, data, company)
+    except Exception as e:
+        print(f"[ANALYTICS ERROR] {filename}: {str(e)}")
+
+    # Radiographs are cut into zoomable tiles for the admin viewer (written in the background)
+    if report_type == "xray":
+        try:
+            build_pyramids(blob_store, filename, content, document_pool)
+        except Exception as e:
+            print(f"[TILES ERROR] {filename}: {str(e)}")
+
+    return data
+
+
+def parse_pdf(content: bytes, report_type: str, filename: str, separator: str = "") -> Dict:
+    """
+    Extract and parse without storing anything (the /extract-* previews and
+    batch_ingest.py); lab reports in a known layout are read by position,
+    as in process_upload.
+    """
+    pages, _, layout = extract_pdf_pages(content, with_layout=report_type in LAYOUT_PARSERS)
+    text = separator.join(pages)
+    if layout is not None:
+        return PARSERS[report_type](text, filename, layout=layout)
+    return PARSERS[report_type](text, filename)
+
+
+def require_admin(request: Request, detail: str) -> None:
+    """403 unless the caller is an admin (admin token or an admin's Firebase ID token); blocking, see admin_auth."""
+    try:
+        admin = is_admin(request.headers)
+    except RuntimeError as e:
+        # A bearer token that cannot be checked here (no google-auth, no FIREBASE_PROJECT)
+        raise HTTPException(status_code=503, detail=str(e))
+    if not admin:
+        raise HTTPException(status_code=403, detail=detail)
+
+
+def client_key(request: Request) -> str:
+    # Fair queueing is per company when the frontend says which one, else per caller
+    return (
+        request.headers.get("X-Company")
+        or request.headers.get("X-Client-Id")
+        or (request.client.host if request.client else "unknown")
+    )
+
+
+async def run_scheduled(request: Request, lane: str, fn, *args):
+    """Wait for a slot in the lane, then run the blocking work off the event loop."""
+    async with scheduler.slot(lane, client_key(request)):
+        if should_profile(request.headers):
+            request.state.profile_id = new_profile_id()
+            name = " ".join([fn.__name__] + [arg for arg in args if isinstance(arg, str) and arg])
+            return await run_in_threadpool(profile_call, request.state.profile_id, name, fn, *args)
+        return await run_in_threadpool(fn, *args)
+
+
+@app.get("/scheduler")
+async def scheduler_stats():
+    return scheduler.stats()
+
+
+@app.get("/profiles")
+async def profiles(request: Request, limit: int = 50):
+    if not is_profiler(request.headers):
+        raise HTTPException(status_code=403, detail="Profiles are restricted to admins")
+    return {"profiles": list_profiles(limit)}
+
+
+@app.get("/profiles/{profile_id}")
+async def get_profile(request: Request, profile_id: str, format: str = "speedscope"):
+    """The saved profile: speedscope JSON (open in speedscope.app) or folded stacks for flamegraph.pl."""
+    if not is_profiler(request.headers):
+        raise HTTPException(status_code=403, detail="Profiles are restricted to admins")
+    path = profile_path(profile_id, folded=format == "folded")
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    media_type = "text/plain" if format == "folded" else "application/json"
+    return FileResponse(path, media_type=media_type, filename=os.path.basename(path))
+
+
+@app.get("/pattern-stats")
+async def get_pattern_stats(type: Optional[str] = None):
+    """Which fallback pattern matched each field, per report type and lab template."""
+    return pattern_stats.summary(type)
+
+
+@app.get("/lab-templates")
+async def get_lab_templates():
+    """Known lab report layouts and how many uploads matched each (or none)."""
+    return lab_templates.stats()
+
+
+@app.get("/shadow")
+async def get_shadow(request: Request, type: Optional[str] = None, diffs: bool = False):
+    """Candidate parsers run in shadow mode: field diffs against production and the latency ratio."""
+    if diffs:
+        await run_in_threadpool(require_admin, request, "Shadow diffs contain patient data and are restricted to admins")
+    return shadow_parsers.summary(type, diffs)
+
+
+@app.delete("/shadow")
+async def reset_shadow(request: Request, type: Optional[str] = None):
+    """Start the counts over, e.g. after changing a candidate."""
+    await run_in_threadpool(require_admin, request, "Resetting shadow stats is restricted to admins")
+    shadow_parsers.reset(type)
+    return {"reset": True}
+
+
+@app.get("/analytics/query")
+async def analytics_query(
+    request: Request,
+    type: Optional[str] = None,
+    analyte: Optional[str] = None,
+    company: Optional[str] = None,
+    year: Optional[int] = None,
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    min_value: Optional[float] = Query(None, alias="min"),
+    max_value: Optional[float] = Query(None, alias="max"),
+    flag: Optional[str] = None,
+    group_by: Optional[str] = None,
+    agg: Optional[str] = None,
+    limit: int = 1000,
+):
+    """
+    Population queries over the numeric lab results, e.g.
+    ?analyte=ldl_cholesterol&min=160&year=2025 (company from X-Company unless
+    given) or ?analyte=hemoglobin&group_by=year&agg=median,count.
+    """
+    def split(value: Optional[str]) -> List[str]:
+        return [part.strip() for part in value.split(",") if part.strip()] if value else []
+
+    try:
+        return await run_in_threadpool(
+            analytics_store.query, type, split(analyte), company or request.headers.get("X-Company"), year,
+            date_from, date_to, min_value, max_value, flag, split(group_by), split(agg), limit,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+@app.get("/analytics/stats")
+async def analytics_stats():
+    return analytics_store.stats()
+
+
+@app.post("/analytics/rebuild")
+async def analytics_rebuild(request: Request):
+    """Rebuild the analytics store from the text sidecars (e.g. after a /reparse?write=true)."""
+    await run_in_threadpool(require_admin, request, "Rebuilding analytics is restricted to admins")
+    try:
+        return await run_in_threadpool(analytics_store.rebuild, blob_store)
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+@app.get("/search")
+async def search(request: Request, q: str, type: Optional[str] = None, company: Optional[str] = None,
+                 limit: int = 20, fuzzy: bool = True):
+    """
+    Ranked search over patient names and report narratives (x-ray and ECG
+    interpretation, medical exam remarks), tolerant of misspelled names.
+    """
+    if type and type not in PARSERS:
+        raise HTTPException(status_code=400, detail=f"Unknown report type: {type}. Expected one of: {', '.join(PARSERS)}")
+    return await run_in_threadpool(
+        search_index.search, q, type, company or request.headers.get("X-Company"), limit, fuzzy,
+    )
+
+
+@app.get("/search/stats")
+async def search_stats():
+    return search_index.stats()
+
+
+@app.post("/search/rebuild")
+async def search_rebuild(request: Request):
+    """Rebuild the search index from the text sidecars of the records in the record store."""
+    await run_in_threadpool(require_admin, request, "Rebuilding the search index is restricted to admins")
+    try:
+        return await run_in_threadpool(search_index.rebuild, blob_store, record_store)
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+@app.get("/documents/stats")
+async def documents_stats():
+    return document_pool.stats()
+
+
+@app.get("/quarantine")
+async def get_quarantine(request: Request, limit: int = 100):
+    """Uploads the preflight set aside (encrypted, corrupt, blank), with their preflight facts."""
+    await run_in_threadpool(require_admin, request, "Quarantined files are restricted to admins")
+    return {"files": await run_in_threadpool(list_quarantine, blob_store, limit)}
+
+
+@app.get("/archive/stats")
+async def archive_stats():
+    """The archival pass: mode, files rewritten and bytes saved since start."""
+    return pdf_archiver.stats()
+
+
+@app.post("/archive", status_code=202)
+async def archive_stored(request: Request, dry_run: bool = False, limit: Optional[int] = None) -> Dict:
+    """
+    Start the archival pass over PDFs stored before it was enabled (or with
+    other settings) in the background; ?dry_run=true only measures. Returns
+    the job; GET /archive/jobs/{id} has its progress and, once done, the
+    bytes saved per file.
+    """
+    await run_in_threadpool(require_admin, request, "Rewriting stored PDFs is restricted to admins")
+    job, started = pdf_archiver.start_backfill(blob_store, document_pool, dry_run=dry_run, limit=limit,
+                                               guess_type=guess_report_type)
+    if not started:
+        raise HTTPException(status_code=409, detail=f"Archive job {job['id']} is already {job['state']}")
+    return job
+
+
+@app.get("/archive/jobs/{job_id}")
+async def archive_job(request: Request, job_id: str) -> Dict:
+    await run_in_threadpool(require_admin, request, "Archive jobs are restricted to admins")
+    job = pdf_archiver.job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No archive job {job_id}")
+    return job
+
+
+@app.get("/storage/stats")
+async def storage_stats():
+    """Blob store backend and, on shared stores, this node's cache hit rate."""
+    return blob_store_stats(blob_store)
+
+
+def persist_and_publish(report_type: str, records: List[Dict], firstname: str = "",
+                        total_files: Optional[int] = None, company: str = "") -> Dict:
+    """
+    Persist parsed records, then push the new ones to the admin pages' change
+    feeds and the /search index (only stored records are searchable).
+    """
+    summary = persist_batch(record_store, report_type, records, firstname, total_files)
+    if summary["saved"]:
+        by_id = {}
+        for data in records:
+            by_id.setdefault(data.get("uniqueId"), data)
+        try:
+            change_feed.publish_many(summary["collection"], "insert", [
+                (unique_id, document_id, by_id[unique_id])
+                for unique_id, document_id in zip(summary["saved"], summary["documentIds"])
+            ])
+        except Exception as e:
+            print(f"[CHANGE FEED ERROR] {report_type}: {str(e)}")
+        try:
+            search_index.add_many(report_type, [by_id[unique_id] for unique_id in summary["saved"]], company)
+        except Exception as e:
+            print(f"[SEARCH ERROR] {report_type}: {str(e)}")
+    return summary
+
+
+async def store_upload(request: Request, content: bytes, filename: str, type: str,
+                       persist: bool = False, firstname: str = "", company: Optional[str] = None) -> Dict:
+    """Run an uploaded PDF through the pipeline (and optionally persist it) in the bulk lane."""
+    if company is None:
+        company = request.headers.get("X-Company", "")
+    preflight_upload(request, content, filename)
+    try:
+        facts, data = await run_scheduled(request, BULK, check_and_process, content, filename, type, company)
+    except PreflightError as e:
+        request.state.preflight = public_facts(e.facts)
+        raise HTTPException(status_code=e.status, detail=e.detail)
+    request.state.preflight = public_facts(facts)
+
+    response = {
+        "data": to_model(type, data),
+        "pdfUrl": data["pdfUrl"],
+    }
+    # persist also saves the record (skipping duplicates) and publishes it on the change feed
+    if persist:
+        try:
+            summary = await run_in_threadpool(persist_and_publish, type, [data], firstname, None, company)
+        except RuntimeError as e:
+            # The record store is unavailable (no Firestore package or credentials)
+            raise HTTPException(status_code=503, detail=str(e))
+        response["documentId"] = summary["documentIds"][0] if summary["documentIds"] else ""
+        response["duplicate"] = bool(summary["duplicates"])
+    return response
+
 
 @app.post("/upload-and-store")
-async def upload_and_store(request: Request, file: UploadFile = File(...), type: str = "xray") -> Dict:
+async def upload_and_store(request: Request, file: UploadFile = File(...), type: str = "xray", compact: bool = False,
+                           persist: bool = False, firstname: str = "") -> Dict:
+    # Validate type
+    if type not in PARSERS:
+        raise HTTPException(status_code=400, detail=f"Unknown report type: {type}. Expected one of: {', '.join(PARSERS)}")
+
     try:
-        # Validate type
-        valid_types = ["xray", "cbc", "urinalysis", "lipid", "ecg", "medical", "chem"]
-        if type not in valid_types:
-            raise HTTPException(status_code=400, detail=f"Unknown report type: {type}. Expected one of: {', '.join(valid_types)}")
-
-        # Save PDF to disk
-        unique_id = Path(file.filename).stem
-        file_path = os.path.join(UPLOAD_DIR, file.filename)
         content = await file.read()
-        with open(file_path, "wb") as f:
-            f.write(content)
-
-        # Extract text
-        pdf = fitz.open(stream=content, filetype="pdf")
-        full_text = "".join(page.get_text() for page in pdf)
-        pdf.close()
-
-        # Dispatch to correct parser
-        if type == "xray":
-            data = parse_xray_data(full_text, file.filename)
-        elif type == "cbc":
-            data = parse_cbc_data(full_text, file.filename)
-        elif type == "urinalysis":
-            data = parse_urinalysis(full_text, file.filename)
-        elif type == "lipid":
-            data = parse_lipid_profile(full_text, file.filename)
-        elif type == "ecg":
-            data = parse_ecg_data(full_text, file.filename)
-        elif type == "medical":
-            data = parse_medical_exam(full_text, file.filename)
-        elif type == "chem":
-            data = parse_chemistry(full_text, file.filename)
-
-        # Dynamically get base URL
-        
-        encoded_filename = quote(file.filename)
-        data["pdfUrl"] = encoded_filename
-
-        return {
-            "data": data,
-            "pdfUrl": encoded_filename,
-        }
+        response = await store_upload(request, content, file.filename, type, persist, firstname)
+        return ModelResponse(response, compact=compact)
 
+    except HTTPException:
+        raise
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Failed to process PDF: {str(e)}")
 
+@app.post("/records/{type}/batch")
+async def upload_batch(request: Request, type: str, files: List[UploadFile] = File(...), firstname: str = Form(""), compact: bool = False):
+    """
+    Upload, parse and persist a whole batch server-side: one bulk duplicate
+    lookup on uniqueId, batched commits, and a single activity entry.
+    """
+    if type not in PARSERS:
+        raise HTTPException(status_code=400, detail=f"Unknown report type: {type}. Expected one of: {', '.join(PARSERS)}")
+
+    async def process(file: UploadFile) -> Dict:
+        try:
+            # Read inside the slot so a large batch is not held in memory at once
+            async with scheduler.slot(BULK, client_key(request)):
+                content = await file.read()
+                _, data = await run_in_threadpool(check_and_process, content, file.filename, type,
+                                                  request.headers.get("X-Company", ""))
+                return data
+        except PreflightError as e:
+            return {"fileName": file.filename, "error": e.detail}
+        except Exception as e:
+            traceback.print_exc()
+            return {"fileName": file.filename, "error": str(e)}
+
+    results = await asyncio.gather(*(process(file) for file in files))
+
+    parsed = [data for data in results if not data.get("error")]
+    failed = [{"fileName": data.get("fileName", ""), "error": data["error"]} for data in results if data.get("error")]
+
+    try:
+        summary = await run_in_threadpool(persist_and_publish, type, parsed, firstname, len(files),
+                                          request.headers.get("X-Company", ""))
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Failed to save records: {str(e)}")
+
+    by_id = {}
+    for data in parsed:
+        by_id.setdefault(data.get("uniqueId"), data)
+    summary["failed"] = failed
+    summary["records"] = [to_model(type, by_id[unique_id]) for unique_id in summary["saved"]]
+    return ModelResponse(summary, compact=compact)
+
+
+# Imported records are saved in chunks of this many per report type
+IMPORT_PERSIST_BATCH = int(os.getenv("IMPORT_PERSIST_BATCH", "5000"))
+
+
+def import_records(mapper: ExportMapper, records, firstname: str = "", company: str = "",
+                   persist: bool = True, out=None, preview: int = 0) -> Dict:
+    """
+    Save the (report type, result) pairs of a structured export like parsed
+    uploads: record store, change feed and search, then analytics for the
+    records that were new. persist=False only counts them (a dry run).
+    """
+    pending: Dict[str, List[Dict]] = {}
+    totals = {"saved": 0, "duplicates": 0, "activityIds": []}
+    samples: List[Dict] = []
+
+    def save(report_type: str) -> None:
+        batch = pending.pop(report_type, [])
+        if not batch:
+            return
+        summary = persist_and_publish(report_type, batch, firstname, 1, company)
+        saved = set(summary["saved"])
+        totals["saved"] += len(saved)
+        totals["duplicates"] += len(summary["duplicates"])
+        if summary["activityId"]:
+            totals["activityIds"].append(summary["activityId"])
+        new_records = []
+        for data in batch:
+            if data["uniqueId"] in saved:
+                saved.discard(data["uniqueId"])
+                new_records.append(data)
+        try:
+            for data in new_records:
+                analytics_store.append(report_type, data, company)
+        except Exception as e:
+            print(f"[ANALYTICS ERROR] {report_type} import: {str(e)}")
+
+    for report_type, data in records:
+        if out is not None:
+            out.write(orjson.dumps({"report_type": report_type, "data": data}).decode() + "\n")
+        if len(samples) < preview:
+            samples.append({"type": report_type, "data": data})
+        if persist:
+            pending.setdefault(report_type, []).append(data)
+            if len(pending[report_type]) >= IMPORT_PERSIST_BATCH:
+                save(report_type)
+    for report_type in list(pending):
+        save(report_type)
+
+    summary = mapper.summary()
+    if persist:
+        summary.update(totals)
+    if preview:
+        summary["preview"] = samples
+    return summary
+
+
+def import_upload(content: bytes, filename: str, type: str, firstname: str, company: str,
+                  dry_run: bool) -> Dict:
+    start = time.perf_counter()
+    mapper, records = read_export(io.BytesIO(content), filename, type)
+    summary = import_records(mapper, records, firstname, company, persist=not dry_run, preview=5 if dry_run else 0)
+    elapsed = time.perf_counter() - start
+    summary["took_ms"] = round(elapsed * 1000, 2)
+    print(f"[IMPORT] {filename}: {summary['rows']} rows -> {sum(summary['records'].values())} records "
+          f"in {elapsed:.2f}s")
+    return summary
+
+
+@app.post("/records/{type}/import")
+async def import_structured(request: Request, type: str, file: UploadFile = File(...), firstname: str = Form(""),
+                            dry_run: bool = False):
+    """
+    Import a lab system CSV/XLSX export instead of its PDFs. type is one of
+    the lab report types, or "auto" to sort results by test name. dry_run
+    maps the rows and returns counts and a preview without saving anything.
+    """
+    if type != "auto" and type not in IMPORT_TYPES:
+        raise HTTPException(status_code=400,
+                            detail=f"Unknown import type: {type}. Expected 'auto' or one of: {', '.join(IMPORT_TYPES)}")
+    content = await file.read()
+    try:
+        return await run_scheduled(request, BULK, import_upload, content, file.filename or "", type, firstname,
+                                   request.headers.get("X-Company", ""), dry_run)
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=f"Cannot import {file.filename}: {str(e)}")
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Failed to import {file.filename}: {str(e)}")
+
+
+def record_collection(type: str) -> str:
+    if type not in COLLECTIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown report type: {type}. Expected one of: {', '.join(COLLECTIONS)}")
+    return COLLECTIONS[type]
+
+
+@app.patch("/records/{type}/{unique_id}")
+def update_record(request: Request, type: str, unique_id: str, fields: Dict = Body(...)):
+    # The record store writes with the server's credentials, past the Firestore rules
+    require_admin(request, "Editing records is restricted to admins")
+    collection = record_collection(type)
+    try:
+        updated = record_store.update_record(collection, unique_id, fields)
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    if updated is None:
+        raise HTTPException(status_code=404, detail=f"No {type} record {unique_id}")
+    document_id, record = updated
+    change_feed.publish(collection, "update", unique_id, document_id, record)
+    search_index.add(type, record)
+    return ModelResponse({"documentId": document_id, "record": record})
+
+
+@app.delete("/records/{type}/{document_id}")
+def delete_record(request: Request, type: str, document_id: str):
+    """Delete one record by its document id (several documents can share a uniqueId)."""
+    require_admin(request, "Deleting records is restricted to admins")
+    collection = record_collection(type)
+    try:
+        unique_id = record_store.delete_record(collection, document_id)
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    if unique_id is None:
+        raise HTTPException(status_code=404, detail=f"No {type} record {document_id}")
+    change_feed.publish(collection, "delete", unique_id, document_id)
+    search_index.remove(type, unique_id)
+    return {"documentId": document_id, "uniqueId": unique_id, "deleted": True}
+
+
+@app.get("/records/{type}/changes")
+async def record_changes(request: Request, type: str, cursor: Optional[int] = None):
+    """
+    Server-Sent Events of record inserts, updates and deletes ("all" for every
+    collection). Resumes after ?cursor= or the Last-Event-ID an EventSource
+    sends on reconnect; a "reset" event means the client must reload.
+    The events carry whole patient records: admins only.
+    """
+    await run_in_threadpool(require_admin, request, "The change feed is restricted to admins")
+    collections = list(COLLECTIONS.values()) if type == "all" else [record_collection(type)]
+    last_event_id = request.headers.get("Last-Event-ID", "")
+    if cursor is None and last_event_id.isdigit():
+        cursor = int(last_event_id)
+    return StreamingResponse(
+        change_feed.stream(collections, cursor),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.exception_handler(UploadError)
+async def upload_error(request: Request, error: UploadError):
+    return JSONResponse({"detail": error.detail}, status_code=error.status, headers={"Tus-Resumable": TUS_VERSION})
+
+
+def upload_headers(session: Dict) -> Dict[str, str]:
+    return {
+        "Tus-Resumable": TUS_VERSION,
+        "Upload-Offset": str(session["offset"]),
+        "Upload-Length": str(session["length"]),
+        "Upload-Expires": formatdate(session["expires"], usegmt=True),
+        "Cache-Control": "no-store",
+    }
+
+
+@app.post("/uploads")
+async def create_upload(request: Request, type: Optional[str] = None, filename: Optional[str] = None,
+                        persist: bool = False, firstname: str = ""):
+    """
+    Start a resumable upload (tus-style). Upload-Length gives the size; the
+    filename and report type come from the query or from Upload-Metadata.
+    Then PATCH /uploads/{id} with the bytes from Upload-Offset on, and HEAD
+    /uploads/{id} for the offset to resume from after a dropped connection.
+    """
+    metadata = parse_metadata(request.headers.get("Upload-Metadata", ""))
+    report_type = type or metadata.get("type", "")
+    if report_type not in PARSERS:
+        raise UploadError(400, f"Unknown report type: {report_type}. Expected one of: {', '.join(PARSERS)}")
+    length = request.headers.get("Upload-Length", "")
+    if not length.isdigit():
+        raise UploadError(400, "Upload-Length header is required")
+
+    options = {
+        "persist": persist or metadata.get("persist") == "true",
+        "firstname": firstname or metadata.get("firstname", ""),
+        "company": request.headers.get("X-Company", ""),
+    }
+    session = await run_in_threadpool(resumable_uploads.create, int(length),
+                                      filename or metadata.get("filename", ""), report_type, options)
+    session["offset"] = 0
+    headers = upload_headers(session)
+    headers["Location"] = f"/uploads/{session['id']}"
+    return Response(status_code=201, headers=headers)
+
+
+@app.head("/uploads/{upload_id}")
+async def upload_offset(upload_id: str):
+    session = await run_in_threadpool(resumable_uploads.get, upload_id)
+    return Response(status_code=200, headers=upload_headers(session))
+
+
+@app.patch("/uploads/{upload_id}")
+async def upload_chunk(request: Request, upload_id: str, compact: bool = False):
+    """
+    Append the body at Upload-Offset. Bytes are kept as they arrive, so a
+    chunk cut off midway still counts. The PATCH that completes the file
+    runs it through the upload pipeline and answers with its result.
+    """
+    if request.headers.get("Content-Type") != "application/offset+octet-stream":
+        raise UploadError(415, "Content-Type must be application/offset+octet-stream")
+    offset = request.headers.get("Upload-Offset", "")
+    if not offset.isdigit():
+        raise UploadError(400, "Upload-Offset header is required")
+
+    async with resumable_uploads.session_lock(upload_id):
+        session = await run_in_threadpool(resumable_uploads.check_offset, upload_id, int(offset))
+        remaining = session["length"] - session["offset"]
+        written = 0
+        try:
+            with resumable_uploads.open_part(upload_id) as part:
+                async for piece in request.stream():
+                    if written + len(piece) > remaining:
+                        raise UploadError(413, "The chunk runs past Upload-Length")
+                    await run_in_threadpool(part.write, piece)
+                    written += len(piece)
+        except ClientDisconnect:
+            print(f"[UPLOADS] {upload_id}: connection dropped at {session['offset'] + written} bytes")
+        finally:
+            await run_in_threadpool(resumable_uploads.touch, session)
+
+        session["offset"] += written
+        if session["offset"] < session["length"]:
+            return Response(status_code=204, headers=upload_headers(session))
+
+        # Complete: hand the file to the same pipeline as /upload-and-store
+        content = await run_in_threadpool(resumable_uploads.read, upload_id)
+        options = session["options"]
+        try:
+            result = await store_upload(request, content, session["filename"], session["type"],
+                                        options.get("persist", False), options.get("firstname", ""),
+                                        company=options.get("company", ""))
+        except HTTPException:
+            raise
+        except Exception as e:
+            traceback.print_exc()
+            # The bytes stay; an empty PATCH at the end offset retries the processing
+            raise HTTPException(status_code=500, detail=f"Failed to process PDF: {str(e)}")
+        response = ModelResponse(result, compact=compact, headers=upload_headers(session))
+        await run_in_threadpool(resumable_uploads.finish, upload_id, response.body)
+        return response
+
+
+@app.get("/uploads/{upload_id}")
+async def upload_status(upload_id: str):
+    """Progress of an upload, with the pipeline result once it is complete."""
+    session = await run_in_threadpool(resumable_uploads.get, upload_id)
+    result = await run_in_threadpool(resumable_uploads.result, upload_id)
+    return ModelResponse({
+        "id": upload_id,
+        "filename": session["filename"],
+        "type": session["type"],
+        "offset": session["offset"],
+        "length": session["length"],
+        "expires": session["expires"],
+        "completed": bool(session.get("completed")),
+        "result": orjson.loads(result) if result else None,
+    }, headers=upload_headers(session))
+
+
+@app.delete("/uploads/{upload_id}")
+async def cancel_upload(upload_id: str):
+    await run_in_threadpool(resumable_uploads.get, upload_id)
+    await run_in_threadpool(resumable_uploads.delete, upload_id)
+    return Response(status_code=204, headers={"Tus-Resumable": TUS_VERSION})
+
+
 @app.get("/view-pdf/{filename}")
 def view_pdf(filename: str):
-    safe_path = Path(UPLOAD_DIR) / Path(filename).name  # strips any subdir tricks
-    if not safe_path.exists():
+    safe_path = blob_store.local_path(Path(filename).name)  # strips any subdir tricks
+    if safe_path is None:
         raise HTTPException(status_code=404, detail="PDF not found")
     return FileResponse(
     path=safe_path,
@@ -96,17 +849,68 @@ def view_pdf(filename: str):
     )
 
 
+def xray_manifest(id: str) -> Dict:
+    manifest = read_manifest(blob_store, Path(id).name + ".pdf")
+    if manifest is None:
+        raise HTTPException(status_code=404, detail="No radiograph tiles for this record")
+    return manifest
+
+
+def xray_image(id: str, index: int) -> Dict:
+    images = xray_manifest(id)["images"]
+    if not 0 <= index < len(images):
+        raise HTTPException(status_code=404, detail="Image not found")
+    return images[index]
+
+
+# Patient images: browsers only (never shared caches), and checked against the
+# ETag on every use; an unchanged tile is a 304, a re-uploaded report changes it
+TILE_CACHE_CONTROL = "private, no-cache"
+
+
+@app.get("/xray/{id}/images")
+def xray_images(id: str):
+    """The radiographs of an X-ray record and the Deep Zoom URLs of their tiles."""
+    manifest = xray_manifest(id)
+    for image in manifest["images"]:
+        image["dzi"] = f"/xray/{quote(id)}/images/{image['index']}.dzi"
+        image["tileUrl"] = f"/xray/{quote(id)}/images/{image['index']}_files/{{level}}/{{col}}_{{row}}.{image['format']}"
+    return manifest
+
+
+@app.get("/xray/{id}/images/{index}.dzi")
+def xray_dzi(id: str, index: int):
+    return Response(dzi_xml(xray_image(id, index)), media_type="application/xml",
+                    headers={"Cache-Control": TILE_CACHE_CONTROL})
+
+
+@app.get("/xray/{id}/images/{index}_files/{level}/{tile}")
+def xray_tile(request: Request, id: str, index: int, level: int, tile: str):
+    name = Path(tile).name
+    if not re.fullmatch(rf"\d+_\d+\.{TILE_FORMAT}", name):
+        raise HTTPException(status_code=404, detail="Tile not found")
+    key = f"{tiles_prefix(Path(id).name + '.pdf')}/{index}/{level}/{name}"
+    stat = blob_store.stat(key)
+    if stat is None:
+        raise HTTPException(status_code=404, detail="Tile not found")
+
+    etag = f'"{stat["etag"]}"'
+    headers = {"Cache-Control": TILE_CACHE_CONTROL, "ETag": etag}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    path = blob_store.local_path(key)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Tile not found")
+    return FileResponse(path, media_type="image/jpeg", headers=headers)
+
+
 @app.post("/extract-xray")
-async def extract_xray(file: UploadFile = File(...)) -> Dict:
+async def extract_xray(request: Request, file: UploadFile = File(...), compact: bool = False) -> Dict:
     content = await file.read()
-    pdf = fitz.open(stream=content, filetype="pdf")
-    full_text = ""
-    for page in pdf:
-        full_text += page.get_text()
 
     # Extract fields from text
-    data = parse_xray_data(full_text, file.filename)
-    return data
+    data = await run_scheduled(request, INTERACTIVE, parse_pdf, content, "xray", file.filename)
+    return ModelResponse(to_model("xray", data), compact=compact)
 
 def parse_xray_data(text: str, filename: str) -> Dict:
     def extract(label):
@@ -142,17 +946,16 @@ def parse_xray_data(text: str, filename: str) -> Dict:
     }
 
 @app.post("/extract-cbc")
-async def extract_cbc(file: UploadFile = File(...)) -> Dict:
+async def extract_cbc(request: Request, file: UploadFile = File(...), compact: bool = False) -> Dict:
     content = await file.read()
-    pdf = fitz.open(stream=content, filetype="pdf")
-    full_text = ""
-    for page in pdf:
-        full_text += page.get_text()
 
-    data = parse_cbc_data(full_text, file.filename)
-    return data
+    data = await run_scheduled(request, INTERACTIVE, parse_pdf, content, "cbc", file.filename)
+    return ModelResponse(to_model("cbc", data), compact=compact)
+
+def parse_cbc_data(text: str, filename: str, layout: Optional[Dict] = None) -> Dict:
+    # Lab template, for the adaptive order of the fallback patterns
+    template = template_key(text)
 
-def parse_cbc_data(text: str, filename: str) -> Dict:
     def get_cbc_value(label: str):
         # Updated pattern to handle L/H flags
         # Match: Label [L|H]? <spaces> result <spaces> unit <spaces> reference range
@@ -174,28 +977,21 @@ def parse_cbc_data(text: str, filename: str) -> Dict:
         }
     
     def extract_absolute_block(text: str) -> str:
-        # First try with ABSOLUTE COUNT anchor
-        match = re.search(r"(?<=ABSOLUTE COUNT)[\s\S]*?(?=\n[A-Z])", text, re.IGNORECASE)
-        if match and match.group(0).strip():
-            absolute_count_block = match.group(0).strip()
-            print("[DEBUG] Extracted ABSOLUTE COUNT block:")
-            print(absolute_count_block)
-            return absolute_count_block
-
-        # Fallback: Try WBC Absolute Count patterns
-        fallback_patterns = [
+        patterns = [
+            r"(?<=ABSOLUTE COUNT)([\s\S]*?)(?=\n[A-Z])",                       # ABSOLUTE COUNT anchor
+            # Fallback: WBC Absolute Count
             r"WBC\s+Absolute\s+Count\s*(.*?)(?=\n\s*MEDICAL|\n\s*PRC|\Z)",  # Until signatures
             r"WBC\s+Absolute\s+Count\s*(.*?)(?=\n[A-Z][A-Z\s]*:)",          # Until next section
             r"WBC\s+Absolute\s+Count\s*(.*)"                               # Everything after
         ]
 
-        for pattern in fallback_patterns:
-            match = re.search(pattern, text, re.DOTALL | re.IGNORECASE)
-            if match and match.group(1).strip():
-                block = match.group(1).strip()
-                print("[DEBUG] Extracted fallback WBC Absolute Count block:")
-                print(block)
-                return block
+        match = pattern_stats.first_match("cbc", "absolute_block", patterns, text, re.DOTALL | re.IGNORECASE,
+                                          template=template, accept=lambda m: bool(m.group(1).strip()))
+        if match:
+            block = match.group(1).strip()
+            print("[DEBUG] Extracted ABSOLUTE COUNT block:")
+            print(block)
+            return block
 
         # If all else fails
         print("[DEBUG] No ABSOLUTE COUNT block found.")
@@ -210,17 +1006,16 @@ def parse_cbc_data(text: str, filename: str) -> Dict:
             rf"{re.escape(label)}\s*([LH])?\s+([\d.]+)\s+([^\n]+)"
         ]
         
-        for pattern in patterns:
-            match = re.search(pattern, block, re.IGNORECASE)
-            if match:
-                groups = match.groups()
-                flag = groups[0] if groups[0] else ""  # L, H, or empty
-                return {
-                    "result": groups[1].strip(),
-                    "unit": groups[2].strip() if len(groups) > 2 else "#",
-                    "reference_range": groups[3].strip() if len(groups) > 3 else "",
-                    "flag": flag
-                }
+        match = pattern_stats.first_match("cbc", label, patterns, block, re.IGNORECASE, template=template)
+        if match:
+            groups = match.groups()
+            flag = groups[0] if groups[0] else ""  # L, H, or empty
+            return {
+                "result": groups[1].strip(),
+                "unit": groups[2].strip() if len(groups) > 2 else "#",
+                "reference_range": groups[3].strip() if len(groups) > 3 else "",
+                "flag": flag
+            }
         
         return {
             "result": "",
@@ -245,8 +1040,39 @@ def parse_cbc_data(text: str, filename: str) -> Dict:
 
     gender, age = extract_gender()
 
-    # Extract the WBC Absolute Count block
-    absolute_count_block = extract_absolute_block(text)
+    # A known lab layout gives the whole result table by position; the patterns are for the others
+    results = lab_templates.table("cbc", layout)
+    if results is None:
+        # Extract the WBC Absolute Count block
+        absolute_count_block = extract_absolute_block(text)
+
+        results = {
+            # CBC Core Panel
+            "rbc": get_cbc_value("RBC Count"),
+            "hematocrit": get_cbc_value("Hematocrit"),
+            "hemoglobin": get_cbc_value("Hemoglobin"),
+            "mcv": get_cbc_value("MCV"),
+            "mch": get_cbc_value("MCH"),
+            "mchc": get_cbc_value("MCHC"),
+            "rdw": get_cbc_value("RDW"),
+            "platelets": get_cbc_value("Platelet Count"),
+            "mpv": get_cbc_value("MPV"),
+            "wbc": get_cbc_value("WBC Count"),
+
+            # WBC Differential Count (%) - These should come from the main text
+            "neutrophils_percent": get_cbc_value("Neutrophil"),
+            "lymphocytes_percent": get_cbc_value("Lymphocytes"),
+            "monocytes_percent": get_cbc_value("Monocytes"),
+            "eosinophils_percent": get_cbc_value("Eosinophil"),
+            "basophils_percent": get_cbc_value("Basophil"),
+
+            # WBC Absolute Counts (#) - These should come from the absolute count block
+            "neutrophils_abs": get_cbc_value_from_block("Neutrophil", absolute_count_block),
+            "lymphocytes_abs": get_cbc_value_from_block("Lymphocyte", absolute_count_block),
+            "monocytes_abs": get_cbc_value_from_block("Monocyte", absolute_count_block),
+            "eosinophils_abs": get_cbc_value_from_block("Eosinophil", absolute_count_block),
+            "basophils_abs": get_cbc_value_from_block("Basophil", absolute_count_block),
+        }
 
     return {
         # Patient Info
@@ -258,33 +1084,9 @@ def parse_cbc_data(text: str, filename: str) -> Dict:
         "collectionDateTime": extract_patient_info("Collection Date/Time"),
         "resultValidated": extract_patient_info("Result Validated"),
 
-        # CBC Core Panel
-        "rbc": get_cbc_value("RBC Count"),
-        "hematocrit": get_cbc_value("Hematocrit"),
-        "hemoglobin": get_cbc_value("Hemoglobin"),
-        "mcv": get_cbc_value("MCV"),
-        "mch": get_cbc_value("MCH"),
-        "mchc": get_cbc_value("MCHC"),
-        "rdw": get_cbc_value("RDW"),
-        "platelets": get_cbc_value("Platelet Count"),
-        "mpv": get_cbc_value("MPV"),
-        "wbc": get_cbc_value("WBC Count"),
-
-        # WBC Differential Count (%) - These should come from the main text
-        "neutrophils_percent": get_cbc_value("Neutrophil"),
-        "lymphocytes_percent": get_cbc_value("Lymphocytes"),
-        "monocytes_percent": get_cbc_value("Monocytes"),
-        "eosinophils_percent": get_cbc_value("Eosinophil"),
-        "basophils_percent": get_cbc_value("Basophil"),
+        **results,
         "total_percent": extract_total_wbc_percent(text),
 
-        # WBC Absolute Counts (#) - These should come from the absolute count block
-        "neutrophils_abs": get_cbc_value_from_block("Neutrophil", absolute_count_block),
-        "lymphocytes_abs": get_cbc_value_from_block("Lymphocyte", absolute_count_block),
-        "monocytes_abs": get_cbc_value_from_block("Monocyte", absolute_count_block),
-        "eosinophils_abs": get_cbc_value_from_block("Eosinophil", absolute_count_block),
-        "basophils_abs": get_cbc_value_from_block("Basophil", absolute_count_block),
-
         # File Info
         "fileName": filename,
         "uploadDate": datetime.utcnow().isoformat(),
@@ -292,12 +1094,11 @@ def parse_cbc_data(text: str, filename: str) -> Dict:
     }
 
 @app.post("/extract-urinalysis")
-async def extract_urinalysis(file: UploadFile = File(...)) -> Dict:
+async def extract_urinalysis(request: Request, file: UploadFile = File(...), compact: bool = False) -> Dict:
     content = await file.read()
-    pdf = fitz.open(stream=content, filetype="pdf")
-    text = "".join(page.get_text() for page in pdf)
 
-    return parse_urinalysis(text, file.filename)
+    data = await run_scheduled(request, INTERACTIVE, parse_pdf, content, "urinalysis", file.filename)
+    return ModelResponse(to_model("urinalysis", data), compact=compact)
 
 
 def extract_patient_info(text: str, label: str, fallback: str = "") -> str:
@@ -310,7 +1111,7 @@ def extract_gender_age(text: str):
         return match.group(1).strip(), match.group(2).strip()
     return "", ""
 
-def extract_urinalysis_value(text: str, label: str, ref_pattern: str = None):
+def extract_urinalysis_value(text: str, label: str, ref_pattern: str = None, template: Optional[str] = None):
     """
     Extracts result, unit, and reference range for a urinalysis label.
     Handles cases where result+unit+label are squished together.
@@ -332,9 +1133,13 @@ def extract_urinalysis_value(text: str, label: str, ref_pattern: str = None):
     
     # Handle Urobilinogen: "0.2 - 1.0EU/dL0.2Urobilinogen"
     if label.lower() == "urobilinogen":
-        # Look for the complete pattern in the text
-        pattern = r"([\d.]+ - [\d.]+)(EU/dL)([\d.]+)" + re.escape(label)
-        match = re.search(pattern, text, re.IGNORECASE)
+        patterns = [
+            # The complete pattern in the text
+            r"([\d.]+ - [\d.]+)(EU/dL)([\d.]+)" + re.escape(label),
+            # Fallback pattern if spacing is different
+            r"([\d.]+ - [\d.]+)\s*(EU/dL)\s*([\d.]+)\s*" + re.escape(label),
+        ]
+        match = pattern_stats.first_match("urinalysis", label, patterns, text, re.IGNORECASE, template=template)
         if match:
             print(f"Urobilinogen match: {match.groups()}")
             return {
@@ -343,22 +1148,16 @@ def extract_urinalysis_value(text: str, label: str, ref_pattern: str = None):
                 "reference_range": match.group(1),  # 0.2 - 1.0
                 "flag": ""
             }
-        # Fallback pattern if spacing is different
-        pattern2 = r"([\d.]+ - [\d.]+)\s*(EU/dL)\s*([\d.]+)\s*" + re.escape(label)
-        match2 = re.search(pattern2, text, re.IGNORECASE)
-        if match2:
-            return {
-                "result": match2.group(3),
-                "unit": match2.group(2),
-                "reference_range": match2.group(1),
-                "flag": ""
-            }
         
     # Handle RBC and WBC: "0.0 - 2.0/hpf0.0RBC" or "0.0 - 2.0/hpf0.1WBC"
     if label.lower() in ["rbc", "wbc"]:
-        # Pattern: (reference_range)/hpf(result)Label
-        pattern = r"([\d.]+ - [\d.]+)/hpf([\d.]+)" + re.escape(label)
-        match = re.search(pattern, text, re.IGNORECASE)
+        patterns = [
+            # Pattern: (reference_range)/hpf(result)Label
+            r"([\d.]+ - [\d.]+)/hpf([\d.]+)" + re.escape(label),
+            # Fallback with spacing
+            r"([\d.]+ - [\d.]+)\s*/hpf\s*([\d.]+)\s*" + re.escape(label),
+        ]
+        match = pattern_stats.first_match("urinalysis", label, patterns, text, re.IGNORECASE, template=template)
         if match:
             print(f"{label} match: {match.groups()}")
             return {
@@ -367,22 +1166,17 @@ def extract_urinalysis_value(text: str, label: str, ref_pattern: str = None):
                 "reference_range": match.group(1),  # 0.0 - 2.0
                 "flag": ""
             }
-        # Fallback with spacing
-        pattern2 = r"([\d.]+ - [\d.]+)\s*/hpf\s*([\d.]+)\s*" + re.escape(label)
-        match2 = re.search(pattern2, text, re.IGNORECASE)
-        if match2:
-            return {
-                "result": match2.group(2),
-                "unit": "/hpf",
-                "reference_range": match2.group(1),
-                "flag": ""
-            }
 
     # Handle Epithelial Cells and Bacteria: "/hpf0.2 RAREEpithelial Cells" or "/hpf2.6 RAREBacteria"
     if label.lower() in ["epithelial cells", "bacteria"]:
-        # First try the spaced version
-        pattern = r"/hpf\s*([\d.]+)\s*(RARE|FEW|MANY)\s*" + re.escape(label)
-        match = re.search(pattern, spaced_text, re.IGNORECASE)
+        patterns = [
+            # First try the spaced version
+            r"/hpf\s*([\d.]+)\s*(RARE|FEW|MANY)\s*" + re.escape(label),
+            # Then the original concatenated pattern
+            r"/hpf([\d.]+)\s*(RARE|FEW|MANY)" + re.escape(label),
+        ]
+        match = pattern_stats.first_match("urinalysis", label, patterns, text, re.IGNORECASE,
+                                          template=template, texts=[spaced_text, text])
         if match:
             print(f"{label} match: {match.groups()}")
             result_parts = []
@@ -397,23 +1191,6 @@ def extract_urinalysis_value(text: str, label: str, ref_pattern: str = None):
                 "reference_range": "",
                 "flag": ""
             }
-        
-        # Try original concatenated pattern
-        pattern2 = r"/hpf([\d.]+)\s*(RARE|FEW|MANY)" + re.escape(label)
-        match2 = re.search(pattern2, text, re.IGNORECASE)
-        if match2:
-            result_parts = []
-            if match2.group(1):
-                result_parts.append(match2.group(1))
-            if match2.group(2):
-                result_parts.append(match2.group(2))
-            
-            return {
-                "result": " ".join(result_parts),
-                "unit": "/hpf", 
-                "reference_range": "",
-                "flag": ""
-            }
 
     # Handle Hyaline Cast: Just "Hyaline Cast" with no preceding values
     if label.lower() == "hyaline cast":
@@ -513,15 +1290,43 @@ def test_extraction():
     print("Bacteria: result=2.6 RARE, unit=/hpf")
     
 # Uncomment to test:
-test_extraction()
+with pattern_stats.paused():
+    test_extraction()
 
 
 
-def parse_urinalysis(text: str, filename: str) -> Dict:
+def parse_urinalysis(text: str, filename: str, layout: Optional[Dict] = None) -> Dict:
     print("===== RAW PDF TEXT =====")
     print(text)
     gender, age = extract_gender_age(text)
 
+    # A known lab layout gives the whole result table by position; the patterns are for the others
+    results = lab_templates.table("urinalysis", layout)
+    if results is None:
+        # One template lookup for the document, not one per field
+        template = template_key(text)
+        results = {
+            # Urinalysis Fields (Match CBC format)
+            "color": extract_urinalysis_value(text, "Color", template=template),
+            "clarity": extract_urinalysis_value(text, "Clarity", template=template),
+            "glucose": extract_urinalysis_value(text, "Glucose", template=template),
+            "bilirubin": extract_urinalysis_value(text, "Bilirubin", template=template),
+            "ketones": extract_urinalysis_value(text, "Ketones", template=template),
+            "specific_gravity": extract_urinalysis_value(text, "Specific Gravity", template=template),
+            "blood": extract_urinalysis_value(text, "Blood", template=template),
+            "ph": extract_urinalysis_value(text, "PH", template=template),
+            "protein": extract_urinalysis_value(text, "Protein", template=template),
+            "urobilinogen": extract_urinalysis_value(text, "Urobilinogen", template=template),
+            "nitrite": extract_urinalysis_value(text, "Nitrite", template=template),
+            "leukocyte_esterase": extract_urinalysis_value(text, "Leukocyte Esterase", template=template),
+            "rbc": extract_urinalysis_value(text, "RBC", template=template),
+            "wbc": extract_urinalysis_value(text, "WBC", template=template),
+            "epithelial_cells": extract_urinalysis_value(text, "Epithelial Cells", template=template),
+            "bacteria": extract_urinalysis_value(text, "Bacteria", template=template),
+            "hyaline_cast": extract_urinalysis_value(text, "Hyaline Cast", template=template),
+            "remarks": extract_urinalysis_value(text, "Remarks:", template=template),
+        }
+
     return {
         # Patient Info
         "patientName": extract_patient_info(text, "Name"),
@@ -534,25 +1339,7 @@ def parse_urinalysis(text: str, filename: str) -> Dict:
         "orderNumber": extract_patient_info(text, "Order Number"),
         "location": extract_patient_info(text, "Location"),
 
-        # Urinalysis Fields (Match CBC format)
-        "color": extract_urinalysis_value(text, "Color"),
-        "clarity": extract_urinalysis_value(text, "Clarity"),
-        "glucose": extract_urinalysis_value(text, "Glucose"),
-        "bilirubin": extract_urinalysis_value(text, "Bilirubin"),
-        "ketones": extract_urinalysis_value(text, "Ketones"),
-        "specific_gravity": extract_urinalysis_value(text, "Specific Gravity"),
-        "blood": extract_urinalysis_value(text, "Blood"),
-        "ph": extract_urinalysis_value(text, "PH"),
-        "protein": extract_urinalysis_value(text, "Protein"),
-        "urobilinogen": extract_urinalysis_value(text, "Urobilinogen"),
-        "nitrite": extract_urinalysis_value(text, "Nitrite"),
-        "leukocyte_esterase": extract_urinalysis_value(text, "Leukocyte Esterase"),
-        "rbc": extract_urinalysis_value(text, "RBC"),
-        "wbc": extract_urinalysis_value(text, "WBC"),
-        "epithelial_cells": extract_urinalysis_value(text, "Epithelial Cells"),
-        "bacteria": extract_urinalysis_value(text, "Bacteria"),
-        "hyaline_cast": extract_urinalysis_value(text, "Hyaline Cast"),
-        "remarks": extract_urinalysis_value(text, "Remarks:"),
+        **results,
 
         # Meta
         "fileName": filename,
@@ -560,24 +1347,54 @@ def parse_urinalysis(text: str, filename: str) -> Dict:
         "uniqueId": filename.replace(".pdf", "")
     }
 @app.post("/extract-ecg")
-async def extract_ecg(file: UploadFile = File(...)):
+async def extract_ecg(request: Request, file: UploadFile = File(...), compact: bool = False):
     try:
         contents = await file.read()
-        pdf = fitz.open(stream=contents, filetype="pdf")
-        text = "".join([page.get_text() for page in pdf])
-        pdf.close()
-
-        # Debug print
-        print("Extracted ECG text:\n", text)
 
-        data = parse_ecg_data(text, file.filename)
+        data = await run_scheduled(request, INTERACTIVE, parse_pdf, contents, "ecg", file.filename)
 
-        return data
+        return ModelResponse(to_model("ecg", data), compact=compact)
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing ECG file: {str(e)}")
 
 
+@app.get("/ecg/{id}/waveform")
+async def ecg_waveform(request: Request, id: str, format: str = "json", leads: str = ""):
+    """
+    The tracing of a stored ECG as per-lead float32 samples in mV:
+    JSON by default, or the compact binary form with format=binary.
+    """
+    if format not in ("json", "binary"):
+        raise HTTPException(status_code=400, detail="format must be 'json' or 'binary'")
+
+    key = Path(id).name + ".pdf"
+    if not blob_store.exists(key):
+        raise HTTPException(status_code=404, detail="ECG not found")
+
+    try:
+        data = await run_scheduled(request, INTERACTIVE, load_waveforms, blob_store, key, document_pool)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=f"Could not read the ECG tracing: {str(e)}")
+
+    waveforms = decode_waveforms(data)
+    wanted = [name.strip() for name in leads.split(",") if name.strip()]
+    if wanted:
+        unknown = [name for name in wanted if name not in waveforms["leads"]]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown leads: {', '.join(unknown)}")
+        waveforms["leads"] = {name: waveforms["leads"][name] for name in wanted}
+        data = encode_waveforms(waveforms)
+
+    headers = {"Cache-Control": "private, max-age=3600"}
+    if format == "binary":
+        return Response(data, media_type="application/octet-stream", headers=headers)
+
+    waveforms["uniqueId"] = Path(id).name
+    waveforms["leads"] = {name: values.round(3) for name, values in waveforms["leads"].items()}
+    return ModelResponse(waveforms, headers=headers)
+
+
 def parse_ecg_data(text: str, filename: str) -> Dict:
     def extract(pattern, default=""):
         match = re.search(pattern, text, re.IGNORECASE | re.MULTILINE | re.DOTALL)
@@ -616,16 +1433,13 @@ def parse_ecg_data(text: str, filename: str) -> Dict:
     return extracted_data
     
 @app.post("/extract-lipid-profile")
-async def extract_lipid_profile(file: UploadFile = File(...)) -> Dict:
+async def extract_lipid_profile(request: Request, file: UploadFile = File(...), compact: bool = False) -> Dict:
     try:
         content = await file.read()
-        pdf = fitz.open(stream=content, filetype="pdf")
-        text = "".join(page.get_text() for page in pdf)
-        pdf.close()
 
         # Parse data only — no file writing here
-        result = parse_lipid_profile(text, file.filename)
-        return result
+        result = await run_scheduled(request, INTERACTIVE, parse_pdf, content, "lipid", file.filename)
+        return ModelResponse(to_model("lipid", result), compact=compact)
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to extract lipid data: {str(e)}")
@@ -649,6 +1463,8 @@ def extract_lipid_value(text: str, test_name: str):
     """
     print(f"Looking for test: {test_name}")
     
+    template = template_key(text)
+
     # Clean the text for better matching
     cleaned_text = re.sub(r'\s+', ' ', text.strip())
     
@@ -661,24 +1477,23 @@ def extract_lipid_value(text: str, test_name: str):
             r"(?<!/)ALT(?!/)\s+([HLN])?\s*([\d.]+)\s+(U/L)\s+([\d.]+ - [\d.]+)",
         ]
         
-        for pattern in patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                groups = match.groups()
-                if len(groups) == 4:  # Has flag
-                    return {
-                        "result": groups[1],
-                        "unit": groups[2],
-                        "reference_range": groups[3],
-                        "flag": groups[0] if groups[0] else ""
-                    }
-                else:  # No flag
-                    return {
-                        "result": groups[0],
-                        "unit": groups[1],
-                        "reference_range": groups[2],
-                        "flag": ""
-                    }
+        match = pattern_stats.first_match("lipid", test_name, patterns, text, re.IGNORECASE, template=template)
+        if match:
+            groups = match.groups()
+            if len(groups) == 4:  # Has flag
+                return {
+                    "result": groups[1],
+                    "unit": groups[2],
+                    "reference_range": groups[3],
+                    "flag": groups[0] if groups[0] else ""
+                }
+            else:  # No flag
+                return {
+                    "result": groups[0],
+                    "unit": groups[1],
+                    "reference_range": groups[2],
+                    "flag": ""
+                }
     
     # Handle Cholesterol (Total) - more flexible pattern
     if test_name.lower() in ["cholesterol (total)", "total cholesterol", "cholesterol"]:
@@ -689,24 +1504,23 @@ def extract_lipid_value(text: str, test_name: str):
             r"Cholesterol\s*\(Total\)\s+([\d.]+)\s+(mg/dL)\s+([\d.]+ - [\d.]+)",
         ]
         
-        for pattern in patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                groups = match.groups()
-                if len(groups) == 4:  # Has flag
-                    return {
-                        "result": groups[1],
-                        "unit": groups[2],
-                        "reference_range": groups[3],
-                        "flag": groups[0]
-                    }
-                else:  # No flag
-                    return {
-                        "result": groups[0],
-                        "unit": groups[1],
-                        "reference_range": groups[2],
-                        "flag": ""
-                    }
+        match = pattern_stats.first_match("lipid", test_name, patterns, text, re.IGNORECASE, template=template)
+        if match:
+            groups = match.groups()
+            if len(groups) == 4:  # Has flag
+                return {
+                    "result": groups[1],
+                    "unit": groups[2],
+                    "reference_range": groups[3],
+                    "flag": groups[0]
+                }
+            else:  # No flag
+                return {
+                    "result": groups[0],
+                    "unit": groups[1],
+                    "reference_range": groups[2],
+                    "flag": ""
+                }
     
     # Handle Triglycerides
     if test_name.lower() == "triglycerides":
@@ -715,24 +1529,23 @@ def extract_lipid_value(text: str, test_name: str):
             r"Triglycerides\s+([\d.]+)\s+(mg/dL)\s+([\d.]+ - [\d.]+)",
         ]
         
-        for pattern in patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                groups = match.groups()
-                if len(groups) == 4:  # Has flag
-                    return {
-                        "result": groups[1],
-                        "unit": groups[2],
-                        "reference_range": groups[3],
-                        "flag": groups[0]
-                    }
-                else:  # No flag
-                    return {
-                        "result": groups[0],
-                        "unit": groups[1],
-                        "reference_range": groups[2],
-                        "flag": ""
-                    }
+        match = pattern_stats.first_match("lipid", test_name, patterns, text, re.IGNORECASE, template=template)
+        if match:
+            groups = match.groups()
+            if len(groups) == 4:  # Has flag
+                return {
+                    "result": groups[1],
+                    "unit": groups[2],
+                    "reference_range": groups[3],
+                    "flag": groups[0]
+                }
+            else:  # No flag
+                return {
+                    "result": groups[0],
+                    "unit": groups[1],
+                    "reference_range": groups[2],
+                    "flag": ""
+                }
     
     # Handle Cholesterol HDL
     if test_name.lower() in ["cholesterol hdl", "hdl", "hdl cholesterol"]:
@@ -743,24 +1556,23 @@ def extract_lipid_value(text: str, test_name: str):
             r"Cholesterol HDL\s+([\d.]+)\s+(mg/dL)\s+([\d.]+ - [\d.]+)",
         ]
         
-        for pattern in patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                groups = match.groups()
-                if len(groups) == 4:  # Has flag
-                    return {
-                        "result": groups[1],
-                        "unit": groups[2],
-                        "reference_range": groups[3],
-                        "flag": groups[0]
-                    }
-                else:  # No flag
-                    return {
-                        "result": groups[0],
-                        "unit": groups[1],
-                        "reference_range": groups[2],
-                        "flag": ""
-                    }
+        match = pattern_stats.first_match("lipid", test_name, patterns, text, re.IGNORECASE, template=template)
+        if match:
+            groups = match.groups()
+            if len(groups) == 4:  # Has flag
+                return {
+                    "result": groups[1],
+                    "unit": groups[2],
+                    "reference_range": groups[3],
+                    "flag": groups[0]
+                }
+            else:  # No flag
+                return {
+                    "result": groups[0],
+                    "unit": groups[1],
+                    "reference_range": groups[2],
+                    "flag": ""
+                }
     
     # Handle Cholesterol LDL
     if test_name.lower() in ["cholesterol ldl", "ldl", "ldl cholesterol"]:
@@ -769,24 +1581,23 @@ def extract_lipid_value(text: str, test_name: str):
             r"Cholesterol LDL\s+([\d.]+)\s+(mg/dL)\s+([\d.]+ - [\d.]+)",
         ]
         
-        for pattern in patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                groups = match.groups()
-                if len(groups) == 4:  # Has flag
-                    return {
-                        "result": groups[1],
-                        "unit": groups[2],
-                        "reference_range": groups[3],
-                        "flag": groups[0]
-                    }
-                else:  # No flag
-                    return {
-                        "result": groups[0],
-                        "unit": groups[1],
-                        "reference_range": groups[2],
-                        "flag": ""
-                    }
+        match = pattern_stats.first_match("lipid", test_name, patterns, text, re.IGNORECASE, template=template)
+        if match:
+            groups = match.groups()
+            if len(groups) == 4:  # Has flag
+                return {
+                    "result": groups[1],
+                    "unit": groups[2],
+                    "reference_range": groups[3],
+                    "flag": groups[0]
+                }
+            else:  # No flag
+                return {
+                    "result": groups[0],
+                    "unit": groups[1],
+                    "reference_range": groups[2],
+                    "flag": ""
+                }
     
     # Handle VLDL
     if test_name.lower() == "vldl":
@@ -797,24 +1608,23 @@ def extract_lipid_value(text: str, test_name: str):
             r"VLDL\s+([\d.]+)\s+(mg/dL)\s+([\d.]+ - [\d.]+)",
         ]
         
-        for pattern in patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                groups = match.groups()
-                if len(groups) == 4:  # Has flag
-                    return {
-                        "result": groups[1],
-                        "unit": groups[2],
-                        "reference_range": groups[3],
-                        "flag": groups[0]
-                    }
-                else:  # No flag
-                    return {
-                        "result": groups[0],
-                        "unit": groups[1],
-                        "reference_range": groups[2],
-                        "flag": ""
-                    }
+        match = pattern_stats.first_match("lipid", test_name, patterns, text, re.IGNORECASE, template=template)
+        if match:
+            groups = match.groups()
+            if len(groups) == 4:  # Has flag
+                return {
+                    "result": groups[1],
+                    "unit": groups[2],
+                    "reference_range": groups[3],
+                    "flag": groups[0]
+                }
+            else:  # No flag
+                return {
+                    "result": groups[0],
+                    "unit": groups[1],
+                    "reference_range": groups[2],
+                    "flag": ""
+                }
     
     # Default empty structure
     return {
@@ -824,7 +1634,7 @@ def extract_lipid_value(text: str, test_name: str):
         "flag": ""
     }
 
-def parse_lipid_profile(text: str, filename: str) -> Dict:
+def parse_lipid_profile(text: str, filename: str, layout: Optional[Dict] = None) -> Dict:
     """Parse the lipid profile PDF and extract all relevant information"""
     print("===== RAW PDF TEXT =====")
     print(text)
@@ -832,6 +1642,19 @@ def parse_lipid_profile(text: str, filename: str) -> Dict:
     
     gender, age = extract_gender_age(text)
 
+    # A known lab layout gives the whole result table by position; the patterns are for the others
+    results = lab_templates.table("lipid", layout)
+    if results is None:
+        results = {
+            # Lipid Profile Fields
+            "alt_sgpt": extract_lipid_value(text, "ALT/SGPT"),
+            "total_cholesterol": extract_lipid_value(text, "Cholesterol (Total)"),
+            "triglycerides": extract_lipid_value(text, "Triglycerides"),
+            "hdl_cholesterol": extract_lipid_value(text, "Cholesterol HDL"),
+            "ldl_cholesterol": extract_lipid_value(text, "Cholesterol LDL"),
+            "vldl": extract_lipid_value(text, "VLDL"),
+        }
+
     result = {
         # Patient Info
         "patientName": extract_patient_info(text, "Name"),
@@ -843,13 +1666,7 @@ def parse_lipid_profile(text: str, filename: str) -> Dict:
         "resultValidated": extract_patient_info(text, "Result Validated"),
         "location": extract_patient_info(text, "Location"),
 
-        # Lipid Profile Fields
-        "alt_sgpt": extract_lipid_value(text, "ALT/SGPT"),
-        "total_cholesterol": extract_lipid_value(text, "Cholesterol (Total)"),
-        "triglycerides": extract_lipid_value(text, "Triglycerides"),
-        "hdl_cholesterol": extract_lipid_value(text, "Cholesterol HDL"),
-        "ldl_cholesterol": extract_lipid_value(text, "Cholesterol LDL"),
-        "vldl": extract_lipid_value(text, "VLDL"),
+        **results,
 
         # Meta
         "fileName": filename,
@@ -900,25 +1717,55 @@ VLDL L 13.60 mg/dL 20 - 30"""
 # test_with_actual_data()
 
 @app.post("/extract-medical-exam")
-async def extract_medical_exam(file: UploadFile = File(...)) -> Dict:
+async def extract_medical_exam(request: Request, file: UploadFile = File(...), compact: bool = False) -> Dict:
     try:
         content = await file.read()
-        pdf = fitz.open(stream=content, filetype="pdf")
-        text = "".join(page.get_text() for page in pdf)
-        pdf.close()
 
-        result = parse_medical_exam(text, file.filename)
+        result = await run_scheduled(request, INTERACTIVE, parse_pdf, content, "medical", file.filename)
         
         # Add null check here
         if result is None:
             raise ValueError("Failed to parse medical exam data - parser returned None")
             
-        return result
+        return ModelResponse(to_model("medical", result), compact=compact)
     except Exception as e:
         print(f"ERROR in extract_medical_exam: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to extract medical exam data: {str(e)}")
 
 
+# Headings of the medical exam form in reading order; a section runs to the next
+# heading. Vital signs, anthropometrics and visual acuity are printed side by
+# side, so their text is interleaved and they share the physical exam section.
+MEDICAL_EXAM_SECTIONS = [
+    ("history", re.compile(r"PRESENT ILLNESS:")),
+    ("physical_exam", re.compile(r"\bII\.\s*PHYSICAL EXAMINATION")),
+    ("lab_findings", re.compile(r"LABORATORY FINDINGS")),
+    ("recommendations", re.compile(r"RECOMMENDATIONS:")),
+    ("certification", re.compile(r"Date of Initial PEME:", re.IGNORECASE)),
+]
+
+
+def split_medical_exam_sections(text: str) -> Dict[str, str]:
+    """
+    Slice the report into demographics, history, physical_exam, lab_findings,
+    recommendations and certification in one pass. A section whose heading is
+    missing (another form layout) maps to the whole text.
+    """
+    starts = [("demographics", 0)]
+    position = 0
+    for name, heading in MEDICAL_EXAM_SECTIONS:
+        match = heading.search(text, position)
+        if match:
+            starts.append((name, match.start()))
+            position = match.start()
+
+    sections = {name: text for name in ["demographics"] + [name for name, _ in MEDICAL_EXAM_SECTIONS]}
+    for i, (name, start) in enumerate(starts):
+        end = starts[i + 1][1] if i + 1 < len(starts) else len(text)
+        sections[name] = text[start:end]
+    return sections
+
+
 def parse_medical_exam(text: str, filename: str) -> Dict:
     from datetime import datetime
     import re
@@ -928,9 +1775,12 @@ def parse_medical_exam(text: str, filename: str) -> Dict:
         print(text)
         print("=" * 50)
 
-        def extract_field(pattern, default=""):
+        # Each field is looked up only in its own section of the form
+        sections = split_medical_exam_sections(text)
+
+        def extract_field(pattern, section, default=""):
             try:
-                match = re.search(pattern, text, re.IGNORECASE | re.MULTILINE)
+                match = re.search(pattern, sections[section], re.IGNORECASE | re.MULTILINE)
                 if match:
                     result = match.group(1).strip()
                     print(f"[FIELD MATCH] {pattern} → {result}")
@@ -945,7 +1795,7 @@ def parse_medical_exam(text: str, filename: str) -> Dict:
         def extract_yes_no_condition(condition_name):
             try:
                 pattern = rf"\[([✓xX ])\]\s*{re.escape(condition_name)}"
-                match = re.search(pattern, text, re.IGNORECASE)
+                match = re.search(pattern, sections["history"], re.IGNORECASE)
                 if not match:
                     return "UNKNOWN"
                 symbol = match.group(1)
@@ -974,11 +1824,11 @@ def parse_medical_exam(text: str, filename: str) -> Dict:
         def extract_vital_signs():
             try:
                 return {
-                    "blood_pressure": extract_field(r"Blood Pressure.*?(\d+/\d+)", ""),
-                    "pulse": extract_field(r"Pulse.*?(\d+)", ""),
-                    "spo2": extract_field(r"Spo0?2.*?(\d+)", ""),
-                    "respiratory_rate": extract_field(r"Res.*?(\d+)", ""),
-                    "temperature": extract_field(r"TEMP.*?([\d.]+)", ""),
+                    "blood_pressure": extract_field(r"Blood Pressure.*?(\d+/\d+)", "physical_exam"),
+                    "pulse": extract_field(r"Pulse.*?(\d+)", "physical_exam"),
+                    "spo2": extract_field(r"Spo0?2.*?(\d+)", "physical_exam"),
+                    "respiratory_rate": extract_field(r"Res.*?(\d+)", "physical_exam"),
+                    "temperature": extract_field(r"TEMP.*?([\d.]+)", "physical_exam"),
                 }
             except Exception as e:
                 print(f"[VITALS ERROR] {str(e)}")
@@ -993,10 +1843,10 @@ def parse_medical_exam(text: str, filename: str) -> Dict:
         def extract_anthropometrics():
             try:
                 return {
-                    "height": extract_field(r"HEIGHT:.*?(\d+)", ""),
-                    "weight": extract_field(r"WEIGHT:.*?([\d.]+)", ""),
-                    "bmi": extract_field(r"BMI:\s*([\d.]+)", ""),
-                    "ibw": extract_field(r"IBW:.*?([\d.]+)", ""),
+                    "height": extract_field(r"HEIGHT:.*?(\d+)", "physical_exam"),
+                    "weight": extract_field(r"WEIGHT:.*?([\d.]+)", "physical_exam"),
+                    "bmi": extract_field(r"BMI:\s*([\d.]+)", "physical_exam"),
+                    "ibw": extract_field(r"IBW:.*?([\d.]+)", "physical_exam"),
                 }
             except Exception as e:
                 print(f"[ANTHROPOMETRICS ERROR] {str(e)}")
@@ -1010,9 +1860,9 @@ def parse_medical_exam(text: str, filename: str) -> Dict:
         def extract_visual_acuity():
             try:
                 return {
-                    "vision_adequacy": extract_field(r"ADEQUATE:\s*([A-Z]+)", ""),
-                    "od": extract_field(r"OD=([J\d]+)", ""),
-                    "os": extract_field(r"OS=([J\d]+)", ""),
+                    "vision_adequacy": extract_field(r"ADEQUATE:\s*([A-Z]+)", "physical_exam"),
+                    "od": extract_field(r"OD=([J\d]+)", "physical_exam"),
+                    "os": extract_field(r"OS=([J\d]+)", "physical_exam"),
                 }
             except Exception as e:
                 print(f"[VISUAL ERROR] {str(e)}")
@@ -1025,11 +1875,11 @@ def parse_medical_exam(text: str, filename: str) -> Dict:
         def extract_lab_findings():
             try:
                 return {
-                    "cbc": extract_field(r"Complete Blood Count\s+(Unremarkable|[A-Za-z\s]+)", ""),
-                    "urinalysis": extract_field(r"Urinalys\s+(Unremarkable|[A-Za-z\s]+)", ""),
-                    "blood_chemistry": extract_field(r"Blood Chemistry\s+(Unremarkable|[A-Za-z\s]+)", ""),
-                    "chest_xray": extract_field(r"Chest X-ray\s+([A-Za-z\s]+?)(?=PA LORDOTIC|ECG|\n)", ""),
-                    "ecg": extract_field(r"ECG\s+(Unremarkable|[A-Za-z\s]+)", ""),
+                    "cbc": extract_field(r"Complete Blood Count\s+(Unremarkable|[A-Za-z\s]+)", "lab_findings"),
+                    "urinalysis": extract_field(r"Urinalys\s+(Unremarkable|[A-Za-z\s]+)", "lab_findings"),
+                    "blood_chemistry": extract_field(r"Blood Chemistry\s+(Unremarkable|[A-Za-z\s]+)", "lab_findings"),
+                    "chest_xray": extract_field(r"Chest X-ray\s+([A-Za-z\s]+?)(?=PA LORDOTIC|ECG|\n)", "lab_findings"),
+                    "ecg": extract_field(r"ECG\s+(Unremarkable|[A-Za-z\s]+)", "lab_findings"),
                 }
             except Exception as e:
                 print(f"[LAB ERROR] {str(e)}")
@@ -1049,16 +1899,16 @@ def parse_medical_exam(text: str, filename: str) -> Dict:
                 def detect_fitness_status():
                     try:
                         # Look for the RECOMMENDATIONS section
-                        recommendations_section = re.search(r"RECOMMENDATIONS:\s*(.*?)(?=Class|This\s+is\s+to\s+certify|$)", text, re.IGNORECASE | re.DOTALL)
+                        recommendations_section = re.search(r"RECOMMENDATIONS:\s*(.*?)(?=Class|This\s+is\s+to\s+certify|$)", sections["recommendations"], re.IGNORECASE | re.DOTALL)
                         if recommendations_section:
                             rec_text = recommendations_section.group(1)
                             print(f"[DEBUG] Recommendations section: {rec_text}")
                             
                             # For documents with "FIT UNFIT" without clear markers
                             # Check the overall document context for fitness determination
-                            if re.search(r"Medically Fit", text, re.IGNORECASE):
+                            if re.search(r"Medically Fit", sections["recommendations"], re.IGNORECASE):
                                 return "FIT"
-                            elif re.search(r"Unfit for employment", text, re.IGNORECASE):
+                            elif re.search(r"Unfit for employment", sections["recommendations"], re.IGNORECASE):
                                 return "UNFIT"
                             elif "FIT" in rec_text.upper():
                                 return "FIT"
@@ -1074,7 +1924,7 @@ def parse_medical_exam(text: str, filename: str) -> Dict:
                 def detect_medical_class():
                     try:
                         # First check if there are treatment needs
-                        needs_treatment = re.search(r"Needs\s+treatment[/\s]*correction\s+([A-Z\s,\-\.]+?)(?=Treatment\s+optional|Class|Remarks|Date|$)", text, re.IGNORECASE)
+                        needs_treatment = re.search(r"Needs\s+treatment[/\s]*correction\s+([A-Z\s,\-\.]+?)(?=Treatment\s+optional|Class|Remarks|Date|$)", sections["recommendations"], re.IGNORECASE)
                         has_treatment_needs = needs_treatment and needs_treatment.group(1).strip() and needs_treatment.group(1).strip() != ""
                         treatment_details = needs_treatment.group(1).strip() if has_treatment_needs else ""
                         
@@ -1091,7 +1941,8 @@ def parse_medical_exam(text: str, filename: str) -> Dict:
                             print(f"[DEBUG] OVERRIDE: Assigning Class B due to treatment needs: {treatment_details}")
                             return "B"
                         
-                        # Now look for explicit class patterns (but they can be overridden by above logic)
+                        # Now look for explicit class patterns (but they can be overridden by above logic).
+                        # The keyword checks below stay document-wide on purpose: findings anywhere count.
                         class_patterns = [
                             r'Class\s*["\']?([ABCDE])["\']?\s*[-–]\s*Medically Fit',
                             r'Class\s*["\']?([ABCDE])["\']?',
@@ -1100,7 +1951,7 @@ def parse_medical_exam(text: str, filename: str) -> Dict:
                         
                         found_class = None
                         for pattern in class_patterns:
-                            match = re.search(pattern, text, re.IGNORECASE)
+                            match = re.search(pattern, sections["recommendations"], re.IGNORECASE)
                             if match:
                                 found_class = match.group(1).upper()
                                 print(f"[DEBUG] Found medical class in text: {found_class}")
@@ -1207,10 +2058,10 @@ def parse_medical_exam(text: str, filename: str) -> Dict:
                 classification["medical_class"] = detect_medical_class()
 
                 # Extract needs treatment
-                classification["needs_treatment"] = extract_field(r"Needs\s+treatment[/\s]*correction\s+([A-Z\s,\-\.]+?)(?=Treatment\s+optional|Class|Remarks|Date|$)", "")
+                classification["needs_treatment"] = extract_field(r"Needs\s+treatment[/\s]*correction\s+([A-Z\s,\-\.]+?)(?=Treatment\s+optional|Class|Remarks|Date|$)", "recommendations")
 
                 # Extract remarks
-                classification["remarks"] = extract_field(r"Remarks:\s*([a-zA-Z\s,\-\.]+?)(?=Date\s+of\s+Initial|This\s+is\s+to\s+certify|$)", "")
+                classification["remarks"] = extract_field(r"Remarks:\s*([a-zA-Z\s,\-\.]+?)(?=Date\s+of\s+Initial|This\s+is\s+to\s+certify|$)", "recommendations")
 
                 print(f"[DEBUG] Final classification: {classification}")
                 return classification
@@ -1255,7 +2106,7 @@ def parse_medical_exam(text: str, filename: str) -> Dict:
             yes_no_conditions[key] = extract_yes_no_condition(condition)
 
         # Safe age extraction
-        age_str = extract_field(r"AGE:\s*(\d+)", "0")
+        age_str = extract_field(r"AGE:\s*(\d+)", "demographics", "0")
         try:
             age = int(age_str) if age_str else 0
         except ValueError:
@@ -1263,25 +2114,25 @@ def parse_medical_exam(text: str, filename: str) -> Dict:
 
         # Build the final result dictionary
         result = {
-            "patient_name": extract_field(r"PATIENT NAME:\s*([A-Z\s]+?)\s+PID:"),
-            "pid": extract_field(r"PID:\s*(\d+)"),
-            "date_of_birth": extract_field(r"DATE OF BIRTH:\s*([\d/]+)"),
+            "patient_name": extract_field(r"PATIENT NAME:\s*([A-Z\s]+?)\s+PID:", "demographics"),
+            "pid": extract_field(r"PID:\s*(\d+)", "demographics"),
+            "date_of_birth": extract_field(r"DATE OF BIRTH:\s*([\d/]+)", "demographics"),
             "age": age,
-            "sex": extract_field(r"SEX:\s*([A-Z]+)"),
-            "date_of_examination": extract_field(r"DATE OF.*?(\d{2}\s+\d{2}\s+\d{4})"),
-            "civil_status": extract_field(r"CIVIL STATUS:\s*([A-Z]+)"),
-            "company": extract_field(r"COMPANY:\s*([A-Z\s]+?)\s+OCCUPATION:"),
-            "occupation": extract_field(r"OCCUPATION:\s*([A-Z\s]*)", ""),
-
-            "present_illness": extract_field(r"PRESENT ILLNESS:\s*([A-Z\s]*?)\s+ALLERGY:"),
-            "food_allergy": extract_field(r"Food:\s*([A-Z]+)"),
-            "medication_allergy": extract_field(r"Medication:\s*([A-Z]+)"),
-            "past_consultation": extract_field(r"If YES, specify:\s*([A-Z\d\s-]+)"),
-            "maintenance_medications": extract_field(r"If YES, specify:\s*([A-Z\s\d]+)"),
-            "previous_hospitalizations": extract_field(r"Previous Hospitalizations:\s*([A-Z\s,\d-]+)"),
-
-            "menstrual_history_lmp": extract_field(r"LMP\s*:\s*([A-Z\s\d]+)"),
-            "obstetrical_history": extract_field(r"OBSTETRICAL HISTORY:\s*([A-Z\d\s()]+)"),
+            "sex": extract_field(r"SEX:\s*([A-Z]+)", "demographics"),
+            "date_of_examination": extract_field(r"DATE OF.*?(\d{2}\s+\d{2}\s+\d{4})", "demographics"),
+            "civil_status": extract_field(r"CIVIL STATUS:\s*([A-Z]+)", "demographics"),
+            "company": extract_field(r"COMPANY:\s*([A-Z\s]+?)\s+OCCUPATION:", "demographics"),
+            "occupation": extract_field(r"OCCUPATION:\s*([A-Z\s]*)", "demographics", ""),
+
+            "present_illness": extract_field(r"PRESENT ILLNESS:\s*([A-Z\s]*?)\s+ALLERGY:", "history"),
+            "food_allergy": extract_field(r"Food:\s*([A-Z]+)", "history"),
+            "medication_allergy": extract_field(r"Medication:\s*([A-Z]+)", "history"),
+            "past_consultation": extract_field(r"If YES, specify:\s*([A-Z\d\s-]+)", "history"),
+            "maintenance_medications": extract_field(r"If YES, specify:\s*([A-Z\s\d]+)", "history"),
+            "previous_hospitalizations": extract_field(r"Previous Hospitalizations:\s*([A-Z\s,\d-]+)", "history"),
+
+            "menstrual_history_lmp": extract_field(r"LMP\s*:\s*([A-Z\s\d]+)", "history"),
+            "obstetrical_history": extract_field(r"OBSTETRICAL HISTORY:\s*([A-Z\d\s()]+)", "history"),
 
             **vitals,
             **anthro,
@@ -1289,13 +2140,13 @@ def parse_medical_exam(text: str, filename: str) -> Dict:
             **labs,
             **classification,
 
-            "examining_physician": extract_field(r"KRIZIA KATE LANUTAN LIAO\s+([A-Z\s]+)\s+DR\."),
-            "evaluating_personnel": extract_field(r"DR\.\s+([A-Z\s-]+)"),
-            "physician_prc": extract_field(r"PRC#:\s*(\d+)"),
+            "examining_physician": extract_field(r"KRIZIA KATE LANUTAN LIAO\s+([A-Z\s]+)\s+DR\.", "certification"),
+            "evaluating_personnel": extract_field(r"DR\.\s+([A-Z\s-]+)", "certification"),
+            "physician_prc": extract_field(r"PRC#:\s*(\d+)", "certification"),
 
-            "date_of_initial_peme": extract_field(r"Date of Initial PEME:\s*([\d/]+)"),
-            "date_of_fitness": extract_field(r"Date of Fitness:\s*([\d/]*)"),
-            "valid_until": extract_field(r"Valid Until:\s*([\d/]*)"),
+            "date_of_initial_peme": extract_field(r"Date of Initial PEME:\s*([\d/]+)", "certification"),
+            "date_of_fitness": extract_field(r"Date of Fitness:\s*([\d/]*)", "certification"),
+            "valid_until": extract_field(r"Valid Until:\s*([\d/]*)", "certification"),
 
             "fileName": filename,
             "uploadDate": datetime.utcnow().isoformat(),
@@ -1324,20 +2175,17 @@ def parse_medical_exam(text: str, filename: str) -> Dict:
 
 
 @app.post("/extract-chem")
-async def extract_chem(file: UploadFile = File(...)) -> Dict:
+async def extract_chem(request: Request, file: UploadFile = File(...), compact: bool = False) -> Dict:
     try:
         content = await file.read()
-        pdf = fitz.open(stream=content, filetype="pdf")
-        text = "\n".join(page.get_text() for page in pdf)
-        pdf.close()
 
-        result = parse_chemistry(text, file.filename)
-        return result
+        result = await run_scheduled(request, INTERACTIVE, parse_pdf, content, "chem", file.filename, "\n")
+        return ModelResponse(to_model("chem", result), compact=compact)
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error extracting Chemistry data: {str(e)}")
 
-def parse_chemistry(text: str, filename: str) -> Dict:
+def parse_chemistry(text: str, filename: str, layout: Optional[Dict] = None) -> Dict:
     def extract(pattern, default=None):
         match = re.search(pattern, text, re.IGNORECASE)
         return match.group(1).strip() if match else default
@@ -1368,17 +2216,22 @@ def parse_chemistry(text: str, filename: str) -> Dict:
             "reference_range": match.group("ref").strip(),
         })
 
-    # Also extract known chemistry values (optional structured view)
-    lab_data = {
-        "fbs": extract(r"FBS\s*[:\-]?\s*([\d.]+)"),
-        "bua": extract(r"(?:BUA|URIC ACID)\s*[:\-]?\s*([\d.]+)"),
-        "creatinine": extract(r"CREATININE\s*[:\-]?\s*([\d.]+)"),
-        "sgpt": extract(r"(?:ALT|SGPT)\s*[:\-]?\s*([\d.]+)"),
-        "cholesterol": extract(r"CHOLESTEROL\s*[:\-]?\s*([\d.]+)"),
-        "hdl": extract(r"HDL\s*[:\-]?\s*([\d.]+)"),
-        "ldl": extract(r"LDL\s*[:\-]?\s*([\d.]+)"),
-        "triglycerides": extract(r"TRIGLYCERIDES\s*[:\-]?\s*([\d.]+)")
-    }
+    # Also extract known chemistry values (optional structured view); a known lab
+    # layout gives them by position, the patterns are for the others
+    results = lab_templates.table("chem", layout)
+    if results is not None:
+        lab_data = {field: value["result"] or None for field, value in results.items()}
+    else:
+        lab_data = {
+            "fbs": extract(r"FBS\s*[:\-]?\s*([\d.]+)"),
+            "bua": extract(r"(?:BUA|URIC ACID)\s*[:\-]?\s*([\d.]+)"),
+            "creatinine": extract(r"CREATININE\s*[:\-]?\s*([\d.]+)"),
+            "sgpt": extract(r"(?:ALT|SGPT)\s*[:\-]?\s*([\d.]+)"),
+            "cholesterol": extract(r"CHOLESTEROL\s*[:\-]?\s*([\d.]+)"),
+            "hdl": extract(r"HDL\s*[:\-]?\s*([\d.]+)"),
+            "ldl": extract(r"LDL\s*[:\-]?\s*([\d.]+)"),
+            "triglycerides": extract(r"TRIGLYCERIDES\s*[:\-]?\s*([\d.]+)")
+        }
 
     return {
         "uniqueId": filename.replace(".pdf", ""),
@@ -1396,3 +2249,77 @@ def parse_chemistry(text: str, filename: str) -> Dict:
         "test_results": tests,
         **lab_data  # Merges structured fields
     }
+
+
+# Report type -> parser, shared by the API routes and the offline tools
+# Parsers that take the page 1 layout and read known lab templates by position (lab_templates)
+LAYOUT_PARSERS = ("cbc", "urinalysis", "lipid", "chem")
+
+PARSERS = {
+    "xray": parse_xray_data,
+    "cbc": parse_cbc_data,
+    "urinalysis": parse_urinalysis,
+    "lipid": parse_lipid_profile,
+    "ecg": parse_ecg_data,
+    "medical": parse_medical_exam,
+    "chem": parse_chemistry,
+}
+
+# Filename prefixes used by the lab and clinic exports, e.g. "CBC_RADEN2025.pdf"
+REPORT_TYPE_PREFIXES = [
+    ("XRAY", "xray"),
+    ("CBC", "cbc"),
+    ("UA", "urinalysis"),
+    ("URINALYSIS", "urinalysis"),
+    ("ECG", "ecg"),
+    ("MEDICAL", "medical"),
+    ("MEXAM", "medical"),
+    ("SGPT", "lipid"),
+    ("LIPID", "lipid"),
+    ("FBS", "chem"),
+    ("CHEM", "chem"),
+]
+
+
+def guess_report_type(filename: str) -> str:
+    name = Path(filename).name.upper()
+    for prefix, report_type in REPORT_TYPE_PREFIXES:
+        if name.startswith(prefix):
+            return report_type
+    return ""
+
+
+@app.post("/screen-abnormal")
+def screen_abnormal(payload: Dict = Body(...)) -> Dict:
+    """
+    Bulk abnormal-result screening over already parsed CBC, urinalysis, lipid
+    and chemistry records, e.g. every CBC of one company.
+    Body: {"records": [...], "abnormal_only": true}
+    """
+    records = payload.get("records")
+    if not isinstance(records, list):
+        raise HTTPException(status_code=400, detail="Expected a 'records' list in the request body")
+
+    records = [record for record in records if isinstance(record, dict)]
+    return screen_records(records, abnormal_only=bool(payload.get("abnormal_only", True)))
+
+
+@app.post("/reparse")
+def reparse(request: Request, type: Optional[str] = None, write: bool = False,
+            workers: Optional[int] = None) -> Dict:
+    """
+    Re-run the current parsers over the stored text sidecars (no PDFs are
+    opened) and report which fields changed. ?type=lipid,medical limits the
+    report types; ?write=true stores the new results in the sidecars only
+    (what /analytics/rebuild and /search/rebuild read). The saved records are
+    left as they are, admin edits included: apply the reported changes to
+    them through PATCH /records/{type}/{id}.
+    """
+    require_admin(request, "Reparsing is restricted to admins")
+    report_types = [t.strip() for t in type.split(",")] if type else None
+    if report_types:
+        unknown = [t for t in report_types if t not in PARSERS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown report type: {', '.join(unknown)}. Expected one of: {', '.join(PARSERS)}")
+
+    return reparse_all(blob_store, PARSERS, PARSER_VERSION, report_types=report_types, workers=workers, write=write)
@@ -0,0 +1,387 @@
+from dataclasses import dataclass, field, fields
+from typing import Any, Dict, List, Optional, Union, get_type_hints
+
+import orjson
+from fastapi.responses import Response
+
+
+# Values treated as "empty" by the compact response mode
+EMPTY_VALUES = ("", "UNKNOWN", None)
+
+
+@dataclass(slots=True)
+class LabValue:
+    result: str = ""
+    unit: str = ""
+    reference_range: str = ""
+    flag: str = ""
+
+
+@dataclass(slots=True)
+class ChemistryTestRow:
+    test_name: str = ""
+    result: str = ""
+    unit: str = ""
+    reference_range: str = ""
+
+
+@dataclass(slots=True)
+class XRayResult:
+    patientName: str = ""
+    dateOfBirth: str = ""
+    age: int = 0
+    gender: str = ""
+    company: str = ""
+    examination: str = ""
+    reportDate: str = ""
+    interpretation: str = ""
+    impression: str = ""
+    fileName: str = ""
+    uploadDate: str = ""
+    uniqueId: str = ""
+    pdfUrl: str = ""
+
+
+@dataclass(slots=True)
+class CbcResult:
+    patientName: str = ""
+    mrn: str = ""
+    gender: str = ""
+    age: int = 0
+    dob: str = ""
+    collectionDateTime: str = ""
+    resultValidated: str = ""
+    rbc: LabValue = field(default_factory=LabValue)
+    hematocrit: LabValue = field(default_factory=LabValue)
+    hemoglobin: LabValue = field(default_factory=LabValue)
+    mcv: LabValue = field(default_factory=LabValue)
+    mch: LabValue = field(default_factory=LabValue)
+    mchc: LabValue = field(default_factory=LabValue)
+    rdw: LabValue = field(default_factory=LabValue)
+    platelets: LabValue = field(default_factory=LabValue)
+    mpv: LabValue = field(default_factory=LabValue)
+    wbc: LabValue = field(default_factory=LabValue)
+    neutrophils_percent: LabValue = field(default_factory=LabValue)
+    lymphocytes_percent: LabValue = field(default_factory=LabValue)
+    monocytes_percent: LabValue = field(default_factory=LabValue)
+    eosinophils_percent: LabValue = field(default_factory=LabValue)
+    basophils_percent: LabValue = field(default_factory=LabValue)
+    total_percent: str = ""
+    neutrophils_abs: LabValue = field(default_factory=LabValue)
+    lymphocytes_abs: LabValue = field(default_factory=LabValue)
+    monocytes_abs: LabValue = field(default_factory=LabValue)
+    eosinophils_abs: LabValue = field(default_factory=LabValue)
+    basophils_abs: LabValue = field(default_factory=LabValue)
+    fileName: str = ""
+    uploadDate: str = ""
+    uniqueId: str = ""
+    pdfUrl: str = ""
+
+
+@dataclass(slots=True)
+class UrinalysisResult:
+    patientName: str = ""
+    mrn: str = ""
+    gender: str = ""
+    age: str = ""
+    dob: str = ""
+    collectionDateTime: str = ""
+    resultValidated: str = ""
+    orderNumber: str = ""
+    location: str = ""
+    color: LabValue = field(default_factory=LabValue)
+    clarity: LabValue = field(default_factory=LabValue)
+    glucose: LabValue = field(default_factory=LabValue)
+    bilirubin: LabValue = field(default_factory=LabValue)
+    ketones: LabValue = field(default_factory=LabValue)
+    specific_gravity: LabValue = field(default_factory=LabValue)
+    blood: LabValue = field(default_factory=LabValue)
+    ph: LabValue = field(default_factory=LabValue)
+    protein: LabValue = field(default_factory=LabValue)
+    urobilinogen: LabValue = field(default_factory=LabValue)
+    nitrite: LabValue = field(default_factory=LabValue)
+    leukocyte_esterase: LabValue = field(default_factory=LabValue)
+    rbc: LabValue = field(default_factory=LabValue)
+    wbc: LabValue = field(default_factory=LabValue)
+    epithelial_cells: LabValue = field(default_factory=LabValue)
+    bacteria: LabValue = field(default_factory=LabValue)
+    hyaline_cast: LabValue = field(default_factory=LabValue)
+    remarks: LabValue = field(default_factory=LabValue)
+    fileName: str = ""
+    uploadDate: str = ""
+    uniqueId: str = ""
+    pdfUrl: str = ""
+
+
+@dataclass(slots=True)
+class LipidResult:
+    patientName: str = ""
+    mrn: str = ""
+    gender: str = ""
+    age: str = ""
+    dob: str = ""
+    collectionDateTime: str = ""
+    resultValidated: str = ""
+    location: str = ""
+    alt_sgpt: LabValue = field(default_factory=LabValue)
+    total_cholesterol: LabValue = field(default_factory=LabValue)
+    triglycerides: LabValue = field(default_factory=LabValue)
+    hdl_cholesterol: LabValue = field(default_factory=LabValue)
+    ldl_cholesterol: LabValue = field(default_factory=LabValue)
+    vldl: LabValue = field(default_factory=LabValue)
+    fileName: str = ""
+    uploadDate: str = ""
+    uniqueId: str = ""
+    pdfUrl: str = ""
+
+
+@dataclass(slots=True)
+class EcgResult:
+    pidNo: str = ""
+    date: str = ""
+    patientName: str = ""
+    referringPhysician: str = ""
+    hr: str = ""
+    bp: str = ""
+    age: str = ""
+    sex: str = ""
+    birthDate: str = ""
+    qrs: str = ""
+    qtQtc: str = ""
+    pr: str = ""
+    pWave: str = ""
+    rrPp: str = ""
+    pqrstAxis: str = ""
+    interpretation: str = ""
+    fileName: str = ""
+    uploadDate: str = ""
+    uniqueId: str = ""
+    pdfUrl: str = ""
+
+
+@dataclass(slots=True)
+class MedicalExamResult:
+    patient_name: str = ""
+    pid: str = ""
+    date_of_birth: str = ""
+    age: int = 0
+    sex: str = ""
+    date_of_examination: str = ""
+    civil_status: str = ""
+    company: str = ""
+    occupation: str = ""
+    present_illness: str = ""
+    food_allergy: str = ""
+    medication_allergy: str = ""
+    past_consultation: str = ""
+    maintenance_medications: str = ""
+    previous_hospitalizations: str = ""
+    menstrual_history_lmp: str = ""
+    obstetrical_history: str = ""
+
+    # Vital signs
+    blood_pressure: str = ""
+    pulse: str = ""
+    spo2: str = ""
+    respiratory_rate: str = ""
+    temperature: str = ""
+
+    # Anthropometrics
+    height: str = ""
+    weight: str = ""
+    bmi: str = ""
+    ibw: str = ""
+
+    # Visual acuity
+    vision_adequacy: str = ""
+    od: str = ""
+    os: str = ""
+
+    # Lab findings
+    cbc: str = ""
+    urinalysis: str = ""
+    blood_chemistry: str = ""
+    chest_xray: str = ""
+    ecg: str = ""
+
+    # Classification
+    fitness_status: str = ""
+    medical_class: str = ""
+    needs_treatment: str = ""
+    remarks: str = ""
+
+    examining_physician: str = ""
+    evaluating_personnel: str = ""
+    physician_prc: str = ""
+    date_of_initial_peme: str = ""
+    date_of_fitness: str = ""
+    valid_until: str = ""
+
+    fileName: str = ""
+    uploadDate: str = ""
+    uniqueId: str = ""
+    pdfUrl: str = ""
+
+    # Medical history (YES / NO / UNKNOWN)
+    head_or_neck_injury: str = ""
+    frequent_dizziness: str = ""
+    fainting_spells: str = ""
+    chronic_cough: str = ""
+    heart_disease__chest_pain: str = ""
+    hypertension: str = ""
+    diabetes: str = ""
+    asthma: str = ""
+    epilepsy: str = ""
+    mental_disorder: str = ""
+    tuberculosis: str = ""
+    cancer: str = ""
+    kidney_disease: str = ""
+    others: str = ""
+
+    # Set only when the parser fell back to its minimal result
+    error: str = ""
+
+
+@dataclass(slots=True)
+class ChemistryResult:
+    uniqueId: str = ""
+    fileName: str = ""
+    uploadDate: str = ""
+    name: Optional[str] = None
+    mrn: Optional[str] = None
+    gender: Optional[str] = None
+    age: Optional[str] = None
+    care_provider: Optional[str] = None
+    location: Optional[str] = None
+    dob: Optional[str] = None
+    collection_datetime: Optional[str] = None
+    result_validated: Optional[str] = None
+    test_results: List[ChemistryTestRow] = field(default_factory=list)
+    fbs: Optional[str] = None
+    bua: Optional[str] = None
+    creatinine: Optional[str] = None
+    sgpt: Optional[str] = None
+    cholesterol: Optional[str] = None
+    hdl: Optional[str] = None
+    ldl: Optional[str] = None
+    triglycerides: Optional[str] = None
+    pdfUrl: str = ""
+
+
+RESULT_MODELS = {
+    "xray": XRayResult,
+    "cbc": CbcResult,
+    "urinalysis": UrinalysisResult,
+    "lipid": LipidResult,
+    "ecg": EcgResult,
+    "medical": MedicalExamResult,
+    "chem": ChemistryResult,
+}
+
+_MODEL_TYPES = tuple(RESULT_MODELS.values())
+
+ResultModel = Union[
+    XRayResult, CbcResult, UrinalysisResult, LipidResult, EcgResult, MedicalExamResult, ChemistryResult
+]
+
+
+def _build_converters(model) -> Dict[str, Any]:
+    """Per-field converter for nested values, resolved once per model class."""
+    hints = get_type_hints(model)
+    converters = {}
+    for model_field in fields(model):
+        hint = hints[model_field.name]
+        if hint is LabValue:
+            converters[model_field.name] = lambda value: LabValue(**value) if isinstance(value, dict) else value
+        elif hint == List[ChemistryTestRow]:
+            converters[model_field.name] = lambda rows: [
+                ChemistryTestRow(**row) if isinstance(row, dict) else row for row in rows or []
+            ]
+        else:
+            converters[model_field.name] = None
+    return converters
+
+
+_CONVERTERS = {model: _build_converters(model) for model in RESULT_MODELS.values()}
+
+
+def to_model(report_type: str, data: Dict) -> Union[ResultModel, Dict]:
+    """
+    Build the typed result model for a parser's dict output.
+    Keys the model does not know about are never dropped: the dict is
+    returned unchanged instead and serialized the slow way.
+    """
+    model = RESULT_MODELS[report_type]
+    converters = _CONVERTERS[model]
+
+    kwargs = {}
+    for key, value in data.items():
+        if key not in converters:
+            print(f"[MODEL] {model.__name__} has no field '{key}', keeping dict result")
+            return data
+        convert = converters[key]
+        kwargs[key] = convert(value) if convert else value
+
+    return model(**kwargs)
+
+
+def _compact(value: Any) -> Any:
+    if isinstance(value, LabValue):
+        result = {name: getattr(value, name) for name in LabValue.__slots__ if getattr(value, name) not in EMPTY_VALUES}
+        return result or None
+    if isinstance(value, ChemistryTestRow):
+        return {name: getattr(value, name) for name in ChemistryTestRow.__slots__ if getattr(value, name) not in EMPTY_VALUES}
+    if isinstance(value, list):
+        return [_compact(item) for item in value]
+    return value
+
+
+def compact_payload(value: Any) -> Any:
+    """
+    Drop empty fields ("", "UNKNOWN", None, empty lab values) from a model,
+    dict or list of them.
+    """
+    if isinstance(value, _MODEL_TYPES):
+        items = ((name, getattr(value, name)) for name in value.__slots__)
+    elif isinstance(value, dict):
+        items = value.items()
+    elif isinstance(value, list):
+        return [compact_payload(item) for item in value]
+    else:
+        return _compact(value)
+
+    payload = {}
+    for name, item in items:
+        item = compact_payload(item) if isinstance(item, (dict, list) + _MODEL_TYPES) else _compact(item)
+        if item in EMPTY_VALUES or item == [] or item == {}:
+            continue
+        payload[name] = item
+    return payload
+
+
+def dumps(value: Any, compact: bool = False) -> bytes:
+    """
+    Serialize models (or containers of models) with orjson.
+    Full responses go through orjson's native dataclass path.
+    """
+    if compact:
+        value = compact_payload(value)
+    return orjson.dumps(value, option=orjson.OPT_SERIALIZE_NUMPY, default=_default)
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+class ModelResponse(Response):
+    """JSON response that skips jsonable_encoder and renders with orjson."""
+    media_type = "application/json"
+
+    def __init__(self, content: Any, compact: bool = False, **kwargs):
+        self.compact = compact
+        super().__init__(content, **kwargs)
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content, compact=self.compact)
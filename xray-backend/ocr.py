@@ -0,0 +1,165 @@
+import hashlib
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import fitz  # PyMuPDF
+
+
+# A page with less text than this (and at least one image) is treated as scanned
+OCR_MIN_TEXT_CHARS = int(os.getenv("OCR_MIN_TEXT_CHARS", "20"))
+OCR_LANGUAGE = os.getenv("OCR_LANGUAGE", "eng")
+OCR_DPI = int(os.getenv("OCR_DPI", "300"))
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(min(4, os.cpu_count() or 1))))
+OCR_CACHE_DIR = os.getenv("OCR_CACHE_DIR", "ocr_cache")
+OCR_MEMORY_CACHE_SIZE = int(os.getenv("OCR_MEMORY_CACHE_SIZE", "512"))
+
+
+class OcrCache:
+    """OCR text keyed by page content hash: small in-memory LRU in front of a disk directory."""
+
+    def __init__(self, directory: str, max_entries: int):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.txt")
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                text = f.read()
+        except FileNotFoundError:
+            return None
+        self._remember(key, text)
+        return text
+
+    def put(self, key: str, text: str) -> None:
+        # Extraction workers share the directory: each writer gets its own temp file
+        tmp_path = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            # The text is still good for this upload; it just isn't cached on disk
+            print(f"[OCR CACHE ERROR] {key}: {str(e)}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+        self._remember(key, text)
+
+    def _remember(self, key: str, text: str) -> None:
+        with self._lock:
+            self._entries[key] = text
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+ocr_cache = OcrCache(OCR_CACHE_DIR, OCR_MEMORY_CACHE_SIZE)
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=OCR_WORKERS)
+        return _executor
+
+
+def page_needs_ocr(page: fitz.Page, text: str) -> bool:
+    """Preflight: the page has (almost) no text layer but does carry an image, i.e. a scan."""
+    if len(text.strip()) >= OCR_MIN_TEXT_CHARS:
+        return False
+    return bool(page.get_images(full=False))
+
+
+def page_content_hash(pdf: fitz.Document, page: fitz.Page) -> str:
+    """Hash of the page's content stream plus the raw bytes of every image it draws."""
+    digest = hashlib.sha256()
+    digest.update(page.read_contents())
+    for image in page.get_images(full=False):
+        digest.update(pdf.xref_stream_raw(image[0]) or b"")
+    digest.update(f"{OCR_LANGUAGE}:{OCR_DPI}".encode())
+    return digest.hexdigest()
+
+
+def _ocr_page(content: bytes, page_number: int, language: str, dpi: int) -> str:
+    # Runs in a worker process, each with its own document handle
+    pdf = fitz.open(stream=content, filetype="pdf")
+    try:
+        page = pdf[page_number]
+        textpage = page.get_textpage_ocr(language=language, dpi=dpi, full=True)
+        return page.get_text(textpage=textpage)
+    finally:
+        pdf.close()
+
+
+def ocr_pages(content: bytes, page_numbers: List[int]) -> Dict[int, str]:
+    """OCR several pages of one document in parallel."""
+    if len(page_numbers) == 1 or multiprocessing.parent_process() is not None:
+        # One page is not worth the hop to another process, and pool workers
+        # (the extraction workers, batch_ingest.py) must not start a pool of
+        # their own per worker
+        return {number: _ocr_page(content, number, OCR_LANGUAGE, OCR_DPI) for number in page_numbers}
+
+    executor = _get_executor()
+    futures = {
+        page_number: executor.submit(_ocr_page, content, page_number, OCR_LANGUAGE, OCR_DPI)
+        for page_number in page_numbers
+    }
+    return {page_number: future.result() for page_number, future in futures.items()}
+
+
+def extract_page_texts(pdf: fitz.Document, content: bytes) -> List[str]:
+    """
+    Text of every page, falling back to OCR only for pages without a text
+    layer. Regular PDFs never reach the OCR path.
+    """
+    texts = [page.get_text() for page in pdf]
+
+    scanned = [number for number, text in enumerate(texts) if page_needs_ocr(pdf[number], text)]
+    if not scanned:
+        return texts
+
+    misses = {}
+    for number in scanned:
+        key = page_content_hash(pdf, pdf[number])
+        cached = ocr_cache.get(key)
+        if cached is not None:
+            texts[number] = cached
+        else:
+            misses[number] = key
+
+    if misses:
+        print(f"[OCR] Running OCR on pages {[number + 1 for number in misses]}")
+        try:
+            results = ocr_pages(content, list(misses))
+        except Exception as e:
+            # Tesseract missing or failed: keep whatever text layer there was
+            print(f"[OCR ERROR] {str(e)}")
+            results = {}
+        for number, text in results.items():
+            texts[number] = text
+            ocr_cache.put(misses[number], text)
+
+    return texts
+
+
+def extract_text(pdf: fitz.Document, content: bytes, separator: str = "") -> str:
+    return separator.join(extract_page_texts(pdf, content))
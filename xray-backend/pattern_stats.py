@@ -0,0 +1,216 @@
+import atexit
+import json
+import multiprocessing.util
+import os
+import re
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence
+
+
+PATTERN_STATS_PATH = os.getenv("PATTERN_STATS_PATH", "pattern_stats.json")
+PATTERN_STATS_FLUSH_SECONDS = float(os.getenv("PATTERN_STATS_FLUSH_SECONDS", "30"))
+# Keep the written order for a template until it has this many matches
+PATTERN_STATS_MIN_SAMPLES = int(os.getenv("PATTERN_STATS_MIN_SAMPLES", "5"))
+
+TEMPLATE_HEADER_LINES = 8
+
+
+def template_key(text: str) -> str:
+    """
+    Identify the lab template from the header lines above the patient block
+    ("TEST / Result / Unit / ... / COMPLETE BLOOD COUNT"); digits are dropped
+    so dates and order numbers don't split a template.
+    """
+    lines = []
+    for line in text[:1024].splitlines():
+        line = re.sub(r"\d+", "", line).strip()
+        if not line:
+            continue
+        if line.lower().startswith("name") or len(lines) == TEMPLATE_HEADER_LINES:
+            break
+        lines.append(line.lower())
+    return f"{zlib.crc32(chr(10).join(lines).encode()):08x}"
+
+
+class PatternStats:
+    """
+    Which of a field's fallback patterns matched, per report type and lab
+    template. Counts are merged into a JSON file every few seconds, so they
+    survive restarts and several workers can share one file. Patterns are
+    tried most successful first, but a hit is only returned once the patterns
+    written before it have failed: the result is always the written order's.
+    """
+
+    def __init__(self, path: str = PATTERN_STATS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._counts: Dict[str, Dict] = {}
+        self._pending: Dict[str, Dict] = {}
+        self._last_flush = time.monotonic()
+        self._local = threading.local()
+        self._counts = self._read()
+
+    def _read(self) -> Dict[str, Dict]:
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f).get("counts", {})
+        except (OSError, ValueError) as e:
+            print(f"[PATTERN STATS ERROR] Could not read {self.path}: {str(e)}")
+            return {}
+
+    @staticmethod
+    def _entry(table: Dict, report_type: str, template: str, field: str, n: int) -> Dict:
+        entry = table.setdefault(report_type, {}).setdefault(template, {}).setdefault(
+            field, {"hits": [0] * n, "misses": 0, "tries": 0})
+        if len(entry["hits"]) < n:
+            entry["hits"].extend([0] * (n - len(entry["hits"])))
+        return entry
+
+    @staticmethod
+    def _add(table: Dict, report_type: str, template: str, field: str, n: int,
+             index: Optional[int], tries: int) -> None:
+        entry = PatternStats._entry(table, report_type, template, field, n)
+        if index is None:
+            entry["misses"] += 1
+        else:
+            entry["hits"][index] += 1
+        entry["tries"] += tries
+
+    def order(self, report_type: str, template: str, field: str, n: int) -> List[int]:
+        """Pattern indices to try, most successful first (ties keep the written order)."""
+        entry = self._counts.get(report_type, {}).get(template, {}).get(field)
+        if not entry or sum(entry["hits"]) < PATTERN_STATS_MIN_SAMPLES:
+            return list(range(n))
+        hits = entry["hits"]
+        return sorted(range(n), key=lambda i: (-(hits[i] if i < len(hits) else 0), i))
+
+    def record(self, report_type: str, template: str, field: str, n: int, index: Optional[int], tries: int) -> None:
+        with self._lock:
+            self._add(self._counts, report_type, template, field, n, index, tries)
+            self._add(self._pending, report_type, template, field, n, index, tries)
+        if time.monotonic() - self._last_flush >= PATTERN_STATS_FLUSH_SECONDS:
+            self.flush()
+
+    @staticmethod
+    def _search(order: List[int], patterns: Sequence[str], text: str, flags: int,
+                texts: Optional[Sequence[str]], accept: Optional[Callable[[re.Match], bool]]):
+        """
+        (pattern index, match, patterns tried) of the first accepted match in
+        the written order, trying the patterns in the given order: fallback
+        patterns are often looser versions of the ones above them and match
+        the same text elsewhere, so a hit at i only stands once every pattern
+        before i that has not failed yet is tried and fails too.
+        """
+        def search(i: int) -> Optional[re.Match]:
+            match = re.search(patterns[i], texts[i] if texts else text, flags)
+            return match if match and (accept is None or accept(match)) else None
+
+        tries = 0
+        failed = set()
+        for i in order:
+            tries += 1
+            match = search(i)
+            if match is None:
+                failed.add(i)
+                continue
+            for j in range(i):
+                if j in failed:
+                    continue
+                tries += 1
+                earlier = search(j)
+                if earlier is not None:
+                    return j, earlier, tries
+            return i, match, tries
+        return None, None, tries
+
+    def first_match(self, report_type: str, field: str, patterns: Sequence[str], text: str,
+                    flags: int = 0, template: Optional[str] = None, texts: Optional[Sequence[str]] = None,
+                    accept: Optional[Callable[[re.Match], bool]] = None) -> Optional[re.Match]:
+        """
+        re.search the patterns in adaptive order and return the first accepted
+        match of the written order (see _search). texts, when given, is the
+        text to search for each pattern. Pass the template_key of the document
+        when looking up several fields of it.
+        """
+        if template is None:
+            template = template_key(text)
+        n = len(patterns)
+        index, match, tries = self._search(self.order(report_type, template, field, n), patterns, text, flags,
+                                           texts, accept)
+        if not getattr(self._local, "paused", False):
+            self.record(report_type, template, field, n, index, tries)
+        return match
+
+    @contextmanager
+    def paused(self):
+        """Searches on this thread keep their order but record nothing (the shadow re-runs of a parser)."""
+        self._local.paused = True
+        try:
+            yield
+        finally:
+            self._local.paused = False
+
+    def flush(self) -> None:
+        """Add the counts gathered since the last flush to the file."""
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if not self._pending or not self.path:
+                return
+            pending, self._pending = self._pending, {}
+            merged = self._read()
+            for report_type, templates in pending.items():
+                for template, fields in templates.items():
+                    for field, delta in fields.items():
+                        entry = self._entry(merged, report_type, template, field, len(delta["hits"]))
+                        for i, hits in enumerate(delta["hits"]):
+                            entry["hits"][i] += hits
+                        entry["misses"] += delta["misses"]
+                        entry["tries"] += delta["tries"]
+            try:
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump({"version": 1, "counts": merged}, f)
+                os.replace(tmp_path, self.path)
+                self._counts = merged
+            except OSError as e:
+                print(f"[PATTERN STATS ERROR] Could not write {self.path}: {str(e)}")
+
+    def summary(self, report_type: Optional[str] = None) -> Dict:
+        """Counts with the current order and the share of first-attempt matches."""
+        with self._lock:
+            counts = json.loads(json.dumps(self._counts))
+        result = {}
+        for rtype, templates in counts.items():
+            if report_type and rtype != report_type:
+                continue
+            for template, fields in templates.items():
+                for field, entry in fields.items():
+                    matched = sum(entry["hits"])
+                    attempts = matched + entry["misses"]
+                    entry["order"] = self.order(rtype, template, field, len(entry["hits"]))
+                    entry["tries_per_lookup"] = round(entry["tries"] / attempts, 2) if attempts else 0
+            result[rtype] = templates
+        return {"path": self.path, "min_samples": PATTERN_STATS_MIN_SAMPLES, "counts": result}
+
+    def _flush_at_process_exit(self) -> None:
+        # Pool workers end through multiprocessing, which runs its finalizers but not atexit
+        multiprocessing.util.Finalize(self, self.flush, exitpriority=10)
+
+    def _after_fork(self) -> None:
+        # The parent's unflushed counts are the parent's to write
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._flush_at_process_exit()
+
+
+pattern_stats = PatternStats()
+atexit.register(pattern_stats.flush)
+multiprocessing.util.register_after_fork(pattern_stats, PatternStats._after_fork)
+if multiprocessing.parent_process() is not None:
+    # A spawned worker imports this module itself
+    pattern_stats._flush_at_process_exit()
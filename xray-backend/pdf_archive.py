@@ -0,0 +1,306 @@
+import os
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import fitz  # PyMuPDF
+
+from blob_store import BlobStore
+from pdf_documents import DocumentPool, open_pdf
+from sidecars import read_sidecar, sidecar_key
+
+
+# When stored PDFs are rewritten: "off", "upload" (before the upload is stored) or "background"
+ARCHIVE_PDFS = os.getenv("ARCHIVE_PDFS", "off")
+# Report types rewritten; the lab reports carry a full-page background scan. Radiographs are left alone
+ARCHIVE_TYPES = os.getenv("ARCHIVE_TYPES", "cbc,urinalysis,lipid,chem")
+# Images drawn at more than 1.5x this resolution are downsampled to it; 0 keeps every image (lossless only)
+ARCHIVE_IMAGE_DPI = int(os.getenv("ARCHIVE_IMAGE_DPI", "150"))
+ARCHIVE_JPEG_QUALITY = int(os.getenv("ARCHIVE_JPEG_QUALITY", "75"))
+# The uploaded bytes are kept under ARCHIVE_ORIGINALS_PREFIX for audit
+ARCHIVE_KEEP_ORIGINALS = os.getenv("ARCHIVE_KEEP_ORIGINALS", "0") == "1"
+ARCHIVE_ORIGINALS_PREFIX = os.getenv("ARCHIVE_ORIGINALS_PREFIX", "originals")
+
+# Below this the resample isn't worth a second lossy encode (Ghostscript uses the same threshold)
+DOWNSAMPLE_THRESHOLD = 1.5
+# A rewrite saving less than this share is dropped, so a second pass doesn't replace every file again
+MIN_SAVING = 0.05
+# Backfill jobs kept for /archive/jobs/{id}
+JOBS_KEPT = 20
+
+
+def _downsample_images(pdf: fitz.Document, dpi: int, quality: int) -> int:
+    """Re-encode images drawn above the threshold as JPEG at dpi; returns how many were replaced."""
+    replaced = 0
+    seen = set()
+    for page in pdf:
+        for image in page.get_images(full=True):
+            xref, smask, width, height = image[0], image[1], image[2], image[3]
+            if xref in seen:
+                continue
+            seen.add(xref)
+            # Logos with transparency are small; JPEG would drop their mask
+            if smask:
+                continue
+            rects = page.get_image_rects(xref)
+            shown = max((max(r.width, r.height) for r in rects), default=0) / 72
+            if not shown:
+                continue
+            scale = dpi / (max(width, height) / shown)
+            if scale * DOWNSAMPLE_THRESHOLD >= 1:
+                continue
+            pixmap = fitz.Pixmap(pdf, xref)
+            if pixmap.alpha:
+                continue
+            if pixmap.colorspace is None or pixmap.colorspace.n not in (1, 3):
+                pixmap = fitz.Pixmap(fitz.csRGB, pixmap)
+            small = fitz.Pixmap(pixmap, max(1, round(width * scale)), max(1, round(height * scale)), None)
+            page.replace_image(xref, stream=small.tobytes("jpg", jpg_quality=quality))
+            replaced += 1
+    return replaced
+
+
+def recompress(content: bytes, dpi: int = ARCHIVE_IMAGE_DPI, quality: int = ARCHIVE_JPEG_QUALITY) -> Tuple[bytes, Dict]:
+    """
+    The PDF rewritten for storage: oversized images downsampled (dpi > 0),
+    embedded fonts subset to the glyphs used, then saved with garbage=4
+    (unused and duplicate objects, so repeated images are stored once) and
+    every stream deflated. Returns the original bytes when the rewrite saves
+    less than MIN_SAVING or would change the text layer. Runs in an
+    extraction worker (DocumentPool.run).
+    """
+    start = time.perf_counter()
+    report = {"before": len(content), "after": len(content), "saved": 0, "images": 0, "kept": True}
+    with open_pdf(content) as pdf:
+        texts = [page.get_text() for page in pdf]
+        if dpi > 0:
+            report["images"] = _downsample_images(pdf, dpi, quality)
+        pdf.subset_fonts()
+        data = pdf.tobytes(garbage=4, deflate=True, deflate_images=True, deflate_fonts=True)
+
+    if len(data) < len(content) * (1 - MIN_SAVING):
+        with open_pdf(data) as pdf:
+            same_text = [page.get_text() for page in pdf] == texts
+        if same_text:
+            report.update(after=len(data), saved=len(content) - len(data), kept=False)
+        else:
+            print("[ARCHIVE] Rewrite changed the text layer; keeping the original")
+    report["took_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return (content if report["kept"] else data), report
+
+
+def originals_key(key: str) -> str:
+    return f"{ARCHIVE_ORIGINALS_PREFIX}/{key}"
+
+
+class PdfArchiver:
+    """
+    The archival pass over stored PDFs. At upload it stores the rewritten
+    PDF instead of the uploaded one; in the background the uploaded PDF is
+    stored as is and replaced once the rewrite is done (unless a newer upload
+    replaced it first). Either way the original can be kept for audit, and
+    view_pdf serves the smaller file. The backfill over already stored PDFs
+    runs as a job on the same thread. The rewrites themselves run in the
+    document pool's workers. Counts and jobs are per process.
+    """
+
+    def __init__(self, mode: str = ARCHIVE_PDFS, types: str = ARCHIVE_TYPES, keep_originals: bool = ARCHIVE_KEEP_ORIGINALS):
+        self.mode = mode
+        self.types = {t.strip() for t in types.split(",") if t.strip()}
+        self.keep_originals = keep_originals
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._counts: Counter = Counter()
+        self._jobs: "OrderedDict[str, Dict]" = OrderedDict()
+
+    def applies(self, report_type: str) -> bool:
+        return self.mode in ("upload", "background") and report_type in self.types
+
+    def store(self, store: BlobStore, key: str, content: bytes, report_type: str, pool: DocumentPool) -> Optional[Dict]:
+        """Put an uploaded PDF in the store, rewritten now or later per ARCHIVE_PDFS; the report at upload."""
+        if not self.applies(report_type):
+            store.put(key, content, "application/pdf")
+            return None
+        if self.keep_originals:
+            store.put(originals_key(key), content, "application/pdf")
+        if self.mode == "background":
+            store.put(key, content, "application/pdf")
+            self.submit(store, key, pool)
+            return None
+        try:
+            data, report = pool.run(recompress, content)
+        except Exception as e:
+            print(f"[ARCHIVE ERROR] {key}: {str(e)}")
+            store.put(key, content, "application/pdf")
+            self._count(None)
+            return None
+        store.put(key, data, "application/pdf")
+        self._count(report)
+        print(f"[ARCHIVE] {key}: {report['before']} -> {report['after']} bytes")
+        return report
+
+    def _submit(self, fn: Callable, *args) -> None:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="archive")
+        self._executor.submit(fn, *args)
+
+    def submit(self, store: BlobStore, key: str, pool: DocumentPool) -> None:
+        self._submit(self._archive_logged, store, key, pool)
+
+    def _archive_logged(self, store: BlobStore, key: str, pool: DocumentPool) -> None:
+        try:
+            self.archive(store, key, pool)
+        except Exception as e:
+            print(f"[ARCHIVE ERROR] {key}: {str(e)}")
+            self._count(None)
+
+    def archive(self, store: BlobStore, key: str, pool: DocumentPool, dry_run: bool = False) -> Dict:
+        """Rewrite one stored PDF in place; the report says what it saved."""
+        stat = store.stat(key)
+        content = store.get(key)
+        if stat is None or content is None:
+            raise FileNotFoundError(f"No PDF {key}")
+        data, report = pool.run(recompress, content)
+        report["key"] = key
+        if dry_run:
+            return report
+        if report["kept"]:
+            self._count(report)
+            return report
+        if self.keep_originals and not store.exists(originals_key(key)):
+            store.put(originals_key(key), content, "application/pdf")
+        # A re-upload while this ran wins; it gets its own pass
+        current = store.stat(key)
+        if current is None or current["etag"] != stat["etag"]:
+            report.update(after=report["before"], saved=0, kept=True, superseded=True)
+            return report
+        store.put(key, data, "application/pdf")
+        self._count(report)
+        print(f"[ARCHIVE] {key}: {report['before']} -> {report['after']} bytes")
+        return report
+
+    def archive_all(self, store: BlobStore, pool: DocumentPool, dry_run: bool = False, limit: Optional[int] = None,
+                    guess_type: Optional[Callable[[str], str]] = None,
+                    on_file: Optional[Callable[[], None]] = None) -> Dict:
+        """
+        The backfill over already stored PDFs of ARCHIVE_TYPES (type from the
+        text sidecar, or guess_type(key) for PDFs stored before sidecars).
+        Files already rewritten come back kept: nothing to gain. on_file is
+        called after each file tried.
+        """
+        start = time.perf_counter()
+        files: List[Dict] = []
+        errors: List[Dict] = []
+        for key in store.list():
+            if "/" in key or not key.lower().endswith(".pdf"):
+                continue
+            if limit is not None and len(files) + len(errors) >= limit:
+                break
+            try:
+                report_type = read_sidecar(store, sidecar_key(key)).get("report_type", "")
+            except FileNotFoundError:
+                report_type = guess_type(key) if guess_type else ""
+            if report_type not in self.types:
+                continue
+            try:
+                files.append(self.archive(store, key, pool, dry_run=dry_run))
+            except Exception as e:
+                errors.append({"key": key, "error": str(e)})
+            if on_file is not None:
+                on_file()
+        before = sum(f["before"] for f in files)
+        after = sum(f["after"] for f in files)
+        return {
+            "dryRun": dry_run,
+            "files": files,
+            "errors": errors,
+            "rewritten": sum(1 for f in files if not f["kept"]),
+            "bytesBefore": before,
+            "bytesAfter": after,
+            "bytesSaved": before - after,
+            "took_s": round(time.perf_counter() - start, 2),
+        }
+
+    def start_backfill(self, store: BlobStore, pool: DocumentPool, dry_run: bool = False, limit: Optional[int] = None,
+                       guess_type: Optional[Callable[[str], str]] = None) -> Tuple[Dict, bool]:
+        """
+        Queue archive_all on the archive thread, behind any background
+        rewrites. Returns (job, True), or (the backfill already queued or
+        running, False): one at a time.
+        """
+        with self._lock:
+            for job in self._jobs.values():
+                if job["state"] in ("queued", "running"):
+                    return dict(job), False
+            job = {
+                "id": uuid.uuid4().hex, "state": "queued", "dryRun": dry_run, "limit": limit,
+                "queuedAt": time.time(), "startedAt": None, "finishedAt": None, "processed": 0,
+                "result": None, "error": None,
+            }
+            self._jobs[job["id"]] = job
+            while len(self._jobs) > JOBS_KEPT:
+                self._jobs.popitem(last=False)
+            queued = dict(job)
+        self._submit(self._run_backfill, job, store, pool, dry_run, limit, guess_type)
+        return queued, True
+
+    def _run_backfill(self, job: Dict, store: BlobStore, pool: DocumentPool, dry_run: bool, limit: Optional[int],
+                      guess_type: Optional[Callable[[str], str]]) -> None:
+        def on_file() -> None:
+            with self._lock:
+                job["processed"] += 1
+
+        with self._lock:
+            job.update(state="running", startedAt=time.time())
+        try:
+            result = self.archive_all(store, pool, dry_run=dry_run, limit=limit, guess_type=guess_type,
+                                      on_file=on_file)
+        except Exception as e:
+            print(f"[ARCHIVE ERROR] Backfill {job['id']}: {str(e)}")
+            with self._lock:
+                job.update(state="failed", error=str(e), finishedAt=time.time())
+            return
+        with self._lock:
+            job.update(state="done", result=result, finishedAt=time.time())
+        print(f"[ARCHIVE] Backfill {job['id']}: {result['rewritten']} rewritten, {result['bytesSaved']} bytes saved")
+
+    def job(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def _count(self, report: Optional[Dict]) -> None:
+        with self._lock:
+            if report is None:
+                self._counts["errors"] += 1
+            elif report["kept"]:
+                self._counts["kept"] += 1
+            else:
+                self._counts["rewritten"] += 1
+                self._counts["bytes_before"] += report["before"]
+                self._counts["bytes_after"] += report["after"]
+                self._counts["images"] += report["images"]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            counts = dict(self._counts)
+        before, after = counts.get("bytes_before", 0), counts.get("bytes_after", 0)
+        return {
+            "mode": self.mode,
+            "types": sorted(self.types),
+            "imageDpi": ARCHIVE_IMAGE_DPI,
+            "keepOriginals": self.keep_originals,
+            "rewritten": counts.get("rewritten", 0),
+            "kept": counts.get("kept", 0),
+            "errors": counts.get("errors", 0),
+            "imagesDownsampled": counts.get("images", 0),
+            "bytesSaved": before - after,
+            "ratio": round(before / after, 2) if after else None,
+        }
+
+
+pdf_archiver = PdfArchiver()
@@ -0,0 +1,225 @@
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+import fitz  # PyMuPDF
+
+from lab_templates import page_layout
+from ocr import extract_page_texts
+from sidecars import page_spans
+
+
+# Extraction worker processes; 0 keeps PyMuPDF in the API process
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "2"))
+# Recycle a worker after this many documents...
+PDF_WORKER_MAX_DOCS = int(os.getenv("PDF_WORKER_MAX_DOCS", "500"))
+# ...or as soon as its resident memory goes above this
+PDF_WORKER_MAX_RSS_MB = int(os.getenv("PDF_WORKER_MAX_RSS_MB", "512"))
+# Empty MuPDF's resource store (cached fonts, images) every N closed documents;
+# PyMuPDF does not report the store size, so this is count based
+PDF_STORE_EMPTY_EVERY = int(os.getenv("PDF_STORE_EMPTY_EVERY", "200"))
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+_stats_lock = threading.Lock()
+_stats = {"opened": 0, "closed": 0, "store_shrinks": 0}
+
+
+def rss_bytes() -> int:
+    """Current resident set size of this process."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        # Not Linux: fall back to the peak, which is the best we have
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+
+@contextmanager
+def open_pdf(content: Optional[bytes] = None, path: Optional[str] = None):
+    """
+    The one way to open a PDF: the document (and its native resources) is
+    always released, even when extraction or parsing fails.
+    """
+    pdf = fitz.open(stream=content, filetype="pdf") if content is not None else fitz.open(path)
+    with _stats_lock:
+        _stats["opened"] += 1
+    try:
+        yield pdf
+    finally:
+        pdf.close()
+        with _stats_lock:
+            _stats["closed"] += 1
+            shrink = PDF_STORE_EMPTY_EVERY > 0 and _stats["closed"] % PDF_STORE_EMPTY_EVERY == 0
+            if shrink:
+                _stats["store_shrinks"] += 1
+        if shrink:
+            fitz.TOOLS.store_shrink(100)
+
+
+def document_stats() -> Dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["open"] = stats["opened"] - stats["closed"]
+    stats["rss_mb"] = round(rss_bytes() / (1024 * 1024), 1)
+    return stats
+
+
+def extract_pages(content: bytes, with_spans: bool = False,
+                  with_layout: bool = False) -> Tuple[List[str], Optional[List], Optional[Dict]]:
+    """Page texts (OCR for pages without a text layer), optional spans and optional page 1 layout, in this process."""
+    with open_pdf(content) as pdf:
+        pages = extract_page_texts(pdf, content)
+        spans = [page_spans(page) for page in pdf] if with_spans else None
+        layout = page_layout(pdf) if with_layout and pdf.page_count else None
+        return pages, spans, layout
+
+
+def _run_in_worker(fn: Callable, *args):
+    return fn(*args), os.getpid(), rss_bytes()
+
+
+def _noop() -> int:
+    return os.getpid()
+
+
+def _warm_in_worker(content: bytes) -> int:
+    extract_pages(content, with_layout=True)
+    # Stay busy a moment so the other warm-up tasks go to the other workers
+    time.sleep(0.05)
+    return os.getpid()
+
+
+class DocumentPool:
+    """
+    Runs PyMuPDF in separate worker processes so native memory held by
+    documents and their images never accumulates in the long-lived API
+    process. A worker is replaced after PDF_WORKER_MAX_DOCS documents, and
+    the whole pool is recycled when a worker reports an RSS above the ceiling.
+    """
+
+    def __init__(self, workers: int, max_docs: int, max_rss_mb: int):
+        self.workers = workers
+        self.max_docs = max_docs
+        self.max_rss = max_rss_mb * 1024 * 1024
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._generation = 0
+        self.documents = 0
+        self.recycles: List[str] = []
+        self.worker_rss: "OrderedDict[int, int]" = OrderedDict()
+
+    @classmethod
+    def from_env(cls) -> "DocumentPool":
+        return cls(PDF_WORKERS, PDF_WORKER_MAX_DOCS, PDF_WORKER_MAX_RSS_MB)
+
+    @property
+    def enabled(self) -> bool:
+        # Pool workers (batch_ingest.py) are daemonic and cannot have children
+        return self.workers > 0 and not multiprocessing.current_process().daemon
+
+    def _current(self) -> Tuple[ProcessPoolExecutor, int]:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    max_tasks_per_child=self.max_docs,
+                )
+            return self._executor, self._generation
+
+    def _recycle(self, generation: int, reason: str) -> None:
+        with self._lock:
+            if generation != self._generation or self._executor is None:
+                return  # another request already recycled this generation
+            old = self._executor
+            self._executor = None
+            self._generation += 1
+            self.recycles.append(reason)
+            del self.recycles[:-20]
+        print(f"[PDF POOL] Recycling workers: {reason}")
+        # Work already submitted still completes; the old workers then exit
+        old.shutdown(wait=False)
+
+    def start(self) -> None:
+        """Spawn the workers ahead of the first upload."""
+        if self.enabled:
+            executor, _ = self._current()
+            for _ in range(self.workers):
+                executor.submit(_noop)
+
+    def warm(self, content: bytes) -> int:
+        """
+        Open (and lay out) a sample document in every worker, so none of them
+        pays PyMuPDF's first-document cost on an upload. Returns the workers warmed.
+        """
+        if not self.enabled:
+            extract_pages(content, with_layout=True)
+            return 0
+        executor, _ = self._current()
+        warmed = set()
+        # The executor hands tasks to whichever worker is free; a few rounds reach them all
+        for _ in range(3):
+            futures = [executor.submit(_warm_in_worker, content) for _ in range(self.workers)]
+            warmed.update(future.result() for future in futures)
+            if len(warmed) >= self.workers:
+                break
+        return len(warmed)
+
+    def extract(self, content: bytes, with_spans: bool = False,
+                with_layout: bool = False) -> Tuple[List[str], Optional[List], Optional[Dict]]:
+        return self.run(extract_pages, content, with_spans, with_layout)
+
+    def run(self, fn: Callable, *args):
+        """fn(*args) in a worker; fn is a module-level function that opens the PDF, its exceptions are re-raised here."""
+        if not self.enabled:
+            return fn(*args)
+
+        executor, generation = self._current()
+        try:
+            result, pid, rss = executor.submit(_run_in_worker, fn, *args).result()
+        except BrokenProcessPool:
+            # A worker died (e.g. killed by the OOM killer); start fresh next time
+            self._recycle(generation, "worker died")
+            raise
+
+        with self._lock:
+            self.documents += 1
+            self.worker_rss[pid] = rss
+            self.worker_rss.move_to_end(pid)
+            while len(self.worker_rss) > self.workers * 4:
+                self.worker_rss.popitem(last=False)
+
+        if rss > self.max_rss:
+            self._recycle(generation, f"worker {pid} at {rss // (1024 * 1024)} MB")
+        return result
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "workers": self.workers if self.enabled else 0,
+                "max_docs_per_worker": self.max_docs,
+                "max_rss_mb": self.max_rss // (1024 * 1024),
+                "documents": self.documents,
+                "generation": self._generation,
+                "recent_recycles": list(self.recycles),
+                "worker_rss_mb": {pid: round(rss / (1024 * 1024), 1) for pid, rss in self.worker_rss.items()},
+                "api_process": document_stats(),
+            }
+
+
+document_pool = DocumentPool.from_env()
@@ -0,0 +1,181 @@
+import json
+import os
+import re
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from blob_store import BlobStore
+from lab_templates import page_layout
+from ocr import OCR_MIN_TEXT_CHARS
+from pdf_documents import open_pdf
+
+
+# Uploads with more pages than this are rejected (a lab report or exam form is a few pages)
+PREFLIGHT_MAX_PAGES = int(os.getenv("PREFLIGHT_MAX_PAGES", "20"))
+PREFLIGHT_MAX_BYTES = int(os.getenv("PREFLIGHT_MAX_BYTES", str(50 * 1024 * 1024)))
+# Encrypted, corrupt and blank files are kept here for a look instead of being dropped
+QUARANTINE_PREFIX = os.getenv("QUARANTINE_PREFIX", "quarantine")
+
+# The header may follow a little junk; the end marker may be followed by some
+HEADER_WINDOW = 1024
+TRAILER_WINDOW = 4096
+
+# How later stages should treat the document
+ROUTE_FAST = "fast"  # one page with a text layer: the probe already has all the text
+ROUTE_FULL = "full"  # regular extraction
+ROUTE_OCR = "ocr"  # page 1 is a scan; extraction will OCR
+
+
+class PreflightError(Exception):
+    """A file the pipeline should not open; status is the HTTP status to answer with."""
+
+    def __init__(self, status: int, detail: str, facts: Dict, quarantine: bool = False):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+        self.facts = facts
+        self.quarantine = quarantine
+
+    def __reduce__(self):
+        # Raised in the document pool workers and re-raised in the API process
+        return PreflightError, (self.status, self.detail, self.facts, self.quarantine)
+
+
+def _fail(facts: Dict, start: float, status: int, detail: str, quarantine: bool = False) -> PreflightError:
+    facts["route"] = "reject"
+    facts["reason"] = detail
+    facts["took_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return PreflightError(status, detail, facts, quarantine)
+
+
+def check_bytes(content: bytes, filename: str = "") -> Dict:
+    """
+    The checks that don't open the document: size, header and trailer
+    bytes. Microseconds, so uploads run them before waiting for a slot.
+    Returns the facts so far; raises PreflightError.
+    """
+    start = time.perf_counter()
+    facts = {
+        "fileName": os.path.basename(filename or ""),
+        "size": len(content),
+        "version": "",
+        "has_eof": False,
+        "encrypted": False,
+        "repaired": False,
+        "page_count": 0,
+        "producer": "",
+        "creator": "",
+        "first_page_chars": 0,
+        "first_page_images": 0,
+        "route": "",
+    }
+
+    def fail(status: int, detail: str, quarantine: bool = False):
+        return _fail(facts, start, status, detail, quarantine)
+
+    if not content:
+        raise fail(400, "The file is empty")
+    if len(content) > PREFLIGHT_MAX_BYTES:
+        raise fail(413, f"The file is larger than {PREFLIGHT_MAX_BYTES} bytes")
+    header = re.search(rb"%PDF-(\d\.\d)", content[:HEADER_WINDOW])
+    if header is None:
+        raise fail(415, "Not a PDF file")
+    facts["version"] = header.group(1).decode()
+    tail = content[-TRAILER_WINDOW:]
+    facts["has_eof"] = b"%%EOF" in tail
+    if not facts["has_eof"] or b"startxref" not in tail:
+        raise fail(422, "The PDF is truncated (no trailer)", quarantine=True)
+    facts["took_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return facts
+
+
+def preflight(content: bytes, filename: str = "", with_layout: bool = False) -> Dict:
+    """
+    Cheap checks before the full extraction: check_bytes, then MuPDF's
+    xref-only open for encryption, page count and producer, and a text-layer
+    probe of page 1. Returns the facts (with route); raises PreflightError
+    for files that should be rejected or quarantined. with_layout also keeps
+    page 1's words for the lab template extractors.
+    """
+    start = time.perf_counter()
+    facts = check_bytes(content, filename)
+
+    def fail(status: int, detail: str, quarantine: bool = False):
+        return _fail(facts, start, status, detail, quarantine)
+
+    pages: Optional[List[str]] = None
+    layout: Optional[Dict] = None
+    try:
+        with open_pdf(content) as pdf:
+            facts["encrypted"] = bool(pdf.is_encrypted)
+            facts["repaired"] = bool(pdf.is_repaired)
+            if pdf.needs_pass:
+                raise fail(422, "The PDF is password protected", quarantine=True)
+            facts["page_count"] = pdf.page_count
+            metadata = pdf.metadata or {}
+            facts["producer"] = metadata.get("producer") or ""
+            facts["creator"] = metadata.get("creator") or ""
+            if pdf.page_count == 0:
+                raise fail(422, "The PDF has no pages", quarantine=True)
+            if pdf.page_count > PREFLIGHT_MAX_PAGES:
+                raise fail(413, f"The PDF has {pdf.page_count} pages; at most {PREFLIGHT_MAX_PAGES} are accepted")
+
+            page = pdf[0]
+            text = page.get_text()
+            facts["first_page_chars"] = len(text.strip())
+            facts["first_page_images"] = len(page.get_images(full=False))
+            if with_layout and pdf.page_count == 1 and len(text.strip()) >= OCR_MIN_TEXT_CHARS:
+                layout = page_layout(pdf)
+    except PreflightError:
+        raise
+    except Exception as e:
+        raise fail(422, f"The PDF cannot be opened: {str(e)}", quarantine=True)
+
+    if facts["first_page_chars"] >= OCR_MIN_TEXT_CHARS:
+        # Same text extract_page_texts would get, so a one-page file needs no second open
+        if facts["page_count"] == 1:
+            facts["route"] = ROUTE_FAST
+            pages = [text]
+        else:
+            facts["route"] = ROUTE_FULL
+    elif facts["first_page_images"]:
+        facts["route"] = ROUTE_OCR
+    elif facts["page_count"] == 1:
+        raise fail(422, "The PDF has no text layer and no images", quarantine=True)
+    else:
+        facts["route"] = ROUTE_FULL
+
+    facts["took_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    # Not facts to report; process_upload takes the text (and layout) from here on the fast route
+    facts["pages"] = pages
+    facts["layout"] = layout
+    return facts
+
+
+def public_facts(facts: Dict) -> Dict:
+    return {key: value for key, value in facts.items() if key not in ("pages", "layout")}
+
+
+def quarantine(store: BlobStore, content: bytes, error: PreflightError) -> str:
+    """Keep a rejected file and its preflight facts under QUARANTINE_PREFIX; returns the PDF's key."""
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+    name = re.sub(r"[^\w.-]+", "_", error.facts.get("fileName") or "upload.pdf")
+    key = f"{QUARANTINE_PREFIX}/{stamp}-{name}"
+    store.put(key, content, "application/octet-stream")
+    report = dict(public_facts(error.facts), quarantinedAt=stamp, key=key)
+    store.put(key + ".preflight.json", json.dumps(report).encode(), "application/json")
+    print(f"[PREFLIGHT] Quarantined {name}: {error.detail}")
+    return key
+
+
+def list_quarantine(store: BlobStore, limit: int = 100) -> List[Dict]:
+    """The preflight reports of quarantined files, newest first."""
+    keys = sorted((key for key in store.list(QUARANTINE_PREFIX + "/") if key.endswith(".preflight.json")),
+                  reverse=True)[:limit]
+    reports = []
+    for key in keys:
+        data = store.get(key)
+        if data:
+            reports.append(json.loads(data))
+    return reports
@@ -0,0 +1,198 @@
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+# Fraction of requests profiled automatically (0 = only on request)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+# Admins profile a single request with "X-Profile: <token>"; unset disables the header
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "1"))
+
+SPEEDSCOPE_SUFFIX = ".speedscope.json"
+FOLDED_SUFFIX = ".folded"
+
+_local = threading.local()
+
+
+def is_profiler(headers) -> bool:
+    token = headers.get("X-Profile") or ""
+    return bool(PROFILE_TOKEN) and hmac.compare_digest(token, PROFILE_TOKEN)
+
+
+def should_profile(headers) -> bool:
+    """One header lookup and, with sampling on, one random number; nothing else when off."""
+    if PROFILE_TOKEN and "X-Profile" in headers:
+        return is_profiler(headers)
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def is_profiling() -> bool:
+    """True inside a profiled call (e.g. to keep work in this thread where the sampler sees it)."""
+    return getattr(_local, "active", False)
+
+
+Frame = Tuple[str, str, int]
+
+
+class _Sampler(threading.Thread):
+    """Samples one thread's Python stack at a fixed interval."""
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(name="profiler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()  # stack (root first) -> seconds
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        last = time.perf_counter()
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            if frame is None:
+                continue
+            stack: List[Frame] = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            # Weight by the real time since the last sample: the parser holds the
+            # GIL, so the sampler often wakes up later than asked
+            self.stacks[tuple(reversed(stack))] += now - last
+            self.samples += 1
+            last = now
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def _trim(stack: Tuple[Frame, ...]) -> Tuple[Frame, ...]:
+    """Drop the thread pool and profiler frames above the profiled function."""
+    for i, (name, filename, _) in enumerate(stack):
+        if name == "profile_call" and filename == __file__:
+            return stack[i + 1:]
+    return stack
+
+
+def write_profile(profile_id: str, name: str, stacks: Counter, duration: float) -> str:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    frames: List[Dict] = []
+    index: Dict[Frame, int] = {}
+    samples, weights = [], []
+    folded = []
+    for stack, seconds in stacks.items():
+        stack = _trim(stack)
+        if not stack:
+            continue
+        ids = []
+        for frame in stack:
+            if frame not in index:
+                index[frame] = len(frames)
+                frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+            ids.append(index[frame])
+        samples.append(ids)
+        weights.append(round(seconds * 1000, 3))
+        folded.append(";".join(f"{frame[0]} ({os.path.basename(frame[1])}:{frame[2]})" for frame in stack)
+                      + f" {max(1, round(seconds * 1_000_000))}")
+
+    speedscope = {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": name,
+        "exporter": "apecentral profiling.py",
+        "shared": {"frames": frames},
+        "profiles": [{
+            "type": "sampled",
+            "name": name,
+            "unit": "milliseconds",
+            "startValue": 0,
+            "endValue": round(duration * 1000, 3),
+            "samples": samples,
+            "weights": weights,
+        }],
+    }
+    path = os.path.join(PROFILE_DIR, profile_id + SPEEDSCOPE_SUFFIX)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(speedscope, f)
+    # Collapsed stacks (microseconds) for flamegraph.pl / inferno
+    with open(os.path.join(PROFILE_DIR, profile_id + FOLDED_SUFFIX), "w", encoding="utf-8") as f:
+        f.write("\n".join(folded) + "\n")
+    return path
+
+
+def new_profile_id() -> str:
+    return f"{datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}"
+
+
+def profile_call(profile_id: str, name: str, fn: Callable, *args):
+    """
+    Run fn(*args) in this thread under the sampling profiler and save the
+    profile as profile_id, also when fn raises.
+    """
+    sampler = _Sampler(threading.get_ident(), PROFILE_INTERVAL_MS / 1000)
+    _local.active = True
+    start = time.perf_counter()
+    sampler.start()
+    try:
+        return fn(*args)
+    finally:
+        duration = time.perf_counter() - start
+        sampler.stop()
+        _local.active = False
+        try:
+            write_profile(profile_id, f"{name} ({duration * 1000:.0f} ms)", sampler.stacks, duration)
+            print(f"[PROFILE] {profile_id}: {name} in {duration * 1000:.0f} ms, {sampler.samples} samples")
+        except Exception as e:
+            print(f"[PROFILE ERROR] {profile_id}: {str(e)}")
+
+
+class ProfileIdMiddleware:
+    """
+    Adds X-Profile-Id to responses of profiled requests (set on request.state
+    by the route). Plain ASGI, so unprofiled requests only pay a dict lookup.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                profile_id = scope.get("state", {}).get("profile_id")
+                if profile_id:
+                    message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profile_id.encode())]
+            await send(message)
+
+        await self.app(scope, receive, send_with_profile_id)
+
+
+def list_profiles(limit: int = 50) -> List[Dict]:
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    names = sorted((n for n in os.listdir(PROFILE_DIR) if n.endswith(SPEEDSCOPE_SUFFIX)), reverse=True)[:limit]
+    profiles = []
+    for name in names:
+        path = os.path.join(PROFILE_DIR, name)
+        profiles.append({"id": name[:-len(SPEEDSCOPE_SUFFIX)], "bytes": os.path.getsize(path),
+                         "created": datetime.fromtimestamp(os.path.getmtime(path)).isoformat()})
+    return profiles
+
+
+def profile_path(profile_id: str, folded: bool = False) -> Optional[str]:
+    name = os.path.basename(profile_id) + (FOLDED_SUFFIX if folded else SPEEDSCOPE_SUFFIX)
+    path = os.path.join(PROFILE_DIR, name)
+    return path if os.path.exists(path) else None
@@ -0,0 +1,326 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import quote
+
+
+# Report type -> Firestore collection used by the admin pages
+COLLECTIONS = {
+    "xray": "xrayRecords",
+    "cbc": "cbcRecords",
+    "urinalysis": "urinalysisRecords",
+    "lipid": "lipidProfileRecords",
+    "ecg": "ecgRecords",
+    "medical": "medExamRecords",
+    "chem": "chemRecords",
+}
+
+# Wording used in the activity log, as in the admin pages
+REPORT_LABELS = {
+    "xray": "X-Ray",
+    "cbc": "CBC",
+    "urinalysis": "Urinalysis",
+    "lipid": "Lipid",
+    "ecg": "ECG",
+    "medical": "Medical Exam",
+    "chem": "Chemistry",
+}
+
+ACTIVITIES_COLLECTION = "activities"
+
+# Firestore limits: 500 writes per batch, 30 values per "in" filter
+FIRESTORE_BATCH_SIZE = 500
+FIRESTORE_IN_LIMIT = 30
+
+
+def _chunks(items: List, size: int) -> Iterable[List]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def record_document_id(unique_id: str) -> str:
+    """Firestore document id of a record saved by the backend: its uniqueId, escaped ("/" is not allowed)."""
+    document_id = quote(unique_id, safe="")
+    if document_id in ("", ".", "..") or (document_id.startswith("__") and document_id.endswith("__")):
+        # Reserved ids
+        document_id = "uid-" + hashlib.sha1(unique_id.encode()).hexdigest()
+    return document_id
+
+
+class RecordStore(ABC):
+    """Where parsed records and activity entries are persisted."""
+
+    @abstractmethod
+    def existing_ids(self, collection: str, unique_ids: List[str]) -> Set[str]:
+        """The subset of unique_ids already stored in the collection (one bulk lookup)."""
+
+    @abstractmethod
+    def write_records(self, collection: str, records: List[Dict]) -> Dict[str, str]:
+        """
+        Insert the records whose uniqueId is not stored yet, in batched commits;
+        the check is part of the write, so concurrent uploads cannot both insert
+        one. Returns uniqueId -> document id of the records actually inserted.
+        """
+
+    @abstractmethod
+    def update_record(self, collection: str, unique_id: str, fields: Dict) -> Optional[Tuple[str, Dict]]:
+        """Merge fields into the record; returns (document id, updated record), None when missing."""
+
+    @abstractmethod
+    def delete_record(self, collection: str, document_id: str) -> Optional[str]:
+        """Delete the record with this document id; returns its uniqueId, None when missing."""
+
+    @abstractmethod
+    def add_activity(self, activity: Dict) -> str:
+        """Insert one activity log entry."""
+
+
+class LocalRecordStore(RecordStore):
+    """
+    SQLite-backed store for backend development and tests. The admin pages
+    read Firestore, so records saved here never reach them.
+    """
+
+    def __init__(self, path: str = "records.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                """CREATE TABLE IF NOT EXISTS records (
+                       id TEXT PRIMARY KEY,
+                       collection TEXT NOT NULL,
+                       unique_id TEXT NOT NULL,
+                       data TEXT NOT NULL,
+                       created_at TEXT NOT NULL,
+                       UNIQUE (collection, unique_id)
+                   )"""
+            )
+            self._connection.execute(
+                """CREATE TABLE IF NOT EXISTS activities (
+                       id TEXT PRIMARY KEY,
+                       data TEXT NOT NULL,
+                       created_at TEXT NOT NULL
+                   )"""
+            )
+
+    def existing_ids(self, collection: str, unique_ids: List[str]) -> Set[str]:
+        found = set()
+        with self._lock:
+            for chunk in _chunks(list(unique_ids), 500):
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._connection.execute(
+                    f"SELECT unique_id FROM records WHERE collection = ? AND unique_id IN ({placeholders})",
+                    [collection, *chunk],
+                )
+                found.update(row[0] for row in rows)
+        return found
+
+    def write_records(self, collection: str, records: List[Dict]) -> Dict[str, str]:
+        now = datetime.now(timezone.utc).isoformat()
+        inserted = {}
+        with self._lock, self._connection:
+            for record in records:
+                document_id = uuid.uuid4().hex
+                cursor = self._connection.execute(
+                    "INSERT OR IGNORE INTO records (id, collection, unique_id, data, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (document_id, collection, record["uniqueId"], json.dumps(record, ensure_ascii=False, default=str), now),
+                )
+                # 0 rows: the (collection, unique_id) constraint ignored it
+                if cursor.rowcount == 1:
+                    inserted[record["uniqueId"]] = document_id
+        return inserted
+
+    def update_record(self, collection: str, unique_id: str, fields: Dict) -> Optional[Tuple[str, Dict]]:
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT id, data FROM records WHERE collection = ? AND unique_id = ?", (collection, unique_id)
+            ).fetchone()
+            if row is None:
+                return None
+            record = {**json.loads(row[1]), **fields, "uniqueId": unique_id}
+            self._connection.execute(
+                "UPDATE records SET data = ? WHERE id = ?",
+                (json.dumps(record, ensure_ascii=False, default=str), row[0]),
+            )
+        return row[0], record
+
+    def delete_record(self, collection: str, document_id: str) -> Optional[str]:
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT unique_id FROM records WHERE collection = ? AND id = ?", (collection, document_id)
+            ).fetchone()
+            if row is None:
+                return None
+            self._connection.execute("DELETE FROM records WHERE id = ?", (document_id,))
+        return row[0]
+
+    def add_activity(self, activity: Dict) -> str:
+        activity_id = uuid.uuid4().hex
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT INTO activities (id, data, created_at) VALUES (?, ?, ?)",
+                (activity_id, json.dumps(activity, ensure_ascii=False, default=str), datetime.now(timezone.utc).isoformat()),
+            )
+        return activity_id
+
+
+class FirestoreRecordStore(RecordStore):
+    """
+    Firestore-backed store, the collections the admin pages read. Honors
+    FIRESTORE_EMULATOR_HOST, so tests can run against the emulator. The
+    client is created on first use: without the package or credentials the
+    API still starts, and saving a record fails with a RuntimeError (503).
+    """
+
+    def __init__(self, project: Optional[str] = None):
+        self.project = project
+        self._lock = threading.Lock()
+        self._db = None
+        self._field_filter = None
+        self._already_exists = None
+
+    @property
+    def _client(self):
+        with self._lock:
+            if self._db is None:
+                try:
+                    from google.cloud import firestore
+                    from google.cloud.firestore_v1.base_query import FieldFilter
+                    from google.api_core.exceptions import AlreadyExists
+                except ImportError:
+                    raise RuntimeError("RECORD_STORE=firestore needs google-cloud-firestore (pip install google-cloud-firestore)")
+                try:
+                    self._db = firestore.Client(project=self.project)
+                except Exception as e:
+                    raise RuntimeError(f"Cannot connect to Firestore: {str(e)}")
+                self._field_filter = FieldFilter
+                self._already_exists = AlreadyExists
+            return self._db
+
+    def existing_ids(self, collection: str, unique_ids: List[str]) -> Set[str]:
+        found = set()
+        reference = self._client.collection(collection)
+        for chunk in _chunks(list(unique_ids), FIRESTORE_IN_LIMIT):
+            query = reference.where(filter=self._field_filter("uniqueId", "in", chunk)).select(["uniqueId"])
+            found.update(snapshot.get("uniqueId") for snapshot in query.stream())
+        return found
+
+    def write_records(self, collection: str, records: List[Dict]) -> Dict[str, str]:
+        # Keyed by uniqueId and written with create(), which fails when the document exists.
+        # Records added by the pages before this (random ids) are caught by existing_ids
+        reference = self._client.collection(collection)
+        inserted = {}
+        for chunk in _chunks(records, FIRESTORE_BATCH_SIZE):
+            documents = [(record, reference.document(record_document_id(record["uniqueId"]))) for record in chunk]
+            batch = self._client.batch()
+            for record, document in documents:
+                batch.create(document, record)
+            try:
+                batch.commit()
+            except self._already_exists:
+                # Another upload saved one of them first; the batch is all or nothing, so go one by one
+                for record, document in documents:
+                    try:
+                        document.create(record)
+                    except self._already_exists:
+                        continue
+                    inserted[record["uniqueId"]] = document.id
+                continue
+            inserted.update((record["uniqueId"], document.id) for record, document in documents)
+        return inserted
+
+    def _find(self, collection: str, unique_id: str):
+        query = self._client.collection(collection).where(filter=self._field_filter("uniqueId", "==", unique_id)).limit(1)
+        return next(iter(query.stream()), None)
+
+    def update_record(self, collection: str, unique_id: str, fields: Dict) -> Optional[Tuple[str, Dict]]:
+        snapshot = self._find(collection, unique_id)
+        if snapshot is None:
+            return None
+        fields = {key: value for key, value in fields.items() if key != "uniqueId"}
+        snapshot.reference.update(fields)
+        return snapshot.id, {**snapshot.to_dict(), **fields}
+
+    def delete_record(self, collection: str, document_id: str) -> Optional[str]:
+        snapshot = self._client.collection(collection).document(document_id).get()
+        if not snapshot.exists:
+            return None
+        snapshot.reference.delete()
+        return (snapshot.to_dict() or {}).get("uniqueId", "")
+
+    def add_activity(self, activity: Dict) -> str:
+        _, document = self._client.collection(ACTIVITIES_COLLECTION).add(activity)
+        return document.id
+
+
+def get_record_store() -> RecordStore:
+    # Firestore by default: the admin pages list records from it and save through the backend
+    backend = os.getenv("RECORD_STORE", "firestore")
+    if backend == "firestore":
+        return FirestoreRecordStore(project=os.getenv("FIRESTORE_PROJECT") or None)
+    if backend == "local":
+        print("[RECORDS] RECORD_STORE=local: records go to SQLite and are not visible to the admin pages")
+        return LocalRecordStore(os.getenv("RECORD_STORE_PATH", "records.db"))
+    raise ValueError(f"Unknown RECORD_STORE: {backend}. Expected 'local' or 'firestore'")
+
+
+def patient_label(record: Dict) -> str:
+    return record.get("patientName") or record.get("patient_name") or record.get("name") or record.get("uniqueId", "")
+
+
+def persist_batch(store: RecordStore, report_type: str, records: List[Dict],
+                  firstname: str = "", total_files: Optional[int] = None) -> Dict:
+    """
+    Deduplicate a batch of parsed records by uniqueId (within the batch and
+    against the store, in one bulk lookup), write the new ones in batched
+    conditional commits and log a single activity entry for the whole batch.
+    """
+    collection = COLLECTIONS[report_type]
+
+    unique = {}
+    duplicates = []
+    for record in records:
+        unique_id = record.get("uniqueId", "")
+        if unique_id in unique:
+            duplicates.append(unique_id)
+        else:
+            unique[unique_id] = record
+
+    existing = store.existing_ids(collection, list(unique)) if unique else set()
+    duplicates.extend(unique_id for unique_id in unique if unique_id in existing)
+    new_records = [record for unique_id, record in unique.items() if unique_id not in existing]
+
+    inserted = store.write_records(collection, new_records) if new_records else {}
+    # Saved by a concurrent upload between the lookup and the write
+    duplicates.extend(record.get("uniqueId", "") for record in new_records if record.get("uniqueId", "") not in inserted)
+    new_records = [record for record in new_records if record.get("uniqueId", "") in inserted]
+
+    activity_id = ""
+    if new_records:
+        label = REPORT_LABELS[report_type]
+        total_files = total_files if total_files is not None else len(records)
+        if len(new_records) == 1:
+            report = f"Added {label} record for {patient_label(new_records[0])} ({new_records[0].get('uniqueId', '')})"
+        else:
+            report = f"Bulk uploaded {len(new_records)} {label} records from {total_files} files"
+        activity_id = store.add_activity({
+            "firstname": firstname,
+            "reportDate": datetime.now(timezone.utc),
+            "report": report,
+            "recordIds": [record.get("uniqueId", "") for record in new_records],
+        })
+
+    return {
+        "collection": collection,
+        "saved": [record.get("uniqueId", "") for record in new_records],
+        "documentIds": [inserted[record.get("uniqueId", "")] for record in new_records],
+        "duplicates": duplicates,
+        "activityId": activity_id,
+    }
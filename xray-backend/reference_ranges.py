@@ -0,0 +1,234 @@
+import re
+from functools import lru_cache
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+
+# Flag codes used by the vectorized evaluation
+FLAG_LOW = -1
+FLAG_NORMAL = 0
+FLAG_HIGH = 1
+FLAG_LETTERS = {FLAG_LOW: "L", FLAG_NORMAL: "", FLAG_HIGH: "H"}
+
+# "4.0 - 36.0", "< 200", ">= 40 mg/dL", "0.0 - 2.0"
+RANGE_PATTERN = re.compile(
+    r"^\s*(<=|>=|≤|≥|<|>)?\s*(-?\d+(?:\.\d+)?)\s*(?:-\s*(-?\d+(?:\.\d+)?))?"
+)
+# Leading number of a result string: "13.60", "0.2 RARE", "56Y"
+RESULT_PATTERN = re.compile(r"^\s*([<>]=?)?\s*(-?\d+(?:\.\d+)?)")
+
+
+@lru_cache(maxsize=4096)
+def parse_reference_range(reference_range: str) -> Tuple[float, float, bool, bool]:
+    """
+    Parse a reference range string into (low, high, low_inclusive, high_inclusive).
+    Unbounded sides are +/-inf, unparseable ranges are (nan, nan).
+    """
+    match = RANGE_PATTERN.match(reference_range or "")
+    if not match:
+        return np.nan, np.nan, True, True
+
+    operator, first, second = match.groups()
+    value = float(first)
+
+    if second is not None and not operator:
+        low, high = value, float(second)
+        if low > high:
+            low, high = high, low
+        return low, high, True, True
+
+    if operator in ("<", "<="):
+        return -np.inf, value, True, operator == "<="
+    if operator in ("≤",):
+        return -np.inf, value, True, True
+    if operator in (">", ">="):
+        return value, np.inf, operator == ">=", True
+    if operator in ("≥",):
+        return value, np.inf, True, True
+
+    # A single bare number is not a usable interval
+    return np.nan, np.nan, True, True
+
+
+@lru_cache(maxsize=4096)
+def parse_result_value(result: str) -> float:
+    match = RESULT_PATTERN.match(result or "")
+    return float(match.group(2)) if match else np.nan
+
+
+def compile_ranges(reference_ranges: Sequence[str]) -> Dict[str, np.ndarray]:
+    """
+    Turn a batch of reference range strings into interval arrays.
+    Each distinct string is parsed once no matter how often it repeats.
+    """
+    strings = np.asarray(reference_ranges, dtype=object).astype(str)
+    if strings.size == 0:
+        empty = np.empty(0, dtype=np.float64)
+        return {
+            "low": empty,
+            "high": empty,
+            "low_inclusive": np.empty(0, dtype=bool),
+            "high_inclusive": np.empty(0, dtype=bool),
+        }
+
+    unique, inverse = np.unique(strings, return_inverse=True)
+    parsed = np.array([parse_reference_range(s) for s in unique], dtype=np.float64)
+
+    return {
+        "low": parsed[inverse, 0],
+        "high": parsed[inverse, 1],
+        "low_inclusive": parsed[inverse, 2].astype(bool),
+        "high_inclusive": parsed[inverse, 3].astype(bool),
+    }
+
+
+def parse_results(results: Sequence[str]) -> np.ndarray:
+    """Parse a batch of result strings into floats (nan when not numeric)."""
+    strings = np.asarray(results, dtype=object).astype(str)
+    if strings.size == 0:
+        return np.empty(0, dtype=np.float64)
+    unique, inverse = np.unique(strings, return_inverse=True)
+    parsed = np.array([parse_result_value(s) for s in unique], dtype=np.float64)
+    return parsed[inverse]
+
+
+def evaluate(values: np.ndarray, ranges: Dict[str, np.ndarray]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Vectorized flag and deviation computation.
+
+    Returns (flags, deviation, evaluated):
+      flags      int8 array of FLAG_LOW / FLAG_NORMAL / FLAG_HIGH
+      deviation  signed distance outside the interval, scaled by the interval
+                 width (or by the bound itself for one-sided ranges);
+                 negative below the range, positive above, 0 inside
+      evaluated  False where the result or the range could not be parsed
+    """
+    low = ranges["low"]
+    high = ranges["high"]
+
+    evaluated = ~np.isnan(values) & ~np.isnan(low) & ~np.isnan(high)
+
+    with np.errstate(invalid="ignore"):
+        below = np.where(ranges["low_inclusive"], values < low, values <= low) & evaluated
+        above = np.where(ranges["high_inclusive"], values > high, values >= high) & evaluated
+
+        width = high - low
+        one_sided_scale = np.where(np.isfinite(low), np.abs(low), np.abs(high))
+        scale = np.where(np.isfinite(width) & (width > 0), width, one_sided_scale)
+        scale = np.where((scale > 0) & np.isfinite(scale), scale, 1.0)
+
+        deviation = np.zeros_like(values)
+        deviation = np.where(below, (values - low) / scale, deviation)
+        deviation = np.where(above, (values - high) / scale, deviation)
+
+    flags = np.zeros(values.shape, dtype=np.int8)
+    flags[below] = FLAG_LOW
+    flags[above] = FLAG_HIGH
+
+    return flags, deviation, evaluated
+
+
+def _patient_name(record: Dict) -> str:
+    return record.get("patientName") or record.get("patient_name") or record.get("name") or ""
+
+
+def flatten_analytes(records: Sequence[Dict]) -> Dict[str, List]:
+    """
+    Collect every analyte with a result and reference range from a batch of
+    parsed records (CBC, urinalysis, lipid and chemistry formats).
+    """
+    columns = {
+        "record_index": [],
+        "analyte": [],
+        "result": [],
+        "unit": [],
+        "reference_range": [],
+        "pdf_flag": [],
+    }
+
+    def add(index, analyte, value):
+        columns["record_index"].append(index)
+        columns["analyte"].append(analyte)
+        columns["result"].append(str(value.get("result") or ""))
+        columns["unit"].append(str(value.get("unit") or ""))
+        columns["reference_range"].append(str(value.get("reference_range") or ""))
+        columns["pdf_flag"].append(str(value.get("flag") or ""))
+
+    for index, record in enumerate(records):
+        for key, value in record.items():
+            if isinstance(value, dict) and "result" in value and "reference_range" in value:
+                add(index, key, value)
+
+        # Chemistry keeps its rows in a list
+        for row in record.get("test_results") or []:
+            if isinstance(row, dict) and "result" in row:
+                add(index, row.get("test_name", ""), row)
+
+    return columns
+
+
+def screen_records(records: Sequence[Dict], abnormal_only: bool = True) -> Dict:
+    """
+    Recompute L/H flags for a whole batch of parsed records and return the
+    abnormal results per record, ordered by how far outside the range they are.
+    """
+    columns = flatten_analytes(records)
+
+    values = parse_results(columns["result"])
+    ranges = compile_ranges(columns["reference_range"])
+    flags, deviation, evaluated = evaluate(values, ranges)
+
+    record_index = np.asarray(columns["record_index"], dtype=np.int64)
+    abnormal = flags != FLAG_NORMAL
+    pdf_flags = np.asarray(columns["pdf_flag"], dtype=object)
+    computed_letters = np.where(flags == FLAG_LOW, "L", np.where(flags == FLAG_HIGH, "H", ""))
+    disagreement = evaluated & (pdf_flags != "") & (pdf_flags != "N") & (pdf_flags != computed_letters)
+
+    # Per-record aggregates without a Python loop over analytes
+    abnormal_counts = np.bincount(record_index[abnormal], minlength=len(records))
+    max_deviation = np.zeros(len(records), dtype=np.float64)
+    np.maximum.at(max_deviation, record_index, np.abs(deviation))
+
+    selected = np.flatnonzero(abnormal if abnormal_only else evaluated)
+    # Group by record, most deviant first within each record
+    order = np.lexsort((-np.abs(deviation[selected]), record_index[selected]))
+    selected = selected[order]
+
+    by_record = {}
+    for index, record in enumerate(records):
+        if abnormal_only and abnormal_counts[index] == 0:
+            continue
+        by_record[index] = {
+            "uniqueId": record.get("uniqueId", ""),
+            "patientName": _patient_name(record),
+            "abnormalCount": int(abnormal_counts[index]),
+            "maxDeviation": round(float(max_deviation[index]), 4),
+            "results": [],
+        }
+
+    for i in selected:
+        entry = by_record.get(int(record_index[i]))
+        if entry is None:
+            continue
+        entry["results"].append({
+            "analyte": columns["analyte"][i],
+            "result": columns["result"][i],
+            "unit": columns["unit"][i],
+            "reference_range": columns["reference_range"][i],
+            "flag": FLAG_LETTERS[int(flags[i])],
+            "pdf_flag": columns["pdf_flag"][i],
+            "deviation": round(float(deviation[i]), 4),
+        })
+
+    results = sorted(by_record.values(), key=lambda entry: entry["maxDeviation"], reverse=True)
+
+    return {
+        "recordCount": len(records),
+        "analyteCount": int(values.size),
+        "evaluatedCount": int(evaluated.sum()),
+        "abnormalCount": int(abnormal.sum()),
+        "missingPdfFlagCount": int((abnormal & (pdf_flags == "")).sum()),
+        "flagDisagreementCount": int(disagreement.sum()),
+        "records": results,
+    }
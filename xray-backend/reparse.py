@@ -0,0 +1,50 @@
+"""
+Re-parse every stored document from its text sidecar with the current parsers.
+
+    python reparse.py [--type lipid,medical] [--workers 4] [--write] [--details]
+
+No PDF is opened; only the *.text.json.gz files written at upload time are read,
+from the configured blob store (BLOB_STORE) or, with --dir, a local directory.
+"""
+import argparse
+import contextlib
+import io
+import json
+
+with contextlib.redirect_stdout(io.StringIO()):
+    from main import PARSER_VERSION, PARSERS, blob_store
+from blob_store import LocalBlobStore
+from sidecars import reparse_all
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", default=None, help="local directory holding the PDFs and their sidecars")
+    parser.add_argument("--type", default="", help="comma separated report types (default: all)")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--write", action="store_true", help="store the new results in the sidecars (the saved records are not changed)")
+    parser.add_argument("--details", action="store_true", help="print every changed field")
+    args = parser.parse_args()
+
+    report_types = [t.strip() for t in args.type.split(",") if t.strip()] or None
+    store = LocalBlobStore(args.dir) if args.dir else blob_store
+
+    # Parsers are chatty; keep the report readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        summary = reparse_all(store, PARSERS, PARSER_VERSION, report_types=report_types,
+                              workers=args.workers, write=args.write)
+
+    print(f"Parser version {summary['parser_version']}: {summary['documents']} documents, "
+          f"{summary['changed_documents']} changed, {summary['elapsed_ms']:.0f} ms"
+          f"{' (written)' if summary['written'] else ''}")
+    for name, count in summary["field_change_counts"].items():
+        print(f"  {name}: {count}")
+    if args.details:
+        for change in summary["changes"]:
+            print(json.dumps(change, ensure_ascii=False, default=str))
+    for error in summary["errors"]:
+        print(f"  ERROR {error['sidecar']}: {error['error']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import asyncio
+import base64
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+
+RESUMABLE_DIR = os.getenv("RESUMABLE_DIR", "upload_sessions")
+# Unfinished uploads (and finished results nobody fetched) are removed after this
+RESUMABLE_TTL_SECONDS = float(os.getenv("RESUMABLE_TTL_SECONDS", str(24 * 3600)))
+RESUMABLE_MAX_BYTES = int(os.getenv("RESUMABLE_MAX_BYTES", str(100 * 1024 * 1024)))
+
+TUS_VERSION = "1.0.0"
+
+PART_SUFFIX = ".part"
+META_SUFFIX = ".json"
+RESULT_SUFFIX = ".result.json"
+
+
+class UploadError(Exception):
+    """A request the upload session cannot accept; status is the HTTP status to answer with."""
+
+    def __init__(self, status: int, detail: str):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+
+
+def parse_metadata(header: str) -> Dict[str, str]:
+    """tus Upload-Metadata: "filename ZmlsZS5wZGY=,type Y2Jj" (values base64)."""
+    metadata = {}
+    for pair in (header or "").split(","):
+        key, _, value = pair.strip().partition(" ")
+        if not key:
+            continue
+        try:
+            metadata[key] = base64.b64decode(value).decode("utf-8") if value else ""
+        except ValueError:
+            raise UploadError(400, f"Upload-Metadata value for {key} is not base64")
+    return metadata
+
+
+class ResumableUploads:
+    """
+    Chunked uploads that survive dropped connections: a session is created
+    with the total length, chunks are appended at the current offset, and
+    the client asks for the offset to resume after an error. Sessions live
+    on disk as <id>.part plus <id>.json, so a restart loses nothing.
+    """
+
+    def __init__(self, directory: str = RESUMABLE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._session_locks: Dict[str, asyncio.Lock] = {}
+
+    def _path(self, upload_id: str, suffix: str) -> str:
+        if not upload_id.isalnum():
+            raise UploadError(404, "Unknown upload")
+        return os.path.join(self.directory, upload_id + suffix)
+
+    def session_lock(self, upload_id: str) -> asyncio.Lock:
+        """Serializes the PATCHes of one upload (a client retrying while its old request still runs)."""
+        with self._lock:
+            return self._session_locks.setdefault(upload_id, asyncio.Lock())
+
+    def create(self, length: int, filename: str, report_type: str, options: Optional[Dict] = None) -> Dict:
+        if length <= 0:
+            raise UploadError(400, "Upload-Length must be a positive number of bytes")
+        if length > RESUMABLE_MAX_BYTES:
+            raise UploadError(413, f"Upload-Length exceeds the maximum of {RESUMABLE_MAX_BYTES} bytes")
+        filename = os.path.basename(filename or "")
+        if not filename:
+            raise UploadError(400, "A filename is required")
+
+        self.expire()
+        now = time.time()
+        session = {
+            "id": uuid.uuid4().hex,
+            "filename": filename,
+            "type": report_type,
+            "length": length,
+            "options": options or {},
+            "created": now,
+            "expires": now + RESUMABLE_TTL_SECONDS,
+        }
+        open(self._path(session["id"], PART_SUFFIX), "wb").close()
+        self._write_meta(session)
+        return session
+
+    def _write_meta(self, session: Dict) -> None:
+        path = self._path(session["id"], META_SUFFIX)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(session, f)
+        os.replace(path + ".tmp", path)
+
+    def get(self, upload_id: str) -> Dict:
+        path = self._path(upload_id, META_SUFFIX)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                session = json.load(f)
+        except FileNotFoundError:
+            raise UploadError(404, "Unknown or expired upload")
+        if session["expires"] < time.time():
+            self.delete(upload_id)
+            raise UploadError(404, "Unknown or expired upload")
+        if session.get("completed"):
+            session["offset"] = session["length"]
+        else:
+            session["offset"] = os.path.getsize(self._path(upload_id, PART_SUFFIX))
+        return session
+
+    def check_offset(self, upload_id: str, offset: int) -> Dict:
+        """
+        The session, if a chunk may be appended at offset (the tus conflict
+        rule). A received but unprocessed upload accepts an empty chunk at
+        its end, which retries the processing.
+        """
+        session = self.get(upload_id)
+        if offset != session["offset"]:
+            raise UploadError(409, f"Upload-Offset {offset} does not match the current offset {session['offset']}")
+        if session.get("completed"):
+            raise UploadError(409, "The upload is already complete")
+        return session
+
+    def open_part(self, upload_id: str):
+        return open(self._path(upload_id, PART_SUFFIX), "ab")
+
+    def touch(self, session: Dict) -> None:
+        """An active upload keeps its session alive for another TTL."""
+        session = {key: value for key, value in session.items() if key != "offset"}
+        session["expires"] = time.time() + RESUMABLE_TTL_SECONDS
+        self._write_meta(session)
+
+    def read(self, upload_id: str) -> bytes:
+        with open(self._path(upload_id, PART_SUFFIX), "rb") as f:
+            return f.read()
+
+    def finish(self, upload_id: str, result: bytes) -> None:
+        """Keep the pipeline's response (for a client whose last PATCH reply got lost) and drop the data."""
+        with open(self._path(upload_id, RESULT_SUFFIX), "wb") as f:
+            f.write(result)
+        session = self.get(upload_id)
+        session.pop("offset")
+        session["completed"] = time.time()
+        session["expires"] = session["completed"] + RESUMABLE_TTL_SECONDS
+        self._write_meta(session)
+        os.remove(self._path(upload_id, PART_SUFFIX))
+
+    def result(self, upload_id: str) -> Optional[bytes]:
+        try:
+            with open(self._path(upload_id, RESULT_SUFFIX), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, upload_id: str) -> None:
+        for suffix in (PART_SUFFIX, META_SUFFIX, RESULT_SUFFIX):
+            try:
+                os.remove(self._path(upload_id, suffix))
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self._session_locks.pop(upload_id, None)
+
+    def expire(self) -> List[str]:
+        """Remove sessions past their expiry time."""
+        expired = []
+        now = time.time()
+        for name in os.listdir(self.directory):
+            if not name.endswith(META_SUFFIX) or name.endswith(RESULT_SUFFIX):
+                continue
+            upload_id = name[:-len(META_SUFFIX)]
+            try:
+                with open(os.path.join(self.directory, name), "r", encoding="utf-8") as f:
+                    expires = json.load(f)["expires"]
+            except (OSError, ValueError, KeyError):
+                continue
+            if expires < now:
+                self.delete(upload_id)
+                expired.append(upload_id)
+        if expired:
+            print(f"[UPLOADS] Expired {len(expired)} upload session(s)")
+        return expired
+
+
+resumable_uploads = ResumableUploads()
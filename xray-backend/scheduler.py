@@ -0,0 +1,138 @@
+import asyncio
+import os
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional, Tuple
+
+
+# Lanes: single-document previews go first, bulk uploads share what is left
+INTERACTIVE = "interactive"
+BULK = "bulk"
+
+
+class _Lane:
+    def __init__(self, name: str, limit: int, priority: int):
+        self.name = name
+        self.limit = limit
+        self.priority = priority
+        self.active = 0
+        self.admitted = 0
+        # client -> waiting requests, in round-robin order
+        self.queues: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+
+    def waiting(self) -> int:
+        return sum(len(queue) for queue in self.queues.values())
+
+    def pop_next(self) -> Optional[asyncio.Future]:
+        """Next waiter, one per client in turn so no client can starve the others."""
+        while self.queues:
+            client, queue = next(iter(self.queues.items()))
+            future = queue.popleft()
+            if queue:
+                self.queues.move_to_end(client)
+            else:
+                del self.queues[client]
+            if not future.done():
+                return future
+        return None
+
+
+class AdmissionScheduler:
+    """
+    Admission control in front of the parsing work.
+
+    Each lane has its own concurrency limit; an optional total limit is shared
+    between lanes, and when a shared slot frees up the higher-priority lane is
+    served first. Inside a lane, waiting requests are served round-robin per
+    client (company), so one bulk upload cannot hold up everybody else.
+    All bookkeeping happens on the event loop thread.
+    """
+
+    def __init__(self, lanes: Dict[str, Tuple[int, int]], total_limit: Optional[int] = None):
+        self.lanes = {name: _Lane(name, limit, priority) for name, (limit, priority) in lanes.items()}
+        self._by_priority = sorted(self.lanes.values(), key=lambda lane: lane.priority)
+        self.total_limit = total_limit
+        self.active = 0
+
+    @classmethod
+    def from_env(cls) -> "AdmissionScheduler":
+        interactive = int(os.getenv("SCHED_INTERACTIVE_LIMIT", "4"))
+        bulk = int(os.getenv("SCHED_BULK_LIMIT", "2"))
+        total = os.getenv("SCHED_TOTAL_LIMIT")
+        return cls(
+            {INTERACTIVE: (interactive, 0), BULK: (bulk, 1)},
+            total_limit=int(total) if total else None,
+        )
+
+    def _can_admit(self, lane: _Lane) -> bool:
+        if lane.active >= lane.limit:
+            return False
+        return self.total_limit is None or self.active < self.total_limit
+
+    def _higher_priority_waiting(self, lane: _Lane) -> bool:
+        """
+        A higher-priority lane that _dispatch would serve first. Lanes only
+        compete for slots under total_limit; without one each lane has its own.
+        """
+        if self.total_limit is None:
+            return False
+        return any(other.queues and other.active < other.limit
+                   for other in self._by_priority if other.priority < lane.priority)
+
+    def _admit(self, lane: _Lane) -> None:
+        lane.active += 1
+        lane.admitted += 1
+        self.active += 1
+
+    def _release(self, lane: _Lane) -> None:
+        lane.active -= 1
+        self.active -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        for lane in self._by_priority:
+            while lane.queues and self._can_admit(lane):
+                future = lane.pop_next()
+                if future is None:
+                    break
+                self._admit(lane)
+                future.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, lane_name: str, client: str):
+        lane = self.lanes[lane_name]
+
+        if not lane.queues and self._can_admit(lane) and not self._higher_priority_waiting(lane):
+            self._admit(lane)
+        else:
+            future = asyncio.get_running_loop().create_future()
+            lane.queues.setdefault(client, deque()).append(future)
+            try:
+                await future
+            except asyncio.CancelledError:
+                # Admitted just as the request went away: give the slot back
+                if future.done() and not future.cancelled():
+                    self._release(lane)
+                raise
+
+        try:
+            yield
+        finally:
+            self._release(lane)
+
+    def stats(self) -> Dict:
+        return {
+            "active": self.active,
+            "total_limit": self.total_limit,
+            "lanes": {
+                lane.name: {
+                    "limit": lane.limit,
+                    "priority": lane.priority,
+                    "active": lane.active,
+                    "waiting": lane.waiting(),
+                    "admitted": lane.admitted,
+                    "waiting_by_client": {client: len(queue) for client, queue in lane.queues.items()},
+                }
+                for lane in self._by_priority
+            },
+        }
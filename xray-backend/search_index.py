@@ -0,0 +1,268 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+from blob_store import BlobStore
+from record_store import COLLECTIONS, RecordStore
+from sidecars import list_sidecars, read_sidecar
+
+
+SEARCH_INDEX_PATH = os.getenv("SEARCH_INDEX_PATH", "search.db")
+# Share of a query word's trigrams a fuzzy hit must contain (0.5 ~ one typo in a 6-letter name)
+SEARCH_FUZZY_THRESHOLD = float(os.getenv("SEARCH_FUZZY_THRESHOLD", "0.5"))
+# Fuzzy candidates scored in Python per query
+SEARCH_FUZZY_CANDIDATES = int(os.getenv("SEARCH_FUZZY_CANDIDATES", "200"))
+
+# Patient name fields across the parsers
+NAME_FIELDS = ("patientName", "patient_name", "name")
+# Free-text fields worth searching, per report type
+NARRATIVE_FIELDS = {
+    "xray": ("interpretation", "impression"),
+    "ecg": ("interpretation",),
+    "medical": ("remarks", "needs_treatment", "present_illness"),
+}
+# bm25 weights of the name and narrative columns
+NAME_WEIGHT = 5.0
+NARRATIVE_WEIGHT = 1.0
+
+
+def _text(value) -> str:
+    if isinstance(value, dict):
+        value = value.get("result")
+    return " ".join(str(value).split()) if value else ""
+
+
+def document_text(report_type: str, data: Dict) -> Dict[str, str]:
+    """The patient name and the narrative text of a parse result, whitespace collapsed."""
+    name = next((_text(data.get(field)) for field in NAME_FIELDS if _text(data.get(field))), "")
+    narrative = "\n".join(
+        text for text in (_text(data.get(field)) for field in NARRATIVE_FIELDS.get(report_type, ())) if text
+    )
+    return {"name": name, "narrative": narrative}
+
+
+def _words(query: str) -> List[str]:
+    return [word for word in re.split(r"[^\w]+", query.lower()) if word]
+
+
+def _trigrams(word: str) -> set:
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+def _quote(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _padded_trigrams(word: str) -> set:
+    # Padding as in pg_trgm, so the word's start and end count too ("garses" ~ "garces")
+    return _trigrams(f"  {word} ")
+
+
+def similarity(word: str, text: str) -> float:
+    """Share of word's trigrams found in the closest word of text."""
+    grams = _padded_trigrams(word)
+    return max((len(grams & _padded_trigrams(candidate)) / len(grams) for candidate in _words(text)), default=0.0)
+
+
+class SearchIndex:
+    """
+    Full-text index of patient names and report narratives (SQLite FTS5 with
+    the trigram tokenizer, so any 3+ character fragment matches). Fed one
+    parse result at a time by the upload pipeline and the record edits.
+    """
+
+    def __init__(self, path: str = SEARCH_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                """CREATE TABLE IF NOT EXISTS documents (
+                       id INTEGER PRIMARY KEY,
+                       report_type TEXT NOT NULL,
+                       unique_id TEXT NOT NULL,
+                       company TEXT NOT NULL,
+                       file_name TEXT NOT NULL,
+                       indexed_at REAL NOT NULL,
+                       UNIQUE (report_type, unique_id)
+                   )"""
+            )
+            # rowid = documents.id
+            self._connection.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(name, narrative, tokenize='trigram')"
+            )
+
+    def add(self, report_type: str, data: Dict, company: Optional[str] = None) -> None:
+        """Index (or re-index) one parse result; company None keeps the one already indexed."""
+        self.add_many(report_type, [data], company)
+
+    def add_many(self, report_type: str, records: List[Dict], company: Optional[str] = None) -> None:
+        """add() for a batch of results in one transaction (structured imports)."""
+        with self._lock, self._connection:
+            for data in records:
+                unique_id = data.get("uniqueId")
+                if not unique_id:
+                    continue
+                text = document_text(report_type, data)
+                row = self._connection.execute(
+                    "SELECT id, company FROM documents WHERE report_type = ? AND unique_id = ?", (report_type, unique_id)
+                ).fetchone()
+                indexed_company = company
+                if row is not None:
+                    if indexed_company is None:
+                        indexed_company = row[1]
+                    self._connection.execute("DELETE FROM documents_fts WHERE rowid = ?", (row[0],))
+                    self._connection.execute("DELETE FROM documents WHERE id = ?", (row[0],))
+                cursor = self._connection.execute(
+                    "INSERT INTO documents (report_type, unique_id, company, file_name, indexed_at) VALUES (?, ?, ?, ?, ?)",
+                    (report_type, unique_id, indexed_company or "", data.get("fileName") or "", time.time()),
+                )
+                self._connection.execute(
+                    "INSERT INTO documents_fts (rowid, name, narrative) VALUES (?, ?, ?)",
+                    (cursor.lastrowid, text["name"], text["narrative"]),
+                )
+
+    def remove(self, report_type: str, unique_id: str) -> bool:
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT id FROM documents WHERE report_type = ? AND unique_id = ?", (report_type, unique_id)
+            ).fetchone()
+            if row is None:
+                return False
+            self._connection.execute("DELETE FROM documents_fts WHERE rowid = ?", (row[0],))
+            self._connection.execute("DELETE FROM documents WHERE id = ?", (row[0],))
+        return True
+
+    def _select(self, match: str, report_type: Optional[str], company: Optional[str], limit: int) -> List[tuple]:
+        sql = (
+            "SELECT d.report_type, d.unique_id, d.company, d.file_name, documents_fts.name, "
+            "snippet(documents_fts, -1, '[', ']', '…', 12), "
+            f"bm25(documents_fts, {NAME_WEIGHT}, {NARRATIVE_WEIGHT}) AS score, documents_fts.narrative "
+            "FROM documents_fts JOIN documents d ON d.id = documents_fts.rowid "
+            "WHERE documents_fts MATCH ?"
+        )
+        params: List = [match]
+        if report_type:
+            sql += " AND d.report_type = ?"
+            params.append(report_type)
+        if company:
+            sql += " AND d.company = ?"
+            params.append(company)
+        sql += " ORDER BY score LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            return self._connection.execute(sql, params).fetchall()
+
+    def _like(self, words: List[str], report_type: Optional[str], company: Optional[str], limit: int) -> List[tuple]:
+        """Words under three characters have no trigram; the tokenizer still serves LIKE."""
+        sql = (
+            "SELECT d.report_type, d.unique_id, d.company, d.file_name, f.name, '', 0.0, f.narrative "
+            "FROM documents_fts f JOIN documents d ON d.id = f.rowid WHERE "
+            + " AND ".join("(f.name LIKE ? OR f.narrative LIKE ?)" for _ in words)
+        )
+        params: List = []
+        for word in words:
+            params += [f"%{word}%", f"%{word}%"]
+        if report_type:
+            sql += " AND d.report_type = ?"
+            params.append(report_type)
+        if company:
+            sql += " AND d.company = ?"
+            params.append(company)
+        sql += " LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            return self._connection.execute(sql, params).fetchall()
+
+    def search(self, query: str, report_type: Optional[str] = None, company: Optional[str] = None,
+               limit: int = 20, fuzzy: bool = True) -> Dict:
+        """
+        Ranked hits for every word of query (names count more than narratives).
+        Exact substring hits come first; when they don't fill the page, hits
+        sharing most trigrams with each word are added (misspelled names).
+        """
+        start = time.perf_counter()
+        words = _words(query)
+        limit = max(1, min(limit, 100))
+        hits: List[Dict] = []
+        seen = set()
+
+        def collect(rows, match: str):
+            for report, unique_id, company_, file_name, name, snippet, score, narrative in rows:
+                if (report, unique_id) in seen:
+                    continue
+                seen.add((report, unique_id))
+                hits.append({
+                    "uniqueId": unique_id, "type": report, "company": company_, "fileName": file_name,
+                    # A fuzzy query matches scattered trigrams, so its highlights would be noise
+                    "patientName": name, "snippet": snippet if match == "exact" and snippet else (narrative or name)[:120],
+                    "score": round(-score, 4), "match": match,
+                })
+
+        if words:
+            if all(len(word) >= 3 for word in words):
+                collect(self._select(" AND ".join(_quote(word) for word in words), report_type, company, limit), "exact")
+            else:
+                collect(self._like(words, report_type, company, limit), "exact")
+
+            grams = set().union(*(_trigrams(word) for word in words))
+            if fuzzy and len(hits) < limit and grams:
+                rows = self._select(" OR ".join(_quote(gram) for gram in sorted(grams)),
+                                    report_type, company, SEARCH_FUZZY_CANDIDATES)
+                scored = []
+                for row in rows:
+                    text = f"{row[4]} {row[7]}"
+                    closeness = min(similarity(word, text) for word in words)
+                    if closeness >= SEARCH_FUZZY_THRESHOLD:
+                        scored.append((closeness, row[6], row))
+                scored.sort(key=lambda item: (-item[0], item[1]))
+                collect([row for _, _, row in scored], "fuzzy")
+
+        return {
+            "query": query,
+            "results": hits[:limit],
+            "took_ms": round((time.perf_counter() - start) * 1000, 2),
+        }
+
+    def rebuild(self, store: BlobStore, records: RecordStore) -> Dict:
+        """
+        Re-index the parse results kept in the text sidecars whose record is
+        still in the record store (previews and deleted records are left out).
+        """
+        candidates: Dict[str, List[tuple]] = {}
+        for key in list_sidecars(store):
+            sidecar = read_sidecar(store, key)
+            result = sidecar.get("result")
+            report_type = sidecar.get("report_type", "")
+            if result and result.get("uniqueId") and report_type in COLLECTIONS:
+                candidates.setdefault(report_type, []).append((result, sidecar.get("company", "")))
+
+        stored = {
+            report_type: records.existing_ids(COLLECTIONS[report_type], [r["uniqueId"] for r, _ in rows])
+            for report_type, rows in candidates.items()
+        }
+        documents = 0
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM documents_fts")
+            self._connection.execute("DELETE FROM documents")
+        for report_type, rows in candidates.items():
+            for result, company in rows:
+                if result["uniqueId"] in stored[report_type]:
+                    self.add(report_type, result, company)
+                    documents += 1
+        with self._lock, self._connection:
+            self._connection.execute("INSERT INTO documents_fts (documents_fts) VALUES ('optimize')")
+        return {"documents": documents}
+
+    def stats(self) -> Dict:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT report_type, COUNT(*) FROM documents GROUP BY report_type"
+            ).fetchall()
+        return {"path": self.path, "documents": dict(rows)}
+
+
+search_index = SearchIndex()
@@ -0,0 +1,268 @@
+import importlib
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+from pattern_stats import pattern_stats
+
+
+# Candidate parsers, "cbc=module:function,medical=module:function"
+SHADOW_PARSERS = os.getenv("SHADOW_PARSERS", "")
+# Share of uploads of a shadowed type that also run the candidate
+SHADOW_SAMPLE_RATE = float(os.getenv("SHADOW_SAMPLE_RATE", "0.1"))
+# Samples waiting for the shadow worker; more are dropped rather than queued
+SHADOW_MAX_PENDING = int(os.getenv("SHADOW_MAX_PENDING", "50"))
+# Every differing sample is appended here, the evidence for promoting or rejecting a candidate
+SHADOW_LOG_PATH = os.getenv("SHADOW_LOG_PATH", "shadow_diffs.jsonl")
+
+# Set by the parsers at call time, never equal between two runs
+SHADOW_IGNORED_FIELDS = ("uploadDate",)
+RECENT_DIFFS = 50
+LATENCY_SAMPLES = 1000
+
+
+def flatten(value, prefix: str = "") -> Dict[str, object]:
+    """{"rbc": {"result": "4.8"}, "test_results": [{...}]} -> {"rbc.result": "4.8", "test_results[0]...": ...}."""
+    if isinstance(value, dict):
+        flat = {}
+        for key, item in value.items():
+            flat.update(flatten(item, f"{prefix}.{key}" if prefix else str(key)))
+        return flat
+    if isinstance(value, (list, tuple)):
+        flat = {}
+        for i, item in enumerate(value):
+            flat.update(flatten(item, f"{prefix}[{i}]"))
+        return flat or {prefix: []}
+    return {prefix: value}
+
+
+def field_diffs(production: Dict, candidate: Dict) -> Dict[str, Dict]:
+    """Fields whose values differ, with both values; a field only one side has is a diff too."""
+    expected = flatten({k: v for k, v in production.items() if k not in SHADOW_IGNORED_FIELDS})
+    actual = flatten({k: v for k, v in candidate.items() if k not in SHADOW_IGNORED_FIELDS})
+    missing = object()
+    diffs = {}
+    for field in sorted(expected.keys() | actual.keys()):
+        a, b = expected.get(field, missing), actual.get(field, missing)
+        if a != b:
+            diffs[field] = {
+                "production": None if a is missing else a,
+                "candidate": None if b is missing else b,
+            }
+    return diffs
+
+
+def load_candidate(spec: str) -> Callable:
+    """"module:function" -> the function."""
+    module_name, _, function_name = spec.partition(":")
+    if not module_name or not function_name:
+        raise ValueError(f"Candidate parser must be module:function, got {spec!r}")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+class ShadowParsers:
+    """
+    Runs candidate parser implementations next to the production ones on a
+    sample of real uploads. The upload only hands over the extracted text
+    and the production result; a background worker runs the candidate,
+    times both parsers back to back on the same text (with pattern stats
+    paused, so the re-runs don't count as lookups), and keeps per-field
+    diff counts and the candidate/production latency ratio. Counts are
+    per process; the diff log is shared.
+    """
+
+    def __init__(self, specs: str = SHADOW_PARSERS, sample_rate: float = SHADOW_SAMPLE_RATE,
+                 log_path: str = SHADOW_LOG_PATH):
+        self.sample_rate = sample_rate
+        self.log_path = log_path
+        self._specs: Dict[str, str] = {}
+        self._candidates: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending = 0
+        for item in specs.split(","):
+            report_type, _, spec = item.strip().partition("=")
+            if report_type and spec:
+                self._specs[report_type] = spec.strip()
+
+    def register(self, report_type: str, parser: Callable, name: Optional[str] = None) -> None:
+        """Shadow report_type's production parser with parser (replacing any earlier candidate)."""
+        with self._lock:
+            self._specs.pop(report_type, None)
+            self._candidates[report_type] = self._entry(name or f"{parser.__module__}:{parser.__name__}", parser)
+
+    @staticmethod
+    def _entry(name: str, parser: Optional[Callable]) -> Dict:
+        return {
+            "name": name, "parser": parser, "warm": False, "samples": 0, "identical": 0, "errors": 0, "dropped": 0,
+            "fields": Counter(), "ratios": deque(maxlen=LATENCY_SAMPLES),
+            "production_ms": deque(maxlen=LATENCY_SAMPLES), "candidate_ms": deque(maxlen=LATENCY_SAMPLES),
+            "recent": deque(maxlen=RECENT_DIFFS),
+        }
+
+    def _candidate(self, report_type: str) -> Optional[Dict]:
+        with self._lock:
+            if report_type in self._specs:
+                # Imported on first use, so a broken candidate never stops the app from starting
+                spec = self._specs.pop(report_type)
+                try:
+                    self._candidates[report_type] = self._entry(spec, load_candidate(spec))
+                except Exception as e:
+                    print(f"[SHADOW ERROR] Cannot load candidate {spec} for {report_type}: {str(e)}")
+            return self._candidates.get(report_type)
+
+    def enabled(self, report_type: str) -> bool:
+        return report_type in self._specs or report_type in self._candidates
+
+    def maybe_submit(self, report_type: str, production: Callable, text: str, filename: str, result: Dict,
+                     layout: Optional[Dict] = None) -> bool:
+        """
+        Queue a shadow run for this upload if its type has a candidate and it
+        falls in the sample. Never blocks and never raises into the upload.
+        layout, when the production parser got one, is passed to both sides.
+        """
+        if not self.enabled(report_type) or random.random() >= self.sample_rate:
+            return False
+        entry = self._candidate(report_type)
+        if entry is None or entry["parser"] is None:
+            return False
+        with self._lock:
+            if self._pending >= SHADOW_MAX_PENDING:
+                entry["dropped"] += 1
+                return False
+            self._pending += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shadow")
+        self._executor.submit(self._run, report_type, entry, production, text, filename, dict(result), layout)
+        return True
+
+    def _run(self, report_type: str, entry: Dict, production: Callable, text: str, filename: str,
+             result: Dict, layout: Optional[Dict] = None) -> None:
+        kwargs = {"layout": layout} if layout is not None else {}
+        try:
+            with pattern_stats.paused():
+                timings, candidate_result, error = self._time_both(entry, production, text, filename, kwargs)
+
+            diffs = field_diffs(result, candidate_result) if error is None else {}
+            with self._lock:
+                entry["samples"] += 1
+                if error is not None:
+                    entry["errors"] += 1
+                elif not diffs:
+                    entry["identical"] += 1
+                entry["fields"].update(diffs.keys())
+                entry["production_ms"].append(timings["production"])
+                entry["candidate_ms"].append(timings["candidate"])
+                if timings["production"] > 0:
+                    entry["ratios"].append(timings["candidate"] / timings["production"])
+                if diffs or error:
+                    sample = {
+                        "at": time.time(), "type": report_type, "candidate": entry["name"],
+                        "fileName": filename, "uniqueId": result.get("uniqueId", ""),
+                        "error": error, "fields": diffs,
+                    }
+                    entry["recent"].append(sample)
+            if diffs or error:
+                self._log(sample)
+        except Exception as e:
+            print(f"[SHADOW ERROR] {report_type} {filename}: {str(e)}")
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    @staticmethod
+    def _time_both(entry: Dict, production: Callable, text: str, filename: str, kwargs: Dict):
+        """(timings, candidate result, candidate error) of running both parsers on the text."""
+        # Both timed here, back to back, so request-path contention doesn't skew the ratio;
+        # the order alternates so neither side always runs on a warm cache
+        if not entry["warm"]:
+            # First calls compile each side's regexes; don't let that count against either
+            entry["warm"] = True
+            for parser in (production, entry["parser"]):
+                try:
+                    parser(text, filename, **kwargs)
+                except Exception:
+                    pass
+        timings = {}
+        order = ("candidate", "production") if entry["samples"] % 2 else ("production", "candidate")
+        candidate_result = None
+        error = None
+        for side in order:
+            start = time.perf_counter()
+            if side == "production":
+                production(text, filename, **kwargs)
+            else:
+                try:
+                    candidate_result = entry["parser"](text, filename, **kwargs)
+                except Exception as e:
+                    error = f"{type(e).__name__}: {str(e)}"
+            timings[side] = (time.perf_counter() - start) * 1000
+        return timings, candidate_result, error
+
+    def _log(self, sample: Dict) -> None:
+        if not self.log_path:
+            return
+        try:
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(sample, ensure_ascii=False, default=str) + "\n")
+        except OSError as e:
+            print(f"[SHADOW ERROR] Could not write {self.log_path}: {str(e)}")
+
+    def summary(self, report_type: Optional[str] = None, diffs: bool = False) -> Dict:
+        """
+        Per shadowed type: samples, identical share, errors, how often each
+        field differed and the candidate/production latency ratio (below 1 is
+        faster). diffs adds the most recent differing samples.
+        """
+        with self._lock:
+            report = {}
+            for name, entry in self._candidates.items():
+                if report_type and name != report_type:
+                    continue
+                ratios = np.array(entry["ratios"], dtype=float)
+                item = {
+                    "candidate": entry["name"],
+                    "samples": entry["samples"],
+                    "identical": entry["identical"],
+                    "identical_rate": round(entry["identical"] / entry["samples"], 4) if entry["samples"] else None,
+                    "errors": entry["errors"],
+                    "dropped": entry["dropped"],
+                    "fields": dict(entry["fields"].most_common()),
+                    "latency": {
+                        "production_ms": _median(entry["production_ms"]),
+                        "candidate_ms": _median(entry["candidate_ms"]),
+                        "ratio_median": round(float(np.median(ratios)), 3) if len(ratios) else None,
+                        "ratio_p95": round(float(np.percentile(ratios, 95)), 3) if len(ratios) else None,
+                    },
+                }
+                if diffs:
+                    item["recent"] = list(entry["recent"])
+                report[name] = item
+            pending_specs = {name: spec for name, spec in self._specs.items() if not report_type or name == report_type}
+            return {
+                "sample_rate": self.sample_rate,
+                "pending": self._pending,
+                "types": report,
+                # Configured but not loaded until the first sampled upload of the type
+                "configured": pending_specs,
+            }
+
+    def reset(self, report_type: Optional[str] = None) -> None:
+        with self._lock:
+            for name, entry in self._candidates.items():
+                if not report_type or name == report_type:
+                    self._candidates[name] = self._entry(entry["name"], entry["parser"])
+
+
+def _median(values) -> Optional[float]:
+    return round(float(np.median(np.array(values, dtype=float))), 3) if len(values) else None
+
+
+shadow_parsers = ShadowParsers()
@@ -0,0 +1,183 @@
+import gzip
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import fitz  # PyMuPDF
+
+from blob_store import BlobStore
+
+
+SIDECAR_SUFFIX = ".text.json.gz"
+SIDECAR_FORMAT = 1
+# Store positioned spans as well as plain text (bigger sidecars)
+SIDECAR_SPANS = os.getenv("SIDECAR_SPANS", "0") == "1"
+
+# Fields that change on every parse and are not worth reporting
+VOLATILE_FIELDS = {"uploadDate", "pdfUrl"}
+
+
+def sidecar_key(pdf_key: str) -> str:
+    return pdf_key + SIDECAR_SUFFIX
+
+
+def page_spans(page: fitz.Page) -> List[List]:
+    """[x0, y0, x1, y1, size, text] for every text span on the page."""
+    spans = []
+    for block in page.get_text("dict")["blocks"]:
+        for line in block.get("lines", []):
+            for span in line["spans"]:
+                if span["text"].strip():
+                    x0, y0, x1, y1 = span["bbox"]
+                    spans.append([round(x0, 2), round(y0, 2), round(x1, 2), round(y1, 2), round(span["size"], 2), span["text"]])
+    return spans
+
+
+def _write_json_gz(store: BlobStore, key: str, payload: Dict) -> None:
+    data = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+    store.put(key, gzip.compress(data, compresslevel=6), "application/gzip")
+
+
+def write_sidecar(store: BlobStore, pdf_key: str, report_type: str, pages: List[str], separator: str,
+                  result: Dict, parser_version: str, spans: Optional[List] = None, company: str = "",
+                  layout: Optional[Dict] = None) -> str:
+    """Store the extracted text (and last parse result) gzip-compressed next to the PDF."""
+    payload = {
+        "format": SIDECAR_FORMAT,
+        "report_type": report_type,
+        "fileName": os.path.basename(pdf_key),
+        "separator": separator,
+        "pages": pages,
+        "spans": spans,
+        # Page 1 words of lab reports, for the lab template extractors
+        "layout": layout,
+        "parser_version": parser_version,
+        "company": company,
+        "extracted_at": datetime.utcnow().isoformat(),
+        "result": result,
+    }
+    key = sidecar_key(pdf_key)
+    _write_json_gz(store, key, payload)
+    return key
+
+
+def read_sidecar(store: BlobStore, key: str) -> Dict:
+    data = store.get(key)
+    if data is None:
+        raise FileNotFoundError(f"No sidecar {key}")
+    return json.loads(gzip.decompress(data))
+
+
+def list_sidecars(store: BlobStore) -> List[str]:
+    return [key for key in store.list() if key.endswith(SIDECAR_SUFFIX)]
+
+
+def diff_fields(old, new, prefix: str = "") -> Dict[str, Dict]:
+    """Field-level differences between two parse results, nested keys joined with dots."""
+    changes = {}
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in sorted(set(old) | set(new), key=str):
+            if not prefix and key in VOLATILE_FIELDS:
+                continue
+            name = f"{prefix}.{key}" if prefix else str(key)
+            changes.update(diff_fields(old.get(key), new.get(key), name))
+    elif old != new:
+        changes[prefix] = {"old": old, "new": new}
+    return changes
+
+
+def reparse_sidecar(store: BlobStore, key: str, parsers: Dict[str, Callable[[str, str], Dict]], parser_version: str,
+                    write: bool, report_types: Optional[List[str]] = None) -> Optional[Dict]:
+    """
+    Re-run the current parser on a stored sidecar; never opens the PDF.
+    Returns None when the sidecar's report type is filtered out.
+    """
+    sidecar = read_sidecar(store, key)
+    report_type = sidecar["report_type"]
+    if report_types and report_type not in report_types:
+        return None
+    parser = parsers.get(report_type)
+    if parser is None:
+        raise ValueError(f"Unknown report type: {report_type}")
+
+    text = sidecar["separator"].join(sidecar["pages"])
+
+    start = time.perf_counter()
+    if sidecar.get("layout"):
+        result = parser(text, sidecar["fileName"], layout=sidecar["layout"])
+    else:
+        result = parser(text, sidecar["fileName"])
+    elapsed = time.perf_counter() - start
+
+    old_result = sidecar.get("result") or {}
+    previous_parser_version = sidecar.get("parser_version", "")
+    if "pdfUrl" in old_result:
+        result["pdfUrl"] = old_result["pdfUrl"]
+    changes = diff_fields(old_result, result)
+
+    if write and (changes or previous_parser_version != parser_version):
+        sidecar["result"] = result
+        sidecar["parser_version"] = parser_version
+        sidecar["reparsed_at"] = datetime.utcnow().isoformat()
+        _write_json_gz(store, key, sidecar)
+
+    return {
+        "fileName": sidecar["fileName"],
+        "report_type": report_type,
+        "previous_parser_version": previous_parser_version,
+        "parse_ms": round(elapsed * 1000, 2),
+        "changed_fields": changes,
+        "result": result,
+    }
+
+
+def reparse_all(store: BlobStore, parsers: Dict[str, Callable[[str, str], Dict]], parser_version: str,
+                report_types: Optional[List[str]] = None, workers: Optional[int] = None,
+                write: bool = False) -> Dict:
+    """
+    Apply the current parsers to every stored sidecar in parallel and report
+    which fields changed per document. write=True updates the sidecars, never
+    the saved records.
+    """
+    start = time.perf_counter()
+    documents = []
+    errors = []
+    # Spawned like the extraction workers: forking the API process would copy its threads and locks
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = {
+            key: executor.submit(reparse_sidecar, store, key, parsers, parser_version, write, report_types)
+            for key in list_sidecars(store)
+        }
+        for key, future in futures.items():
+            try:
+                document = future.result()
+            except Exception as e:
+                errors.append({"sidecar": key, "error": str(e)})
+                continue
+            if document is not None:
+                documents.append(document)
+
+    changed = [document for document in documents if document["changed_fields"]]
+    field_counts: Dict[str, int] = {}
+    for document in changed:
+        for name in document["changed_fields"]:
+            key = f"{document['report_type']}.{name}"
+            field_counts[key] = field_counts.get(key, 0) + 1
+
+    return {
+        "parser_version": parser_version,
+        "documents": len(documents),
+        "changed_documents": len(changed),
+        "written": write,
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 2),
+        "field_change_counts": dict(sorted(field_counts.items(), key=lambda item: -item[1])),
+        "changes": [
+            {key: document[key] for key in ("fileName", "report_type", "previous_parser_version", "changed_fields")}
+            for document in changed
+        ],
+        "errors": errors,
+    }
@@ -0,0 +1,110 @@
+"""
+Memory soak test for the PDF document layer.
+
+    python soak_pdf_memory.py [--dir uploaded_pdfs] [--parses 10000] [--workers 2] [--max-docs 500]
+    python soak_pdf_memory.py --workers 0        # PyMuPDF in this process
+
+Extracts and parses the corpus over and over through pdf_documents, sampling
+the resident memory of this process and of the extraction workers. With the
+document lifecycle bounded, both series stay flat: the reported slope (MB per
+1000 parses, over the second half of the run) should be close to zero.
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+from typing import List, Tuple
+
+with contextlib.redirect_stdout(io.StringIO()):
+    from main import LAYOUT_PARSERS, PARSERS, UPLOAD_DIR, guess_report_type
+from pdf_documents import DocumentPool, PDF_WORKER_MAX_RSS_MB, rss_bytes
+
+
+def load_corpus(directory: str) -> List[Tuple[str, str, bytes]]:
+    corpus = []
+    for name in sorted(os.listdir(directory)):
+        report_type = guess_report_type(name) if name.lower().endswith(".pdf") else None
+        if report_type:
+            with open(os.path.join(directory, name), "rb") as f:
+                corpus.append((name, report_type, f.read()))
+    return corpus
+
+
+def slope_per_1000(samples: List[Tuple[int, float]]) -> float:
+    """Least-squares slope of (parses, MB), in MB per 1000 parses."""
+    if len(samples) < 2:
+        return 0.0
+    n = len(samples)
+    mean_x = sum(x for x, _ in samples) / n
+    mean_y = sum(y for _, y in samples) / n
+    var = sum((x - mean_x) ** 2 for x, _ in samples)
+    if var == 0:
+        return 0.0
+    cov = sum((x - mean_x) * (y - mean_y) for x, y in samples)
+    return cov / var * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", default=UPLOAD_DIR)
+    parser.add_argument("--parses", type=int, default=10000)
+    parser.add_argument("--workers", type=int, default=2, help="extraction workers, 0 for in-process")
+    parser.add_argument("--max-docs", type=int, default=500, help="documents per worker before it is replaced")
+    parser.add_argument("--max-rss-mb", type=int, default=PDF_WORKER_MAX_RSS_MB)
+    parser.add_argument("--sample-every", type=int, default=250)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.dir)
+    if not corpus:
+        raise SystemExit(f"No PDFs with a known report type in {args.dir}")
+
+    pool = DocumentPool(args.workers, args.max_docs, args.max_rss_mb)
+    pool.start()
+
+    api_samples, worker_samples = [], []
+    errors = 0
+    started = time.perf_counter()
+    print(f"{'parses':>8} {'seconds':>8} {'api MB':>8} {'worker MB':>10} {'docs/sec':>9}")
+    try:
+        for i in range(1, args.parses + 1):
+            name, report_type, content = corpus[i % len(corpus)]
+            try:
+                # As parse_pdf: lab reports in a known layout are read by position
+                pages, _, layout = pool.extract(content, with_layout=report_type in LAYOUT_PARSERS)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    if layout is not None:
+                        PARSERS[report_type]("".join(pages), name, layout=layout)
+                    else:
+                        PARSERS[report_type]("".join(pages), name)
+            except Exception as e:
+                errors += 1
+                print(f"[SOAK ERROR] {name}: {e}", file=sys.stderr)
+
+            if i % args.sample_every == 0 or i == args.parses:
+                api_mb = rss_bytes() / (1024 * 1024)
+                worker_rss = pool.stats()["worker_rss_mb"]
+                worker_mb = max(worker_rss.values()) if worker_rss else 0.0
+                api_samples.append((i, api_mb))
+                worker_samples.append((i, worker_mb))
+                elapsed = time.perf_counter() - started
+                print(f"{i:>8} {elapsed:>8.0f} {api_mb:>8.1f} {worker_mb:>10.1f} {i / elapsed:>9.1f}", flush=True)
+    finally:
+        stats = pool.stats()
+        pool.shutdown()
+
+    # The first half includes allocator and cache warm-up
+    half = len(api_samples) // 2
+    print()
+    print(f"{args.parses} parses, {errors} errors, {stats['generation']} pool recycles")
+    print(f"API process: {api_samples[0][1]:.1f} -> {api_samples[-1][1]:.1f} MB, "
+          f"slope {slope_per_1000(api_samples[half:]):+.2f} MB/1000 parses")
+    if args.workers > 0:
+        print(f"Workers (max): {worker_samples[0][1]:.1f} -> {worker_samples[-1][1]:.1f} MB, "
+              f"slope {slope_per_1000(worker_samples[half:]):+.2f} MB/1000 parses")
+    print(f"Documents left open in this process: {stats['api_process']['open']}")
+
+
+if __name__ == "__main__":
+    main()
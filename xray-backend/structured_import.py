@@ -0,0 +1,449 @@
+"""
+Import lab results from the lab system's CSV / Excel exports instead of PDFs.
+
+    python structured_import.py EXPORT.csv [EXPORT2.xlsx ...] [--type auto] [--out results.jsonl] [--persist]
+
+Rows are streamed and mapped onto the same result dicts as parse_cbc_data,
+parse_urinalysis, parse_lipid_profile and parse_chemistry. Two layouts are
+understood:
+
+- long: one row per result, with test / result (and optionally unit,
+  reference range, flag) columns next to the patient and order columns;
+- wide: one row per order, with one column per analyte.
+
+Rows of the same patient and order (order number, else collection time) make
+one record; with --type auto each result goes to the report type its test
+name belongs to. A name several types share (RBC, glucose, HDL) is placed by
+its unit, reference range or a qualitative result, else by the one type the
+order already has results for; otherwise it is reported as unmapped. A test
+that comes again for a field already filled is reported, never overwritten.
+"""
+import argparse
+import codecs
+import csv
+import io
+import json
+import os
+import re
+import sys
+import time
+from collections import Counter, OrderedDict
+from dataclasses import fields
+from datetime import datetime
+from typing import IO, Dict, Iterator, List, Optional, Tuple
+
+from models import RESULT_MODELS, LabValue
+
+
+IMPORT_TYPES = ("cbc", "urinalysis", "lipid", "chem")
+# uniqueId prefix per report type, as in the PDF file names ("CBC_RADEN2025")
+IMPORT_PREFIXES = {"cbc": "CBC", "urinalysis": "UA", "lipid": "LIPID", "chem": "CHEM"}
+# Orders kept open for more rows; exports list an order's rows together, so older ones are complete
+IMPORT_OPEN_RECORDS = int(os.getenv("IMPORT_OPEN_RECORDS", "1000"))
+
+
+def normalize(name) -> str:
+    """ "Neutrophils %" -> "neutrophils_percent", "Collection Date/Time" -> "collection_date_time"."""
+    name = str(name or "").strip().lower().replace("%", " percent ").replace("#", " abs ")
+    return re.sub(r"[^a-z0-9]+", "_", name).strip("_")
+
+
+def _aliases(table: Dict[str, List[str]]) -> Dict[str, str]:
+    return {normalize(alias): key for key, aliases in table.items() for alias in [key, *aliases]}
+
+
+# Patient and order columns -> result keys (chemistry renames some, see CHEM_KEYS)
+HEADER_COLUMNS = _aliases({
+    "patientName": ["patient_name", "patient", "name", "full_name"],
+    "mrn": ["pid", "patient_id", "hospital_no", "medical_record_no", "medical_record_number"],
+    "gender": ["sex"],
+    "age": [],
+    "dob": ["date_of_birth", "birth_date", "birthdate"],
+    "collectionDateTime": ["collection_datetime", "collection_date_time", "collection_date", "collected"],
+    "resultValidated": ["result_validated", "validated", "validated_at", "verified_at"],
+    "orderNumber": ["order_number", "order_no", "order", "accession", "accession_no", "lab_no"],
+    "location": ["ward", "department"],
+    "care_provider": ["physician", "requesting_physician", "doctor"],
+})
+CHEM_KEYS = {"patientName": "name", "collectionDateTime": "collection_datetime", "resultValidated": "result_validated"}
+
+# Result columns of the long layout
+RESULT_COLUMNS = _aliases({
+    "test": ["test_name", "analyte", "component", "parameter", "test_description"],
+    "result": ["value", "result_value"],
+    "unit": ["units", "uom"],
+    "reference_range": ["ref_range", "reference", "normal_range", "range", "normal_values"],
+    "flag": ["abnormal_flag", "h_l"],
+})
+
+# Test names -> result field per report type
+ANALYTES = {
+    "cbc": _aliases({
+        "rbc": ["rbc_count", "red_blood_cells", "red_blood_cell_count"],
+        "hematocrit": ["hct"],
+        "hemoglobin": ["hgb", "hb"],
+        "mcv": [], "mch": [], "mchc": [],
+        "rdw": ["rdw_cv"],
+        "platelets": ["platelet_count", "plt"],
+        "mpv": [],
+        "wbc": ["wbc_count", "white_blood_cells", "white_blood_cell_count"],
+        "neutrophils_percent": ["neutrophils", "neutrophil", "neutrophils_pct", "segmenters"],
+        "lymphocytes_percent": ["lymphocytes", "lymphocyte", "lymphocytes_pct"],
+        "monocytes_percent": ["monocytes", "monocyte", "monocytes_pct"],
+        "eosinophils_percent": ["eosinophils", "eosinophil", "eosinophils_pct"],
+        "basophils_percent": ["basophils", "basophil", "basophils_pct"],
+        "neutrophils_abs": ["absolute_neutrophils", "abs_neutrophils", "anc"],
+        "lymphocytes_abs": ["absolute_lymphocytes", "abs_lymphocytes"],
+        "monocytes_abs": ["absolute_monocytes", "abs_monocytes"],
+        "eosinophils_abs": ["absolute_eosinophils", "abs_eosinophils"],
+        "basophils_abs": ["absolute_basophils", "abs_basophils"],
+    }),
+    "urinalysis": _aliases({
+        "color": ["colour"],
+        "clarity": ["appearance", "transparency"],
+        "glucose": ["urine_glucose", "sugar"],
+        "bilirubin": [],
+        "ketones": ["ketone"],
+        "specific_gravity": ["sp_gr", "sg"],
+        "blood": ["occult_blood"],
+        "ph": [],
+        "protein": ["albumin"],
+        "urobilinogen": [],
+        "nitrite": ["nitrites"],
+        "leukocyte_esterase": ["leukocytes"],
+        "rbc": ["urine_rbc", "red_cells"],
+        "wbc": ["urine_wbc", "pus_cells", "pus_cell"],
+        "epithelial_cells": ["epithelial", "squamous_epithelial_cells"],
+        "bacteria": [],
+        "hyaline_cast": ["hyaline_casts", "casts"],
+        "remarks": [],
+    }),
+    "lipid": _aliases({
+        "alt_sgpt": ["alt", "sgpt", "alt_sgpt"],
+        "total_cholesterol": ["cholesterol", "chole"],
+        "triglycerides": ["triglyceride", "trig"],
+        "hdl_cholesterol": ["hdl", "hdl_c"],
+        "ldl_cholesterol": ["ldl", "ldl_c"],
+        "vldl": ["vldl_cholesterol"],
+    }),
+    "chem": _aliases({
+        "fbs": ["fasting_blood_sugar", "fasting_blood_glucose", "glucose_fasting", "glucose", "blood_glucose",
+                "serum_glucose"],
+        "bua": ["uric_acid", "blood_uric_acid"],
+        "creatinine": ["crea", "serum_creatinine"],
+        "sgpt": ["alt"],
+        "cholesterol": ["total_cholesterol"],
+        "hdl": ["hdl_cholesterol"],
+        "ldl": ["ldl_cholesterol"],
+        "triglycerides": ["triglyceride"],
+    }),
+}
+
+
+# Unit or reference range text -> the report types a shared test name can then belong to.
+# Urine dipsticks also report in mg/dL, so the urinalysis signs are checked first
+UNIT_TYPES = [
+    (re.compile(r"/\s*[hl]pf\b", re.I), ("urinalysis",)),
+    (re.compile(r"10\s*[\^*]\s*\d|x\s*10\b|/\s*(?:u|µ|m)l\b|/\s*(?:mm3|cumm)\b|\bfl\b|\bpg\b", re.I), ("cbc",)),
+    (re.compile(r"\bmg\s*/\s*dl\b|\b(?:m|u|µ)mol\s*/\s*l\b|\bu\s*/\s*l\b", re.I), ("lipid", "chem")),
+]
+# Results and reference ranges only urinalysis reports: dipstick grades
+QUALITATIVE = re.compile(r"^(?:neg(?:ative)?|trace|pos(?:itive)?|nil|none|rare|few|moderate|many|\d?\++)$", re.I)
+# Microscopy counts per field ("0-2"); as a reference range this would be any serum range
+COUNT_RANGE = re.compile(r"^\d+\s*-\s*\d+$")
+
+
+def panel_types(result: Dict) -> Optional[Tuple[str, ...]]:
+    """The report types a result's unit, reference range or value points to; None when they don't tell."""
+    value = result["result"].strip()
+    if QUALITATIVE.match(value) or COUNT_RANGE.match(value) or QUALITATIVE.match(result["reference_range"].strip()):
+        return ("urinalysis",)
+    text = f"{result['unit']} {result['reference_range']}"
+    for pattern, types in UNIT_TYPES:
+        if pattern.search(text):
+            return types
+    return None
+
+
+def empty_result(report_type: str) -> Dict:
+    """The parser's dict shape for report_type, every field at its default."""
+    result = {}
+    for model_field in fields(RESULT_MODELS[report_type]):
+        if model_field.default_factory is LabValue:
+            result[model_field.name] = {"result": "", "unit": "", "reference_range": "", "flag": ""}
+        elif model_field.default_factory is list:
+            result[model_field.name] = []
+        else:
+            result[model_field.name] = model_field.default
+    return result
+
+
+def _flag(value: str) -> str:
+    value = value.strip().upper()
+    return value[0] if value[:1] in ("H", "L") else ""
+
+
+def read_rows(stream: IO[bytes], filename: str) -> Iterator[List[str]]:
+    """Rows of a .csv/.tsv/.txt (delimiter sniffed) or .xlsx export as lists of strings, header first."""
+    if filename.lower().endswith((".xlsx", ".xlsm")):
+        try:
+            import openpyxl
+        except ImportError:
+            raise RuntimeError("Importing Excel files needs openpyxl (pip install openpyxl)")
+        workbook = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+        try:
+            for row in workbook.worksheets[0].iter_rows(values_only=True):
+                yield ["" if value is None else _cell(value) for value in row]
+        finally:
+            workbook.close()
+        return
+
+    text = codecs.getreader("utf-8-sig")(stream, errors="replace")
+    sample = text.read(64 * 1024)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=",;\t|")
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.reader(_chain(sample, text), dialect)
+    yield from reader
+
+
+def _chain(sample: str, rest) -> Iterator[str]:
+    yield from io.StringIO(sample + rest.readline())
+    yield from rest
+
+
+def _cell(value) -> str:
+    if isinstance(value, datetime):
+        return value.strftime("%B %d, %Y  %H:%M")
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
+class ExportMapper:
+    """
+    Turns export rows into (report type, result dict) pairs. counts keeps
+    rows, records per type, skipped rows, the test names nothing maps to and
+    those dropped because their field was already filled.
+    """
+
+    def __init__(self, report_type: str = "auto", source: str = ""):
+        if report_type != "auto" and report_type not in IMPORT_TYPES:
+            raise ValueError(f"Unknown import type: {report_type}. Expected 'auto' or one of: {', '.join(IMPORT_TYPES)}")
+        self.report_type = report_type
+        self.source = source
+        self.types = IMPORT_TYPES if report_type == "auto" else (report_type,)
+        self.rows = 0
+        self.skipped = 0
+        self.records: Counter = Counter()
+        self.unmapped: Counter = Counter()
+        self.repeated: Counter = Counter()
+        self._open: "OrderedDict[Tuple, Dict]" = OrderedDict()
+
+    def records_from(self, rows: Iterator[List[str]]) -> Iterator[Tuple[str, Dict]]:
+        header = None
+        for row in rows:
+            if header is None:
+                if any(str(cell).strip() for cell in row):
+                    header = self._header(row)
+                continue
+            self.rows += 1
+            if not any(str(cell).strip() for cell in row):
+                self.skipped += 1
+                continue
+            self._add_row(header, row)
+            while len(self._open) > IMPORT_OPEN_RECORDS:
+                yield from self._finish(self._open.popitem(last=False)[1])
+        while self._open:
+            yield from self._finish(self._open.popitem(last=False)[1])
+
+    def _header(self, row: List[str]) -> Dict:
+        names = [normalize(cell) for cell in row]
+        header = {"patient": {}, "result": {}, "analytes": {}}
+        for index, name in enumerate(names):
+            if name in RESULT_COLUMNS:
+                header["result"].setdefault(RESULT_COLUMNS[name], index)
+            elif name in HEADER_COLUMNS:
+                header["patient"].setdefault(HEADER_COLUMNS[name], index)
+            elif any(name in ANALYTES[t] for t in self.types):
+                header["analytes"][index] = row[index]
+        if "test" in header["result"] and "result" not in header["result"]:
+            raise ValueError("The export has a test column but no result column")
+        if "test" not in header["result"] and not header["analytes"]:
+            raise ValueError("No test/result columns and no known analyte columns in the export header")
+        return header
+
+    def _add_row(self, header: Dict, row: List[str]) -> None:
+        def cell(index: Optional[int]) -> str:
+            return str(row[index]).strip() if index is not None and index < len(row) else ""
+
+        patient = {key: cell(index) for key, index in header["patient"].items()}
+        key = (patient.get("mrn") or patient.get("patientName", ""),
+               patient.get("orderNumber") or patient.get("collectionDateTime", ""))
+        if not any(key):
+            self.skipped += 1
+            return
+        record = self._open.get(key)
+        if record is None:
+            record = self._open[key] = {"patient": patient, "results": []}
+        else:
+            self._open.move_to_end(key)
+            for name, value in patient.items():
+                record["patient"][name] = record["patient"].get(name) or value
+
+        columns = header["result"]
+        if "test" in columns:
+            test = cell(columns["test"])
+            if test:
+                record["results"].append({
+                    "test": test, "result": cell(columns["result"]), "unit": cell(columns.get("unit")),
+                    "reference_range": cell(columns.get("reference_range")), "flag": _flag(cell(columns.get("flag"))),
+                })
+        for index, test in header["analytes"].items():
+            value = cell(index)
+            if value:
+                record["results"].append({"test": test, "result": value, "unit": "", "reference_range": "", "flag": ""})
+
+    def _place(self, placed: Dict[str, List[Tuple[str, Dict]]], report_type: str, field: str, result: Dict) -> None:
+        """Add a result to report_type's record unless a result already filled its field."""
+        if field and any(taken == field for taken, _ in placed[report_type]):
+            self.repeated[result["test"]] += 1
+            return
+        placed[report_type].append((field, result))
+
+    def _finish(self, record: Dict) -> Iterator[Tuple[str, Dict]]:
+        # Each result goes to the one type that knows its test. A test several types know
+        # (RBC in CBC and urinalysis, glucose in urinalysis and chemistry) is placed by its unit,
+        # reference range or value, else by the one type the order already has results for
+        placed: Dict[str, List[Tuple[str, Dict]]] = {t: [] for t in self.types}
+        ambiguous = []
+        for result in record["results"]:
+            name = normalize(result["test"])
+            candidates = [t for t in self.types if name in ANALYTES[t]]
+            if len(candidates) == 1:
+                self._place(placed, candidates[0], ANALYTES[candidates[0]][name], result)
+            elif candidates:
+                ambiguous.append((name, candidates, result))
+            elif "chem" in self.types:
+                self._place(placed, "chem", "", result)
+            else:
+                self.unmapped[result["test"]] += 1
+        in_order = {t for t in self.types if placed[t]}
+        for name, candidates, result in ambiguous:
+            hinted = panel_types(result)
+            if hinted is not None:
+                candidates = [t for t in candidates if t in hinted]
+            if len(candidates) > 1:
+                candidates = [t for t in candidates if t in in_order]
+            if len(candidates) == 1:
+                self._place(placed, candidates[0], ANALYTES[candidates[0]][name], result)
+            else:
+                self.unmapped[result["test"]] += 1
+
+        for report_type, results in placed.items():
+            if results and any(field for field, _ in results):
+                self.records[report_type] += 1
+                yield report_type, self._result(report_type, record["patient"], results)
+            elif results:
+                # Only tests no type knows: not worth a chemistry record of its own
+                for _, result in results:
+                    self.unmapped[result["test"]] += 1
+
+    def _result(self, report_type: str, patient: Dict, results: List[Tuple[str, Dict]]) -> Dict:
+        data = empty_result(report_type)
+        for name, value in patient.items():
+            key = CHEM_KEYS.get(name, name) if report_type == "chem" else name
+            if key in data and value:
+                data[key] = value
+        if report_type == "cbc":
+            age = re.match(r"\d+", str(data["age"] or ""))
+            data["age"] = int(age.group()) if age else 0
+
+        for field, result in results:
+            value = {name: result[name] for name in ("result", "unit", "reference_range", "flag")}
+            if report_type == "chem":
+                data["test_results"].append({"test_name": result["test"], **{
+                    name: value[name] for name in ("result", "unit", "reference_range")}})
+                if field:
+                    data[field] = value["result"]
+            else:
+                data[field] = value
+
+        order = patient.get("orderNumber") or patient.get("collectionDateTime", "")
+        unique_id = "_".join(part for part in (
+            IMPORT_PREFIXES[report_type],
+            re.sub(r"[^\w.-]+", "", patient.get("mrn") or patient.get("patientName", "")),
+            re.sub(r"[^\w.-]+", "", order),
+        ) if part)
+        data.update({
+            "fileName": self.source,
+            "uploadDate": datetime.utcnow().isoformat(),
+            "uniqueId": unique_id,
+            # No source PDF to link
+            "pdfUrl": "",
+        })
+        return data
+
+    def summary(self) -> Dict:
+        return {
+            "rows": self.rows,
+            "skippedRows": self.skipped,
+            "records": dict(self.records),
+            "unmappedTests": dict(self.unmapped.most_common(20)),
+            "repeatedTests": dict(self.repeated.most_common(20)),
+        }
+
+
+def read_export(stream: IO[bytes], filename: str, report_type: str = "auto") -> Tuple[ExportMapper, Iterator[Tuple[str, Dict]]]:
+    """The mapper (for its counts) and the (report type, result) pairs of an export file."""
+    mapper = ExportMapper(report_type, os.path.basename(filename))
+    return mapper, mapper.records_from(read_rows(stream, filename))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", help="CSV, TSV or XLSX exports")
+    parser.add_argument("--type", default="auto", choices=["auto", *IMPORT_TYPES],
+                        help="report type of every result, or 'auto' to go by test name")
+    parser.add_argument("--out", default=None, help="write the records as JSON lines")
+    parser.add_argument("--persist", action="store_true",
+                        help="save the records like /records/{type}/import (record store, change feed, analytics, search)")
+    parser.add_argument("--firstname", default="", help="name for the activity log entry")
+    parser.add_argument("--company", default="")
+    args = parser.parse_args()
+
+    import_records = None
+    if args.persist:
+        import contextlib
+        with contextlib.redirect_stdout(io.StringIO()):
+            from main import import_records
+
+    out = open(args.out, "a", encoding="utf-8") if args.out else None
+    started = time.perf_counter()
+    totals: Counter = Counter()
+    try:
+        for path in args.files:
+            with open(path, "rb") as stream:
+                mapper, records = read_export(stream, path, args.type)
+                if import_records is not None:
+                    summary = import_records(mapper, records, args.firstname, args.company, out=out)
+                else:
+                    for report_type, data in records:
+                        if out:
+                            out.write(json.dumps({"report_type": report_type, "data": data}, ensure_ascii=False) + "\n")
+                    summary = mapper.summary()
+            totals["rows"] += summary["rows"]
+            totals["records"] += sum(summary["records"].values())
+            print(json.dumps({"file": path, **summary}, ensure_ascii=False, default=str))
+    finally:
+        if out:
+            out.close()
+
+    elapsed = time.perf_counter() - started
+    sys.stderr.write(f"{totals['rows']} rows, {totals['records']} records in {elapsed:.2f}s "
+                     f"({totals['rows'] / elapsed if elapsed > 0 else 0:.0f} rows/sec)\n")
+
+
+if __name__ == "__main__":
+    main()
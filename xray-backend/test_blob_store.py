@@ -0,0 +1,93 @@
+"""
+The blob stores (python -m pytest test_blob_store.py). The S3 test runs
+against MinIO when S3_TEST_ENDPOINT_URL is set, e.g.
+
+    docker run -p 9000:9000 minio/minio server /data
+    S3_TEST_ENDPOINT_URL=http://localhost:9000 AWS_ACCESS_KEY_ID=minioadmin \
+        AWS_SECRET_ACCESS_KEY=minioadmin python -m pytest test_blob_store.py
+"""
+import os
+import pickle
+import time
+import uuid
+
+import pytest
+
+from blob_store import CACHE_BLOBS, STALE_TMP_SECONDS, CachedBlobStore, LocalBlobStore, S3BlobStore
+
+
+def cache(tmp_path, max_bytes=1000):
+    return CachedBlobStore(LocalBlobStore(str(tmp_path / "shared")), str(tmp_path / "cache"), max_bytes=max_bytes)
+
+
+def test_processes_on_a_node_evict_against_one_total(tmp_path):
+    first, second = cache(tmp_path), cache(tmp_path)
+    first.put("a.pdf", b"a" * 400)
+    second.put("b.pdf", b"b" * 400)
+    first.put("c.pdf", b"c" * 400)
+
+    # "a.pdf" was the least recently used blob on the node
+    assert not os.path.exists(tmp_path / "cache" / CACHE_BLOBS / "a.pdf")
+    assert first.stats()["bytes"] == second.stats()["bytes"] == 800
+    assert second.get("a.pdf") == b"a" * 400
+
+
+def test_only_stale_tmp_files_are_removed(tmp_path):
+    blobs = tmp_path / "cache" / CACHE_BLOBS
+    blobs.mkdir(parents=True)
+    (blobs / "in_flight.pdf.1.2.tmp").write_bytes(b"x")
+    stale = blobs / "crashed.pdf.3.4.tmp"
+    stale.write_bytes(b"x")
+    old = time.time() - STALE_TMP_SECONDS - 60
+    os.utime(stale, (old, old))
+
+    cache(tmp_path)
+    assert (blobs / "in_flight.pdf.1.2.tmp").exists()
+    assert not stale.exists()
+
+
+def test_pool_workers_get_one_read_only_handle(tmp_path):
+    store = cache(tmp_path)
+    store.put("a.pdf", b"a")
+    store.backend.put("b.pdf", b"b")
+
+    worker = pickle.loads(pickle.dumps(store))
+    assert worker.read_only
+    assert pickle.loads(pickle.dumps(store)) is worker
+    assert worker.get("a.pdf") == b"a"
+    # Read from the shared store, not cached
+    assert worker.get("b.pdf") == b"b"
+    assert store.stats()["blobs"] == 1
+
+    # A worker's write replaces the shared blob and drops the stale cached copy
+    worker.put("a.pdf", b"new")
+    assert store.get("a.pdf") == b"new"
+
+
+@pytest.mark.skipif(not os.getenv("S3_TEST_ENDPOINT_URL"), reason="set S3_TEST_ENDPOINT_URL to a MinIO server")
+def test_s3_store_through_the_cache(tmp_path):
+    bucket = os.getenv("S3_TEST_BUCKET", "blob-store-test")
+    backend = S3BlobStore(bucket, f"test-{uuid.uuid4().hex}", os.getenv("S3_TEST_ENDPOINT_URL"),
+                          os.getenv("S3_TEST_REGION", "us-east-1"))
+    try:
+        backend._client.create_bucket(Bucket=bucket)
+    except (backend._client.exceptions.BucketAlreadyOwnedByYou, backend._client.exceptions.BucketAlreadyExists):
+        pass
+    store = CachedBlobStore(backend, str(tmp_path / "cache"), revalidate_seconds=0)
+
+    store.put("XRAY_A.pdf", b"%PDF-1", "application/pdf")
+    store.put("XRAY_A_tiles/0/0/0_0.jpg", b"tile", "image/jpeg")
+    assert store.list("XRAY_A") == ["XRAY_A.pdf", "XRAY_A_tiles/0/0/0_0.jpg"]
+    assert store.stat("XRAY_A.pdf")["size"] == 6
+    assert open(store.local_path("XRAY_A.pdf"), "rb").read() == b"%PDF-1"
+
+    # Replaced through another node: the ETag check drops the cached copy
+    backend.put("XRAY_A.pdf", b"%PDF-2", "application/pdf")
+    assert store.get("XRAY_A.pdf") == b"%PDF-2"
+
+    # One client per worker process
+    assert pickle.loads(pickle.dumps(backend)) is pickle.loads(pickle.dumps(backend))
+
+    assert store.delete_prefix("XRAY_A") == 2
+    assert store.get("XRAY_A.pdf") is None
+    assert store.stat("XRAY_A.pdf") is None
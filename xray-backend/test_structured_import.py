@@ -0,0 +1,80 @@
+"""
+Mixed-panel orders through ExportMapper (python -m pytest test_structured_import.py).
+"""
+import io
+
+from structured_import import read_export
+
+
+HEADER = "MRN,Patient Name,Order No,Test,Result,Unit,Reference Range\n"
+
+
+def export(rows, report_type="auto", header=HEADER):
+    stream = io.BytesIO((header + "".join(f"{row}\n" for row in rows)).encode())
+    mapper, records = read_export(stream, "export.csv", report_type)
+    return mapper, {report_type: data for report_type, data in records}
+
+
+ANNUAL_EXAM = [
+    "1001,DELA CRUZ JUAN,A1,RBC,4.5,x10^12/L,4.0-5.5",
+    "1001,DELA CRUZ JUAN,A1,WBC,7.2,x10^9/L,5.0-10.0",
+    "1001,DELA CRUZ JUAN,A1,Hemoglobin,14.1,g/dL,12.0-16.0",
+    "1001,DELA CRUZ JUAN,A1,Glucose,95,mg/dL,70-110",
+    "1001,DELA CRUZ JUAN,A1,Creatinine,0.9,mg/dL,0.6-1.2",
+    "1001,DELA CRUZ JUAN,A1,Color,Yellow,,",
+    "1001,DELA CRUZ JUAN,A1,Glucose,Negative,,Negative",
+    "1001,DELA CRUZ JUAN,A1,RBC,0-2,/hpf,0-2",
+    "1001,DELA CRUZ JUAN,A1,WBC,5-8,/hpf,0-5",
+]
+
+
+def test_shared_tests_go_by_unit():
+    mapper, records = export(ANNUAL_EXAM)
+    assert set(records) == {"cbc", "chem", "urinalysis"}
+    assert records["cbc"]["rbc"]["result"] == "4.5"
+    assert records["cbc"]["wbc"]["result"] == "7.2"
+    assert records["urinalysis"]["rbc"]["result"] == "0-2"
+    assert records["urinalysis"]["wbc"]["result"] == "5-8"
+    assert records["urinalysis"]["glucose"]["result"] == "Negative"
+    assert records["chem"]["fbs"] == "95"
+    assert mapper.summary()["unmappedTests"] == {}
+
+
+def test_shared_test_without_unit_is_unmapped_when_both_panels_are_ordered():
+    mapper, records = export([
+        "1001,DELA CRUZ JUAN,A1,Hemoglobin,14.1,,",
+        "1001,DELA CRUZ JUAN,A1,Color,Yellow,,",
+        "1001,DELA CRUZ JUAN,A1,RBC,4.5,,",
+    ])
+    assert records["cbc"]["rbc"]["result"] == ""
+    assert records["urinalysis"]["rbc"]["result"] == ""
+    assert mapper.summary()["unmappedTests"] == {"RBC": 1}
+
+
+def test_shared_test_without_unit_follows_the_only_panel_ordered():
+    _, records = export([
+        "1002,SANTOS MARIA,B7,Hemoglobin,13.2,,",
+        "1002,SANTOS MARIA,B7,RBC,4.1,,",
+    ])
+    assert set(records) == {"cbc"}
+    assert records["cbc"]["rbc"]["result"] == "4.1"
+
+
+def test_lipid_panel_keeps_its_cholesterol():
+    _, records = export([
+        "1003,REYES ANA,C2,Cholesterol,210,mg/dL,<200",
+        "1003,REYES ANA,C2,HDL,45,mg/dL,>40",
+        "1003,REYES ANA,C2,VLDL,30,mg/dL,<30",
+    ])
+    assert set(records) == {"lipid"}
+    assert records["lipid"]["total_cholesterol"]["result"] == "210"
+    assert records["lipid"]["hdl_cholesterol"]["result"] == "45"
+
+
+def test_a_later_result_never_overwrites_a_field():
+    mapper, records = export([
+        "1001,DELA CRUZ JUAN,A1,WBC,7.2,x10^9/L,5.0-10.0",
+        "1001,DELA CRUZ JUAN,A1,WBC Count,9.9,x10^9/L,5.0-10.0",
+    ], report_type="cbc")
+    assert records["cbc"]["wbc"]["result"] == "7.2"
+    assert mapper.summary()["repeatedTests"] == {"WBC Count": 1}
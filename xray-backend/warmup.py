@@ -0,0 +1,229 @@
+import threading
+import time
+import traceback
+from typing import Callable, Dict, Iterable, Optional
+
+import fitz  # PyMuPDF
+
+from pattern_stats import pattern_stats
+
+
+# Minimal text per report type, laid out like the real lab/clinic PDFs so the
+# parsers walk (and compile) the same regex paths as a real upload.
+SAMPLE_TEXTS = {
+    "xray": """X-RAY REPORT
+Patient's Name
+: WARMUP, SAMPLE
+Age: 30
+Date of Birth
+: Jan-01-1995
+Gender: MALE
+Company
+: WARMUP
+Examination
+: CHEST PA
+Interpretation
+: The heart is not enlarged.
+Impression
+: NORMAL CHEST.""",
+    "cbc": """COMPLETE BLOOD COUNT
+RBC Count
+4.80
+X10^6/uL
+4.5 - 5.1
+Hemoglobin
+13.5
+g/dL
+12.3 - 15.3
+WBC Count
+6.2
+X10^3/uL
+4.4 - 11.0
+   Neutrophil
+55
+%
+44 - 68
+           Total :
+100
+WBC Absolute Count
+   Neutrophil
+2.5
+#
+1.8 - 7.0
+MEDICAL TECHNOLOGIST
+Name
+: SAMPLE WARMUP
+Gender / Age
+: FEMALE / 30Y""",
+    "urinalysis": """Name
+SAMPLE WARMUP
+Gender / Age
+FEMALE / 30 Y
+Yellow
+Color
+1.005
+Specific Gravity
+6.0
+PH
+0.2 - 1.0
+EU/dL
+0.2
+Urobilinogen
+0.0 - 2.0
+/hpf
+0.0
+RBC
+/hpf
+0.2 RARE
+Epithelial Cells
+Hyaline Cast
+!
+Remarks:""",
+    "lipid": """ALT/SGPT
+21.0
+U/L
+4.0 - 36.0
+Cholesterol (Total)
+165.00
+mg/dL
+150 - 200
+Triglycerides
+68.00
+mg/dL
+10 - 190
+Cholesterol HDL
+H
+84.0
+mg/dL
+40.0 - 75.0
+Cholesterol LDL
+67.4
+mg/dL
+50 - 130
+VLDL
+L
+13.60
+mg/dL
+20 - 30
+Name
+: SAMPLE WARMUP
+Gender / Age
+: FEMALE / 30Y""",
+    "ecg": """12-LEAD ELECTROCARDIOGRAM REPORT
+PID No: 100000000000
+Date: 01-JAN-2025
+Patient's Name: SAMPLE WARMUP
+Age/Sex: 30/F
+Referring Physician: APE
+Birth date: 01-JAN-1995
+HR:
+65
+bpm
+QRS
+86
+ms
+PR
+162
+ms
+INTERPRETATION:
+Sinus rhythm within normal limits
+SAMPLE WARMUP, MD""",
+    "medical": """PATIENT NAME: SAMPLE WARMUP PID: 100000000000
+DATE OF BIRTH: 01/01/1995 AGE: 30 SEX: FEMALE
+CIVIL STATUS: SINGLE
+COMPANY: WARMUP OCCUPATION: NURSE
+PRESENT ILLNESS: NONE ALLERGY:
+[ ] Hypertension
+Blood Pressure 110/70 Pulse 72 Spo2 98 Resp 18 TEMP 36.5
+HEIGHT: 160 WEIGHT: 55.0 BMI: 21.48 IBW: 54.0
+ADEQUATE: ADEQUATE OD=20 OS=20
+Complete Blood Count Unremarkable
+RECOMMENDATIONS: FIT
+Class A - Medically Fit
+Remarks: none
+Date of Initial PEME: 01/01/2025""",
+    "chem": """Fasting Blood Sugar
+90.0
+mg/dL
+70.0 - 110.0
+CREATININE 0.60 mg/dL 0.60 - 1.20
+NAME : SAMPLE WARMUP
+GENDER : FEMALE
+AGE : 30""",
+}
+
+
+def build_sample_pdf(text: str) -> bytes:
+    """Render sample text into a one-page PDF in memory."""
+    with fitz.open() as pdf:
+        page = pdf.new_page()
+        page.insert_text((36, 36), text, fontsize=7)
+        return pdf.tobytes()
+
+
+class WarmupState:
+    """Readiness of this instance, reported by /readyz."""
+
+    def __init__(self):
+        self.ready = False
+        self.started_at = None
+        self.finished_at = None
+        self.timings: Dict[str, float] = {}
+        self.error = ""
+        self._lock = threading.Lock()
+
+    def as_dict(self) -> Dict:
+        with self._lock:
+            timings = dict(self.timings)
+            return {
+                "status": "ready" if self.ready else ("failed" if self.error else "warming"),
+                "timings_ms": {key: round(value * 1000, 2) for key, value in timings.items()},
+                "error": self.error,
+            }
+
+
+def warm_up(state: WarmupState, report_types: Iterable[str], parse: Callable[[bytes, str, str], Dict],
+            warm_workers: Optional[Callable[[bytes], int]] = None) -> None:
+    """
+    Pay the cold-start costs before taking traffic: PyMuPDF's first document
+    in every extraction worker (warm_workers), and the first compilation of
+    every parser regex (kept in re's cache). parse(content, report_type,
+    filename) is the upload path's extract-and-parse, page layout and lab
+    templates included. The sample lookups are kept out of the pattern stats.
+    """
+    state.started_at = time.perf_counter()
+    try:
+        start = time.perf_counter()
+        samples = {report_type: build_sample_pdf(text) for report_type, text in SAMPLE_TEXTS.items()}
+        state.timings["pymupdf_init"] = time.perf_counter() - start
+
+        if warm_workers is not None:
+            start = time.perf_counter()
+            warmed = warm_workers(samples["cbc"])
+            state.timings["pdf_workers"] = time.perf_counter() - start
+            print(f"[WARMUP] {warmed} PDF workers warm")
+
+        with pattern_stats.paused():
+            for report_type in report_types:
+                start = time.perf_counter()
+                parse(samples[report_type], report_type, f"warmup_{report_type}.pdf")
+                state.timings[f"parse_{report_type}"] = time.perf_counter() - start
+
+        state.finished_at = time.perf_counter()
+        state.timings["warmup_total"] = state.finished_at - state.started_at
+        with state._lock:
+            state.ready = True
+        print(f"[WARMUP] Ready in {state.timings['warmup_total'] * 1000:.1f} ms")
+    except Exception as e:
+        traceback.print_exc()
+        with state._lock:
+            state.error = str(e)
+
+
+def start_warmup(state: WarmupState, report_types: Iterable[str], parse: Callable[[bytes, str, str], Dict],
+                 warm_workers: Optional[Callable[[bytes], int]] = None) -> threading.Thread:
+    """Warm up in the background so /healthz answers immediately."""
+    thread = threading.Thread(target=warm_up, args=(state, list(report_types), parse, warm_workers),
+                              name="warmup", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,173 @@
+import json
+import math
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import fitz  # PyMuPDF
+import numpy as np
+
+from blob_store import BlobStore
+from pdf_documents import DocumentPool, open_pdf
+
+
+TILE_SIZE = int(os.getenv("XRAY_TILE_SIZE", "256"))
+TILE_QUALITY = int(os.getenv("XRAY_TILE_QUALITY", "85"))
+TILE_FORMAT = "jpg"
+TILES_SUFFIX = "_tiles"
+MANIFEST_NAME = "manifest.json"
+
+# What counts as a radiograph among a report's images: big enough to be worth
+# zooming into, and mostly dark. The letterhead is also a full-page image but
+# nearly white; signatures and logos are small.
+MIN_FILM_PX = int(os.getenv("XRAY_MIN_FILM_PX", "512"))
+MAX_FILM_BRIGHTNESS = float(os.getenv("XRAY_MAX_FILM_BRIGHTNESS", "200"))
+# Concurrent store.put calls while a pyramid is written (S3 puts are mostly waiting)
+TILE_WRITERS = int(os.getenv("XRAY_TILE_WRITERS", "8"))
+
+# Pyramids are written one after the other, in upload order, off the upload request
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tiles")
+_puts = ThreadPoolExecutor(max_workers=TILE_WRITERS, thread_name_prefix="tile-put")
+
+
+def tiles_prefix(pdf_key: str) -> str:
+    return os.path.splitext(pdf_key)[0] + TILES_SUFFIX
+
+
+def _image_pixels(pdf: fitz.Document, xref: int) -> np.ndarray:
+    """Image as an (height, width, 1 or 3) uint8 array, without alpha."""
+    pixmap = fitz.Pixmap(pdf, xref)
+    if pixmap.alpha:
+        pixmap = fitz.Pixmap(pixmap, 0)
+    if pixmap.colorspace is None or pixmap.colorspace.n not in (1, 3):
+        pixmap = fitz.Pixmap(fitz.csRGB, pixmap)
+    return np.frombuffer(pixmap.samples, np.uint8).reshape(pixmap.height, pixmap.width, pixmap.n).copy()
+
+
+def find_radiographs(pdf: fitz.Document) -> List[Tuple[int, int, np.ndarray]]:
+    """(page number, xref, pixels) of every embedded image that looks like a film."""
+    films, seen = [], set()
+    for page in pdf:
+        for image in page.get_images(full=True):
+            xref, width, height = image[0], image[2], image[3]
+            if xref in seen or min(width, height) < MIN_FILM_PX:
+                continue
+            seen.add(xref)
+            pixels = _image_pixels(pdf, xref)
+            if pixels.mean() <= MAX_FILM_BRIGHTNESS:
+                films.append((page.number, xref, pixels))
+    return films
+
+
+def _halve(pixels: np.ndarray) -> np.ndarray:
+    """Next pyramid level: 2x2 averages, rounding odd sizes up as Deep Zoom does."""
+    height, width = pixels.shape[:2]
+    padded = np.pad(pixels, ((0, height % 2), (0, width % 2), (0, 0)), mode="edge").astype(np.uint16)
+    halved = (padded[0::2, 0::2] + padded[1::2, 0::2] + padded[0::2, 1::2] + padded[1::2, 1::2] + 2) // 4
+    return halved.astype(np.uint8)
+
+
+def _encode_tile(tile: np.ndarray) -> bytes:
+    colorspace = fitz.csGRAY if tile.shape[2] == 1 else fitz.csRGB
+    height, width = tile.shape[:2]
+    pixmap = fitz.Pixmap(colorspace, width, height, np.ascontiguousarray(tile).tobytes(), 0)
+    return pixmap.tobytes(TILE_FORMAT, jpg_quality=TILE_QUALITY)
+
+
+def build_pyramid(pixels: np.ndarray, prefix: str, tile_size: int = TILE_SIZE) -> Tuple[Dict, List[Tuple[str, bytes]]]:
+    """
+    Deep Zoom layout: level L is the image scaled by 1 / 2^(max_level - L),
+    so the last level is full resolution and level 0 a single pixel; each
+    level is cut into tile_size squares keyed <prefix>/L/col_row.jpg.
+    Returns the image info and the encoded (key, tile) pairs.
+    """
+    height, width = pixels.shape[:2]
+    max_level = math.ceil(math.log2(max(width, height)))
+    level_pixels = pixels
+    tiles = []
+    for level in range(max_level, -1, -1):
+        level_height, level_width = level_pixels.shape[:2]
+        for row in range(math.ceil(level_height / tile_size)):
+            for col in range(math.ceil(level_width / tile_size)):
+                tile = level_pixels[row * tile_size:(row + 1) * tile_size, col * tile_size:(col + 1) * tile_size]
+                tiles.append((f"{prefix}/{level}/{col}_{row}.{TILE_FORMAT}", _encode_tile(tile)))
+        if level:
+            level_pixels = _halve(level_pixels)
+
+    info = {
+        "width": width,
+        "height": height,
+        "tileSize": tile_size,
+        "overlap": 0,
+        "format": TILE_FORMAT,
+        "levels": max_level + 1,
+        "tiles": len(tiles),
+    }
+    return info, tiles
+
+
+def cut_pyramids(content: bytes, prefix: str) -> Tuple[List[Dict], List[Tuple[str, bytes]]]:
+    """The pyramid of every radiograph in an X-ray report; runs in an extraction worker."""
+    images, tiles = [], []
+    with open_pdf(content=content) as pdf:
+        for index, (page_number, xref, pixels) in enumerate(find_radiographs(pdf)):
+            info, image_tiles = build_pyramid(pixels, f"{prefix}/{index}")
+            info.update({"index": index, "page": page_number + 1})
+            images.append(info)
+            tiles.extend(image_tiles)
+    return images, tiles
+
+
+def build_pyramids(store: BlobStore, pdf_key: str, content: bytes, pool: DocumentPool) -> Future:
+    """
+    Cut every radiograph of a stored X-ray report into a tile pyramid under
+    <name>_tiles/<n>/ (in the pool's workers), then write it in the
+    background, replacing the tiles of an earlier upload of the file. The
+    manifest is written last, so viewers never see a half-built pyramid.
+    Returns the future of the write, which resolves to the manifest.
+    """
+    start = time.perf_counter()
+    prefix = tiles_prefix(pdf_key)
+    images, tiles = pool.run(cut_pyramids, content, prefix)
+    return _writer.submit(_write_pyramids, store, pdf_key, prefix, images, tiles, start)
+
+
+def _write_pyramids(store: BlobStore, pdf_key: str, prefix: str, images: List[Dict],
+                    tiles: List[Tuple[str, bytes]], start: float) -> Dict:
+    try:
+        old_keys = set(store.list(prefix + "/"))
+        list(_puts.map(lambda tile: store.put(tile[0], tile[1], "image/jpeg"), tiles))
+
+        manifest = {"images": images, "builtAt": time.time()}
+        manifest_key = f"{prefix}/{MANIFEST_NAME}"
+        if images:
+            store.put(manifest_key, json.dumps(manifest).encode("utf-8"), "application/json")
+        else:
+            store.delete(manifest_key)
+        # Tiles of the earlier upload that this pyramid did not overwrite
+        new_keys = {manifest_key} if images else set()
+        new_keys.update(key for key, _ in tiles)
+        list(_puts.map(store.delete, old_keys - new_keys))
+    except Exception as e:
+        print(f"[TILES ERROR] {os.path.basename(pdf_key)}: {str(e)}")
+        raise
+
+    print(f"[TILES] {os.path.basename(pdf_key)}: {len(images)} radiograph(s), "
+          f"{len(tiles)} tiles in {(time.perf_counter() - start) * 1000:.0f} ms")
+    return manifest
+
+
+def read_manifest(store: BlobStore, pdf_key: str) -> Optional[Dict]:
+    data = store.get(f"{tiles_prefix(pdf_key)}/{MANIFEST_NAME}")
+    return json.loads(data) if data is not None else None
+
+
+def dzi_xml(image: Dict) -> str:
+    """Deep Zoom descriptor, for viewers such as OpenSeadragon."""
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" '
+        f'Format="{image["format"]}" Overlap="{image["overlap"]}" TileSize="{image["tileSize"]}">'
+        f'<Size Width="{image["width"]}" Height="{image["height"]}"/></Image>'
+    )